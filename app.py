@@ -1,16 +1,34 @@
 import streamlit as st
 import requests
-import re
-import cloudinary
-import cloudinary.uploader
-import google.generativeai as genai
 import os
+import re
+import io
 import asyncio
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from chrome_extractor import HybridExtractor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import article_url
+import cache_store
+import clients
+import dedup_index
+import firecrawl_client
+import image_optimizer
+import markdown_scanner
+import pipeline
+import prompt_compactor
+import rewrite_validator
+import stage_scheduler
+from deadline import Deadline, DeadlineExceeded
+from history_store import HistoryStore
+from single_flight import SingleFlight
 
 
-def get_content_with_fallback(url: str, firecrawl_key: str, use_chrome_fallback: bool = True) -> str:
+def get_content_with_fallback(url: str, firecrawl_key: str, use_chrome_fallback: bool = True,
+                              fast_load: bool = True, deadline: Deadline = None) -> str:
     """
     使用混合提取器获取内容，优先Firecrawl，失败后使用Chrome DevTools MCP
     
@@ -18,13 +36,18 @@ def get_content_with_fallback(url: str, firecrawl_key: str, use_chrome_fallback:
         url: 文章URL
         firecrawl_key: Firecrawl API密钥
         use_chrome_fallback: 是否在Firecrawl失败时使用Chrome DevTools MCP
+        fast_load: Chrome降级时是否使用快速加载模式（拦截非文档资源，正文出现即提取）
+        deadline: 单篇处理时限，各提取方式的超时不超过剩余时间
         
     Returns:
         提取的Markdown文本
     """
+    # 延迟导入，避免拖慢应用冷启动
+    from chrome_extractor import HybridExtractor
+    
     try:
         # 创建混合提取器
-        extractor = HybridExtractor(firecrawl_api_key=firecrawl_key)
+        extractor = HybridExtractor(firecrawl_api_key=firecrawl_key, fast_load=fast_load)
         
         # 在Streamlit中运行异步代码
         loop = asyncio.new_event_loop()
@@ -32,7 +55,7 @@ def get_content_with_fallback(url: str, firecrawl_key: str, use_chrome_fallback:
         
         try:
             content = loop.run_until_complete(
-                extractor.extract_content(url, use_chrome_fallback)
+                extractor.extract_content(url, use_chrome_fallback, deadline)
             )
             return content
         finally:
@@ -42,13 +65,14 @@ def get_content_with_fallback(url: str, firecrawl_key: str, use_chrome_fallback:
         raise Exception(f"内容提取失败: {str(e)}")
 
 
-def get_content_from_firecrawl(url: str, api_key: str) -> str:
+def get_content_from_firecrawl(url: str, api_key: str, timeout: float = 30) -> str:
     """
-    接收一个URL，调用Firecrawl的scrape API，并返回干净的Markdown文本。
+    接收一个URL，调用Firecrawl的scrape API，并返回干净的正文Markdown文本。
     
     Args:
         url: 必须是一个非空的、格式合法的URL字符串
         api_key: Firecrawl API密钥
+        timeout: 请求超时秒数
         
     Returns:
         成功时返回从Firecrawl API获取到的Markdown文本
@@ -57,35 +81,291 @@ def get_content_from_firecrawl(url: str, api_key: str) -> str:
         requests.exceptions.RequestException: 如果网络请求失败
         ValueError: 如果API返回的数据格式不正确或包含错误信息
     """
-    if not api_key:
-        raise ValueError("Firecrawl API Key未配置")
+    try:
+        # 只请求正文Markdown，复用连接池
+        return firecrawl_client.scrape(url, api_key, timeout)
+    except requests.exceptions.RequestException as e:
+        raise requests.exceptions.RequestException(f"网络请求失败: {str(e)}")
+
+
+def get_content_from_static_html(url: str, deadline: Deadline = None) -> str:
+    """
+    公众号文章直接请求页面并解析静态HTML中的正文。
     
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    payload = {"url": url}
+    Args:
+        url: 文章URL
+        deadline: 单篇处理时限，请求超时不超过剩余时间
+    
+    Returns:
+        提取的Markdown文本；不是公众号链接、遇到验证页或正文为空时返回空字符串，由调用方降级到Firecrawl
+    """
+    # 延迟导入，避免拖慢应用冷启动
+    from chrome_extractor import StaticHtmlExtractor
     
+    if not StaticHtmlExtractor.supports(url):
+        return ""
     try:
-        response = requests.post(
-            "https://api.firecrawl.dev/v0/scrape",
-            json=payload,
-            headers=headers,
-            timeout=30
-        )
-        response.raise_for_status()
+        extractor = StaticHtmlExtractor()
+        return extractor.extract(url, (deadline or Deadline()).timeout(extractor.timeout))
+    except Exception as e:
+        print(f"{e}，改用Firecrawl提取")
+        return ""
+
+
+# 同一篇文章的并发提取和相同原文、指令的并发改写在进程内只执行一次
+_extract_flight = SingleFlight()
+_rewrite_flight = SingleFlight()
+
+
+# 排队中的预取：{缓存键: 事件}，提交时等待同一次预取则设置事件，预取改到交互通道排队
+_prefetch_promotions = {}
+_prefetch_promotions_lock = threading.Lock()
+
+
+class _PrefetchFailed(Exception):
+    """预先提取失败；原始异常为__cause__，用于区分合并等待到的是否是预取的失败"""
+
+
+def _promote_prefetched(cache: cache_store.DiskCache, key: str):
+    """把预先提取的结果转为正式的提取缓存，返回其内容；没有预取结果时返回None"""
+    content = cache.get(cache_store.PREFETCH, key)
+    if content is not None:
+        cache.set(cache_store.EXTRACT, key, content, ttl=cache_store.EXTRACT_TTL)
+        cache.delete(cache_store.PREFETCH, key)
+    return content
+
+
+def extract_article(url: str, firecrawl_key: str, use_chrome_fallback: bool = True, use_cache: bool = True,
+                    fast_load: bool = True, deadline: Deadline = None, speculative: bool = False) -> str:
+    """
+    提取文章内容，结果写入磁盘缓存，多个会话和工作进程共享。
+    
+    URL先规范化，带不同跟踪参数的同一篇文章共用缓存；多个会话同时提取同一篇文章时共享一次提取。
+    
+    Args:
+        url: 文章URL
+        firecrawl_key: Firecrawl API密钥
+        use_chrome_fallback: 是否在Firecrawl失败时使用Chrome DevTools MCP
+        use_cache: 是否读取缓存；为False时强制重新提取（结果仍会写入缓存）
+        fast_load: Chrome降级时是否使用快速加载模式
+        deadline: 单篇处理时限，为None时不限制
+        speculative: 是否为输入链接后的预先提取；结果只在缓存中短期保留，
+            用户提交时才转为正式的提取缓存
         
-        data = response.json()
-        if data.get("success") and "markdown" in data.get("data", {}):
-            return data["data"]["markdown"]
+    Returns:
+        提取的Markdown文本
+    """
+    deadline = deadline or Deadline()
+    url = article_url.canonicalize(url)
+    cache = cache_store.get_cache()
+    key = cache_store.make_key(url)
+    if use_cache:
+        cached = cache.get(cache_store.EXTRACT, key)
+        if cached is None:
+            cached = cache.get(cache_store.PREFETCH, key) if speculative else _promote_prefetched(cache, key)
+        if cached is not None:
+            return cached
+    
+    def _extract():
+        # 与批量任务共享提取服务的并发，按调度通道排队；预取不一定会被提交，走批量通道，不与真实请求争抢
+        lane, promote = (stage_scheduler.BATCH, threading.Event()) if speculative else (None, None)
+        if promote is not None:
+            with _prefetch_promotions_lock:
+                _prefetch_promotions[key] = promote
+        try:
+            with stage_scheduler.get_scheduler().slot("extract", lane=lane, deadline=deadline, promote=promote):
+                if use_chrome_fallback:
+                    content = get_content_with_fallback(url, firecrawl_key, use_chrome_fallback, fast_load, deadline)
+                else:
+                    content = get_content_from_static_html(url, deadline)
+                    if not content:
+                        deadline.check("内容提取")
+                        content = get_content_from_firecrawl(url, firecrawl_key, deadline.timeout(30))
+        except Exception as e:
+            if speculative:
+                raise _PrefetchFailed(str(e)) from e
+            raise
+        finally:
+            if promote is not None:
+                with _prefetch_promotions_lock:
+                    _prefetch_promotions.pop(key, None)
+        if speculative:
+            cache.set(cache_store.PREFETCH, key, content, ttl=cache_store.PREFETCH_TTL)
         else:
-            raise ValueError(f"Firecrawl API返回错误: {data.get('error', '未知错误')}")
+            cache.set(cache_store.EXTRACT, key, content, ttl=cache_store.EXTRACT_TTL)
+        return content
+    
+    if not speculative:
+        # 提交时预取可能还在批量通道排队，改到交互通道，提交不必排在批量任务之后
+        with _prefetch_promotions_lock:
+            promote = _prefetch_promotions.get(key)
+        if promote is not None:
+            promote.set()
+    try:
+        content = _extract_flight.do(key, _extract)
+    except _PrefetchFailed as e:
+        if speculative:
+            raise e.__cause__
+        # 等待的是预取发起的提取：预取的时限从输入链接时开始计算，它的失败不代表本次提交也会失败，重新提取一次
+        content = _extract_flight.do(key, _extract)
+    if not speculative:
+        # 提交时正好在等待同一篇文章的预取，结果写在预取缓存中
+        _promote_prefetched(cache, key)
+    return content
+
+
+@st.cache_resource
+def get_prefetch_executor() -> ThreadPoolExecutor:
+    """进程内共享的预取线程池，限制同时进行的预先提取数量"""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+
+
+def prefetch_article():
+    """
+    url_input的on_change回调：输入链接后立即在后台提取正文，用户挑选改写指令时提取已在进行。
+    点击处理时直接命中预取结果，或通过请求合并等待同一次提取完成；用户没有提交时预取结果很快过期
+    """
+    url = (st.session_state.get("url_input") or "").strip()
+    if not url.startswith(("http://", "https://")):
+        return
+    # 关闭缓存复用时提交会重新提取，预取没有意义
+    if not getattr(st.session_state, 'prefetch_enabled', True) or not getattr(st.session_state, 'use_cache', True):
+        return
+    
+    job = build_session_job(url)
+    
+    def _prefetch():
+        try:
+            extract_article(job["url"], job["firecrawl_key"], job["use_chrome_fallback"], True,
+                            job["chrome_fast_load"], Deadline(job["deadline_seconds"]), speculative=True)
+        except Exception as e:
+            print(f"预先提取失败 {job['url']}: {e}")
+    
+    get_prefetch_executor().submit(_prefetch)
+
+
+def upload_images_to_cloudinary(image_urls: list, cloud_name: str, api_key: str, api_secret: str,
+                                optimize: bool = False, max_width: int = image_optimizer.DEFAULT_MAX_WIDTH,
+                                image_format: str = "webp", quality: int = image_optimizer.DEFAULT_QUALITY,
+                                deadline: Deadline = None, on_image=None) -> dict:
+    """
+    将一组图片上传到Cloudinary，返回原链接到新链接的映射。
+    
+    Args:
+        image_urls: 图片URL列表，可以包含重复项
+        cloud_name: Cloudinary云名称
+        api_key: Cloudinary API密钥
+        api_secret: Cloudinary API密钥
+        optimize: 是否在上传前进行本地缩放、转码和元数据清理
+        max_width: 预处理时的最大图片宽度
+        image_format: 预处理的目标格式，webp或jpeg
+        quality: 预处理的目标压缩质量
+        deadline: 图片转存的时限；时限已到时跳过预处理和剩余图片的上传
+        on_image: 每张图片处理完（复用缓存、上传成功或失败）后调用 on_image(原URL, 新URL或None, 已完成数, 总数)
+        
+    Returns:
+        {原图片URL: Cloudinary secure_url}，上传失败或因时限跳过的图片不会出现在结果中
+        
+    Raises:
+        ValueError: 如果Cloudinary配置不完整
+    """
+    # 按凭据复用客户端，不修改Cloudinary全局配置，并发会话互不干扰
+    client = clients.get_cloudinary_client(cloud_name, api_key, api_secret)
+    deadline = deadline or Deadline()
+    
+    image_urls = list(dict.fromkeys(image_urls))
+    if not image_urls:
+        return {}
+    
+    # 已转存过的图片直接复用缓存中的链接
+    cache = cache_store.get_cache()
+    cache_keys = {
+        url: cache_store.make_key(cloud_name, url, optimize, max_width, image_format, quality)
+        for url in image_urls
+    }
+    total = len(image_urls)
+    uploaded = {}
+    for url in image_urls:
+        cached_url = cache.get(cache_store.IMAGE, cache_keys[url])
+        if cached_url:
+            uploaded[url] = cached_url
+            if on_image:
+                on_image(url, cached_url, len(uploaded), total)
+    if uploaded:
+        st.info(f"♻️ {len(uploaded)} 张图片此前已转存，直接复用")
+    image_urls = [url for url in image_urls if url not in uploaded]
+    
+    if not image_urls:
+        return uploaded
+    
+    # 与批量任务共享Cloudinary的并发，按调度通道排队；排队期间时限已到时全部保留原链接
+    scheduler = stage_scheduler.get_scheduler()
+    try:
+        slot_id = scheduler.acquire("images", deadline=deadline)
+    except DeadlineExceeded:
+        st.warning(f"⏰ 处理时限将到，跳过 {len(image_urls)} 张图片的转存，保留原链接")
+        return uploaded
+    
+    try:
+        # 可选：上传前在本地进程池中预处理图片
+        optimized_images = {}
+        if optimize and image_urls and not deadline.expired():
+            if image_optimizer.is_available():
+                optimized_images = image_optimizer.optimize_images(
+                    image_urls,
+                    max_width=max_width,
+                    image_format=image_format,
+                    quality=quality,
+                    timeout=deadline.timeout(30),
+                    deadline=deadline
+                )
+                savings = image_optimizer.summarize_savings(optimized_images)
+                st.info(
+                    f"📉 图片预处理: {savings['count']} 张, "
+                    f"{savings['original_bytes'] / 1024:.1f} KB → {savings['optimized_bytes'] / 1024:.1f} KB, "
+                    f"节省 {savings['saved_percent']:.1f}%"
+                )
+            else:
+                st.warning("⚠️ 未安装Pillow，跳过图片预处理")
+        
+        for position, url in enumerate(image_urls):
+            if deadline.expired():
+                # 时限已到：剩余图片保留原链接，保证改写阶段还有时间完成
+                st.warning(f"⏰ 处理时限将到，跳过剩余 {len(image_urls) - position} 张图片的转存，保留原链接")
+                break
+            try:
+                # 预处理成功时上传处理后的字节，否则由Cloudinary直接拉取原图
+                optimized = optimized_images.get(url)
+                source = io.BytesIO(optimized["data"]) if optimized and optimized["data"] else url
+                
+                # 上传图片到Cloudinary
+                upload_result = client.upload(
+                    source,
+                    folder="wechat_articles",
+                    timeout=deadline.timeout(30)
+                )
+                new_url = upload_result.get("secure_url")
+                
+                if new_url:
+                    uploaded[url] = new_url
+                    cache.set(cache_store.IMAGE, cache_keys[url], new_url)
+                    st.success(f"✅ 图片上传成功: {url}")
+                    
+            except Exception as e:
+                st.warning(f"⚠️ 图片上传失败 {url}: {str(e)}")
             
-    except requests.exceptions.RequestException as e:
-        raise requests.exceptions.RequestException(f"网络请求失败: {str(e)}")
+            if on_image:
+                on_image(url, uploaded.get(url), total - len(image_urls) + position + 1, total)
+    finally:
+        scheduler.release(slot_id)
+    
+    return uploaded
 
 
-def process_images_with_cloudinary(markdown_text: str, cloud_name: str, api_key: str, api_secret: str) -> str:
+def process_images_with_cloudinary(markdown_text: str, cloud_name: str, api_key: str, api_secret: str,
+                                   optimize: bool = False, max_width: int = image_optimizer.DEFAULT_MAX_WIDTH,
+                                   image_format: str = "webp", quality: int = image_optimizer.DEFAULT_QUALITY,
+                                   deadline: Deadline = None, on_image=None) -> str:
     """
     接收Markdown文本，查找所有图片链接，将图片上传到Cloudinary，并用新链接替换旧链接。
     
@@ -94,6 +374,12 @@ def process_images_with_cloudinary(markdown_text: str, cloud_name: str, api_key:
         cloud_name: Cloudinary云名称
         api_key: Cloudinary API密钥
         api_secret: Cloudinary API密钥
+        optimize: 是否在上传前进行本地缩放、转码和元数据清理
+        max_width: 预处理时的最大图片宽度
+        image_format: 预处理的目标格式，webp或jpeg
+        quality: 预处理的目标压缩质量
+        deadline: 图片转存的时限，时限已到时剩余图片保留原链接
+        on_image: 每张图片处理完后的回调，参数同upload_images_to_cloudinary
         
     Returns:
         返回处理后的Markdown文本。如果原文中没有图片，则原样返回
@@ -101,50 +387,248 @@ def process_images_with_cloudinary(markdown_text: str, cloud_name: str, api_key:
     Raises:
         cloudinary.exceptions.Error: 如果上传到Cloudinary失败
     """
-    # 配置Cloudinary
-    cloudinary.config(
-        cloud_name=cloud_name,
-        api_key=api_key,
-        api_secret=api_secret
-    )
-    
     if not all([cloud_name, api_key, api_secret]):
         raise ValueError("Cloudinary配置未完成")
     
-    # 查找所有Markdown图片链接
-    image_urls = re.findall(r"!\[.*?\]\((.*?)\)", markdown_text)
-    if not image_urls:
+    # 查找所有图片（内联、引用式和<img>标签），同一URL只上传一次
+    spans = markdown_scanner.scan(markdown_text)
+    if not spans:
         return markdown_text
     
-    processed_text = markdown_text
-    for url in image_urls:
+    uploaded = upload_images_to_cloudinary(
+        markdown_scanner.unique_urls(spans), cloud_name, api_key, api_secret,
+        optimize=optimize, max_width=max_width, image_format=image_format, quality=quality, deadline=deadline,
+        on_image=on_image
+    )
+    
+    # 按扫描到的位置替换，正文中恰好出现的相同文字不受影响
+    return markdown_scanner.replace_urls(markdown_text, uploaded, spans)
+
+
+IMAGE_TOKEN_PREFIX = "https://img.placeholder.local/"
+
+
+def tokenize_image_urls(markdown_text: str) -> tuple:
+    """
+    将Markdown中的图片链接替换为稳定的占位链接，使改写可以在图片上传完成前开始。
+    
+    占位链接仍是合法URL，模型会像对待普通图片链接一样原样保留。
+    
+    Args:
+        markdown_text: 原始Markdown文本
+        
+    Returns:
+        (替换后的文本, {占位链接: 原图片URL})
+    """
+    spans = markdown_scanner.scan(markdown_text)
+    url_to_token = {
+        url: f"{IMAGE_TOKEN_PREFIX}img_{index:04d}"
+        for index, url in enumerate(markdown_scanner.unique_urls(spans), start=1)
+    }
+    token_map = {token: url for url, token in url_to_token.items()}
+    return markdown_scanner.replace_urls(markdown_text, url_to_token, spans), token_map
+
+
+def restore_image_tokens(markdown_text: str, token_map: dict, uploaded: dict = None) -> str:
+    """
+    将占位链接替换为最终图片链接。
+    
+    Args:
+        markdown_text: 包含占位链接的文本（通常是改写结果）
+        token_map: tokenize_image_urls返回的映射
+        uploaded: {原图片URL: Cloudinary secure_url}，上传失败的图片回退到原链接
+        
+    Returns:
+        替换后的Markdown文本
+    """
+    uploaded = uploaded or {}
+    # 先替换较长的占位符，避免img_0001误伤img_00010之类的前缀
+    for token in sorted(token_map, key=len, reverse=True):
+        original_url = token_map[token]
+        markdown_text = markdown_text.replace(token, uploaded.get(original_url, original_url))
+    return markdown_text
+
+
+# 探测模型是否可用的单次请求超时（秒），有处理时限时不超过剩余时间
+MODEL_PROBE_TIMEOUT = 30
+
+
+def _select_gemini_model(api_key: str, deadline: Deadline = None):
+    """
+    选择一个可用的2.5系列模型。
+    
+    模型绑定到按API Key缓存的客户端，不调用genai.configure()修改全局状态；
+    探测成功的模型名会被记住，同一API Key的后续请求不再重复探测。
+    
+    Args:
+        api_key: Gemini API密钥
+        deadline: 单篇处理时限，探测请求的超时不超过剩余时间
+    
+    Raises:
+        DeadlineExceeded: 如果探测前时限已到
+        Exception: 如果没有可用的模型
+    """
+    deadline = deadline or Deadline()
+    cached_model_name = clients.get_selected_model_name(api_key)
+    
+    # 尝试使用可用的模型 - 只使用Gemini 2.5系列
+    available_models = [cached_model_name] if cached_model_name else ['gemini-2.5-pro', 'gemini-2.5-flash']
+    model = None
+    
+    for model_name in available_models:
+        if model_name == cached_model_name:
+            model = clients.get_gemini_model(api_key, model_name)
+            break
+        deadline.check("模型探测")
         try:
-            # 上传图片到Cloudinary
-            upload_result = cloudinary.uploader.upload(
-                url,
-                folder="wechat_articles",
-                timeout=30
+            candidate = clients.get_gemini_model(api_key, model_name)
+            # 测试模型是否可用
+            test_response = candidate.generate_content(
+                "测试", request_options={"timeout": deadline.timeout(MODEL_PROBE_TIMEOUT)}
             )
-            new_url = upload_result.get("secure_url")
-            
-            if new_url:
-                processed_text = processed_text.replace(url, new_url)
-                st.success(f"✅ 图片上传成功: {url}")
-                
-        except Exception as e:
-            st.warning(f"⚠️ 图片上传失败 {url}: {str(e)}")
+            if test_response.text:
+                model = candidate
+                clients.set_selected_model_name(api_key, model_name)
+                st.success(f"✅ 成功连接到模型: {model.model_name}")
+                break
+        except Exception as model_error:
+            st.warning(f"⚠️ 模型 {model_name} 不可用: {str(model_error)}")
             continue
     
-    return processed_text
+    if not model:
+        raise Exception("无法找到可用的Gemini 2.5系列模型，请检查API密钥是否支持Gemini 2.5")
+    
+    # 显示最终使用的模型信息
+    model_info = f"🤖 **当前使用模型**: {model.model_name}"
+    if "2.5-pro" in model.model_name:
+        model_info += " ⭐ (最强性能版本)"
+    elif "2.5-flash" in model.model_name:
+        model_info += " ⚡ (高速响应版本)"
+    
+    st.info(model_info)
+    return model
+
+
+DEFAULT_REWRITE_INSTRUCTION = """请将以下Markdown格式的文章内容进行改写，使其表达方式更简洁、流畅。
+
+重要规则：
+1. 必须保持原文的Markdown格式不变，包括标题、列表、代码块等。
+2. 必须完整保留原文中所有的图片链接（![]()）。
+3. 不要添加任何与原文无关的评论或内容。
+4. 保持原文的核心观点和信息不变。
+5. 优化句式结构，使表达更加清晰流畅。"""
+
+
+def build_rewrite_instruction(custom_prompt: str = None, placeholder_rule: str = "") -> str:
+    """
+    组装改写指令（不含原文），作为模型的system instruction。
+    
+    同一组指令和附加规则得到的文本完全相同，按其哈希缓存的模型可以在所有文章间复用。
+    
+    Args:
+        custom_prompt: 自定义改写指令，为空时使用默认指令
+        placeholder_rule: 附加的额外规则（例如占位符说明），需自带结尾换行
+        
+    Returns:
+        指令字符串
+    """
+    return f"""{custom_prompt or DEFAULT_REWRITE_INSTRUCTION}
+
+{placeholder_rule}用户消息中分隔线之间的内容是需要改写的原文。
+请直接返回改写后的Markdown内容，不要添加额外说明。
+"""
+
+
+def build_rewrite_content(source_text: str) -> str:
+    """组装每篇文章单独发送的用户消息，只包含原文"""
+    return f"""原文如下：
+---
+{source_text}
+---
+"""
+
+
+def build_rewrite_prompt(source_text: str, custom_prompt: str = None, placeholder_rule: str = "") -> str:
+    """
+    组装指令和原文合在一起的完整prompt，供不使用system instruction的调用方（例如批量改写）使用。
+    
+    Args:
+        source_text: 需要改写的原文
+        custom_prompt: 自定义改写指令，为空时使用默认指令
+        placeholder_rule: 附加在原文之前的额外规则（例如占位符说明），需自带结尾换行
+        
+    Returns:
+        完整的prompt字符串
+    """
+    return f"{build_rewrite_instruction(custom_prompt, placeholder_rule)}\n{build_rewrite_content(source_text)}"
 
 
-def rewrite_with_gemini(markdown_text: str, api_key: str, custom_prompt: str = None) -> str:
+def _generate_with_retry(model, prompt: str, max_retries: int = 3, deadline: Deadline = None,
+                         on_chunk=None) -> str:
+    """
+    调用模型生成内容，失败时重试。有时限时每次请求的超时不超过剩余时间，时限已到时不再重试。
+    
+    传入on_chunk时以流式方式生成，每收到一段文本调用 on_chunk(本段文本, 本次尝试已生成的全文)；
+    重试时已生成的全文从头开始。
+    
+    Raises:
+        DeadlineExceeded: 如果时限已到
+        Exception: 如果重试max_retries次后仍然失败
+    """
+    deadline = deadline or Deadline()
+    # 与批量任务共享Gemini的并发，按调度通道排队
+    with stage_scheduler.get_scheduler().slot("rewrite", deadline=deadline):
+        for attempt in range(max_retries):
+            deadline.check("AI改写")
+            remaining = deadline.remaining()
+            request_options = {"timeout": max(1.0, remaining)} if remaining is not None else None
+            try:
+                if on_chunk:
+                    text = _generate_streaming(model, prompt, request_options, on_chunk)
+                else:
+                    text = model.generate_content(prompt, request_options=request_options).text
+                if text:
+                    return text.strip()
+                else:
+                    raise Exception("Gemini API返回空内容")
+            except Exception as retry_error:
+                if attempt == max_retries - 1:
+                    raise Exception(f"Gemini API重试{max_retries}次后仍然失败: {str(retry_error)}")
+                st.warning(f"⚠️ 第{attempt + 1}次尝试失败，正在重试...")
+                continue
+
+
+def _generate_streaming(model, prompt: str, request_options, on_chunk) -> str:
+    """流式调用模型，逐段回调并返回完整文本"""
+    pieces = []
+    for chunk in model.generate_content(prompt, stream=True, request_options=request_options):
+        try:
+            text = chunk.text
+        except ValueError:
+            # 只带结束原因、没有文本的分段
+            continue
+        if text:
+            pieces.append(text)
+            on_chunk(text, "".join(pieces))
+    return "".join(pieces)
+
+
+def rewrite_with_gemini(markdown_text: str, api_key: str, custom_prompt: str = None,
+                        compact_prompt: bool = False, use_cache: bool = True, deadline: Deadline = None,
+                        on_chunk=None, section_rule: str = "") -> str:
     """
     接收Markdown文本，并调用Google Gemini API对其进行改写。
     
     Args:
         markdown_text: 待改写的文本内容
         api_key: Gemini API密钥
+        custom_prompt: 自定义改写指令，为空时使用默认指令
+        compact_prompt: 是否将URL和代码块替换为短占位符以减少prompt token，改写后精确还原
+        use_cache: 是否复用相同原文和指令的缓存结果；为False时强制重新改写
+        deadline: 单篇处理时限，Gemini请求的超时不超过剩余时间
+        on_chunk: 流式改写的回调 on_chunk(本段文本, 已生成的全文)，全文中的占位符已还原；
+            命中缓存或等待其他会话的相同改写时不会调用
+        section_rule: 附加在改写指令前的说明，例如分段改写时说明这只是文章的一部分
         
     Returns:
         成功时返回由Gemini API生成的改写后的文本
@@ -155,87 +639,580 @@ def rewrite_with_gemini(markdown_text: str, api_key: str, custom_prompt: str = N
     if not api_key:
         raise ValueError("Gemini API Key未配置")
     
+    cache = cache_store.get_cache()
+    key_parts = [markdown_text, custom_prompt, compact_prompt]
+    if section_rule:
+        # 没有附加说明时不参与缓存键，整篇改写的已有缓存保持有效
+        key_parts.append(section_rule)
+    cache_key = cache_store.make_key(*key_parts)
+    if use_cache:
+        cached = cache.get(cache_store.REWRITE, cache_key)
+        if cached is not None:
+            st.info("♻️ 相同原文和指令此前已改写过，直接复用缓存结果")
+            return cached
+    
+    deadline = deadline or Deadline()
+    while True:
+        if _rewrite_flight.in_flight(cache_key):
+            st.info("⏳ 相同原文和指令正在由其他会话改写，等待共享结果")
+        try:
+            return _rewrite_flight.do(
+                cache_key,
+                lambda: _rewrite_uncached(markdown_text, api_key, custom_prompt, compact_prompt, cache_key, deadline,
+                                          on_chunk, section_rule)
+            )
+        except DeadlineExceeded:
+            # 等待到的可能是其他会话的时限到了；本次请求自己的时限未到时重新改写
+            if deadline.expired():
+                raise
+            st.info("🔁 共享的改写因其他会话的处理时限中止，重新改写")
+
+
+def _rewrite_uncached(markdown_text: str, api_key: str, custom_prompt: str, compact_prompt: bool,
+                      cache_key: str, deadline: Deadline = None, on_chunk=None, section_rule: str = "") -> str:
+    """实际调用Gemini改写并写入缓存，由rewrite_with_gemini在合并并发请求后调用"""
+    cache = cache_store.get_cache()
     try:
-        genai.configure(api_key=api_key)
+        model_name = _select_gemini_model(api_key, deadline).model_name
         
-        # 尝试使用可用的模型 - 只使用Gemini 2.5系列
-        available_models = ['gemini-2.5-pro', 'gemini-2.5-flash']
-        model = None
+        # 可选：压缩prompt中需要原样保留的长片段
+        placeholders = {}
+        source_text = markdown_text
+        placeholder_rule = section_rule
+        if compact_prompt:
+            source_text, placeholders = prompt_compactor.compact(markdown_text)
+            if placeholders:
+                placeholder_rule += f"{prompt_compactor.PLACEHOLDER_RULE}\n\n"
         
-        for model_name in available_models:
-            try:
-                model = genai.GenerativeModel(model_name)
-                # 测试模型是否可用
-                test_response = model.generate_content("测试")
-                if test_response.text:
-                    st.success(f"✅ 成功连接到模型: {model.model_name}")
-                    break
-            except Exception as model_error:
-                st.warning(f"⚠️ 模型 {model_name} 不可用: {str(model_error)}")
-                continue
+        # 指令部分按模板哈希编译为带system instruction的模型并复用，每篇文章只发送原文
+        instruction = build_rewrite_instruction(custom_prompt, placeholder_rule)
+        model = clients.get_instructed_model(api_key, model_name, instruction)
+        content = build_rewrite_content(source_text)
         
-        if not model:
-            raise Exception("无法找到可用的Gemini 2.5系列模型，请检查API密钥是否支持Gemini 2.5")
+        if placeholders:
+            compacted_tokens = prompt_compactor.estimate_tokens(instruction + content)
+            uncompacted_tokens = (
+                compacted_tokens
+                - prompt_compactor.estimate_tokens(source_text + prompt_compactor.PLACEHOLDER_RULE + "\n\n")
+                + prompt_compactor.estimate_tokens(markdown_text)
+            )
+            st.info(
+                f"🗜️ **Prompt压缩**: 约 {uncompacted_tokens} → {compacted_tokens} tokens "
+                f"（替换 {len(placeholders)} 处链接/代码块）"
+            )
         
-        # 显示最终使用的模型信息
-        model_info = f"🤖 **当前使用模型**: {model.model_name}"
-        if "2.5-pro" in model.model_name:
-            model_info += " ⭐ (最强性能版本)"
-        elif "2.5-flash" in model.model_name:
-            model_info += " ⚡ (高速响应版本)"
+        if on_chunk and placeholders:
+            # 预览中显示还原后的链接和代码块
+            stream_chunk = on_chunk
+            on_chunk = lambda text, generated: stream_chunk(text, prompt_compactor.restore(generated, placeholders))
+        rewritten = _generate_with_retry(model, content, deadline=deadline, on_chunk=on_chunk)
+        if placeholders:
+            missing = prompt_compactor.missing_placeholders(rewritten, placeholders)
+            if missing:
+                st.warning(f"⚠️ 改写结果丢失了 {len(missing)} 个占位符: {', '.join(missing[:5])}")
+            rewritten = prompt_compactor.restore(rewritten, placeholders)
+        cache.set(cache_store.REWRITE, cache_key, rewritten)
+        return rewritten
+    
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        raise Exception(f"Gemini API调用失败: {str(e)}")
+
+
+def repair_rewrite_sections(original: str, rewritten: str, api_key: str, custom_prompt: str = None,
+                            deadline: Deadline = None) -> str:
+    """
+    校验改写结果的结构，只重新改写出问题的章节并拼回原位。
+    
+    Args:
+        original: 改写前的Markdown
+        rewritten: 改写后的Markdown
+        api_key: Gemini API密钥
+        custom_prompt: 自定义改写指令
+        deadline: 单篇处理时限；时限已到时跳过修复，来不及重新改写的章节保留当前改写结果
         
-        st.info(model_info)
+    Returns:
+        修复后的Markdown。重新改写后仍不一致的章节回退为原文；
+        如果缺陷无法定位到具体章节（例如标题数量变化），则原样返回rewritten
         
-        # 使用自定义prompt或默认prompt
-        if custom_prompt:
-            prompt = f"""
-{custom_prompt}
+    Raises:
+        Exception: 如果Gemini API调用失败
+    """
+    defects = rewrite_validator.validate(original, rewritten)
+    if not defects:
+        return rewritten
+    
+    for defect in defects:
+        st.warning(f"⚠️ 结构校验: {defect['detail']}")
+    
+    sections = rewrite_validator.defective_sections(defects)
+    if not sections:
+        st.warning("⚠️ 缺陷无法定位到具体章节，保留当前改写结果")
+        return rewritten
+    
+    deadline = deadline or Deadline()
+    if deadline.expired():
+        st.warning("⏰ 处理时限已到，跳过章节修复，保留当前改写结果")
+        return rewritten
+    
+    original_sections = rewrite_validator.split_sections(original)
+    rewritten_sections = rewrite_validator.split_sections(rewritten)
+    
+    section_rule = "以下内容是一篇文章中的一个章节，请只改写这个章节。\n\n"
+    try:
+        model = clients.get_instructed_model(
+            api_key, _select_gemini_model(api_key, deadline).model_name,
+            build_rewrite_instruction(custom_prompt, section_rule)
+        )
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        raise Exception(f"Gemini API调用失败: {str(e)}")
+    
+    repaired = run_concurrently(*[
+        (lambda source: lambda: _generate_with_retry(model, build_rewrite_content(source), deadline=deadline))(
+            original_sections[index]
+        )
+        for index in sections
+    ], return_exceptions=True)
+    
+    for index, text in zip(sections, repaired):
+        if isinstance(text, DeadlineExceeded):
+            st.warning(f"⏰ 处理时限已到，第{index}节保留当前改写结果")
+            continue
+        if isinstance(text, Exception):
+            raise text
+        source = original_sections[index]
+        # 保留原章节结尾的空白，保证与下一个章节之间的分隔不变
+        trailing = source[len(source.rstrip()):]
+        if not source.strip() or rewrite_validator.validate(source, text):
+            st.warning(f"⚠️ 第{index}节重新改写后仍不一致，保留原文")
+            rewritten_sections[index] = source
+        else:
+            rewritten_sections[index] = text.strip() + trailing
+    
+    st.success(f"✅ 已重新改写 {len(sections)} 个章节")
+    return "".join(rewritten_sections)
 
-原文如下：
----
-{markdown_text}
----
 
-请直接返回改写后的Markdown内容，不要添加额外说明。
-"""
-        else:
-            prompt = f"""
-请将以下Markdown格式的文章内容进行改写，使其表达方式更简洁、流畅。
+SEGMENT_CHARS = 20000
+SEGMENT_RULE = "以下内容是一篇长文章中连续的一部分，请只改写这一部分，不要添加开头语或总结。\n\n"
 
-重要规则：
-1. 必须保持原文的Markdown格式不变，包括标题、列表、代码块等。
-2. 必须完整保留原文中所有的图片链接（![]()）。
-3. 不要添加任何与原文无关的评论或内容。
-4. 保持原文的核心观点和信息不变。
-5. 优化句式结构，使表达更加清晰流畅。
 
-原文如下：
----
-{markdown_text}
----
+def rewrite_segmented(markdown_text: str, api_key: str, custom_prompt: str = None, compact_prompt: bool = False,
+                      use_cache: bool = True, repair_structure: bool = True, deadline: Deadline = None,
+                      max_chars: int = SEGMENT_CHARS) -> str:
+    """
+    低内存模式：按章节边界把长文章分段，逐段改写后拼接。
+    
+    原文只按偏移切出当前分段，prompt压缩、结构校验和修复都只作用于这一段，
+    处理超长文章时的内存峰值与分段大小相关，而不是整篇文章的若干倍。
+    
+    Args:
+        markdown_text: 待改写的文本内容
+        api_key: Gemini API密钥
+        custom_prompt: 自定义改写指令
+        compact_prompt: 是否压缩prompt
+        use_cache: 是否复用缓存的改写结果，按分段缓存
+        repair_structure: 是否对每个分段做结构校验和局部修复
+        deadline: 单篇处理时限，所有分段共用
+        max_chars: 每段的字符数上限，单个章节超过上限时独立成段
+        
+    Returns:
+        拼接后的改写结果
+        
+    Raises:
+        Exception: 如果Gemini API调用失败
+    """
+    spans = rewrite_validator.segment_spans(markdown_text, max_chars)
+    # 只有一段时与整篇改写完全相同，共用缓存
+    section_rule = SEGMENT_RULE if len(spans) > 1 else ""
+    if section_rule:
+        st.info(f"✂️ 低内存模式: 按章节分为 {len(spans)} 段依次改写")
+    
+    pieces = []
+    for number, (start, end) in enumerate(spans, 1):
+        segment = markdown_text[start:end]
+        if not segment.strip():
+            pieces.append(segment)
+            continue
+        rewritten = rewrite_with_gemini(segment, api_key, custom_prompt, compact_prompt, use_cache, deadline,
+                                        section_rule=section_rule)
+        if repair_structure:
+            rewritten = repair_rewrite_sections(segment, rewritten, api_key, custom_prompt, deadline)
+        if section_rule:
+            # 保留分段结尾的空白，保证与下一段之间的分隔不变
+            rewritten = rewritten.strip() + segment[len(segment.rstrip()):]
+            st.info(f"✂️ 已改写第 {number}/{len(spans)} 段")
+        pieces.append(rewritten)
+    return "".join(pieces)
 
-请直接返回改写后的Markdown内容，不要添加额外说明。
-"""
+
+def rewrite_variants(markdown_text: str, api_key: str, prompts: dict, compact_prompt: bool = False,
+                     use_cache: bool = True, repair_structure: bool = True, deadline: Deadline = None) -> list:
+    """
+    针对同一原文并发生成多个改写版本。
+    
+    Args:
+        markdown_text: 待改写的文本内容
+        api_key: Gemini API密钥
+        prompts: {版本名称: 改写指令}
+        compact_prompt: 是否压缩prompt
+        use_cache: 是否复用缓存的改写结果
+        repair_structure: 是否对每个版本做结构校验和局部修复
+        deadline: 单篇处理时限，所有版本共用
         
-        # 添加重试机制
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                response = model.generate_content(prompt)
-                if response.text:
-                    return response.text.strip()
-                else:
-                    raise Exception("Gemini API返回空内容")
-            except Exception as retry_error:
-                if attempt == max_retries - 1:
-                    raise Exception(f"Gemini API重试{max_retries}次后仍然失败: {str(retry_error)}")
-                st.warning(f"⚠️ 第{attempt + 1}次尝试失败，正在重试...")
-                continue
-            
+    Returns:
+        与prompts顺序一致的列表，每项包含name、content、latency（秒）和error；
+        单个版本失败不影响其他版本，失败时content为None
+        
+    Raises:
+        Exception: 如果没有可用的Gemini模型
+    """
+    if not api_key:
+        raise ValueError("Gemini API Key未配置")
+    
+    # 先选定模型，避免各版本同时探测模型
+    try:
+        _select_gemini_model(api_key, deadline)
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         raise Exception(f"Gemini API调用失败: {str(e)}")
+    
+    def _rewrite_variant(name, prompt):
+        def _run():
+            started = time.perf_counter()
+            content = rewrite_with_gemini(markdown_text, api_key, prompt, compact_prompt, use_cache, deadline)
+            if repair_structure:
+                content = repair_rewrite_sections(markdown_text, content, api_key, prompt, deadline)
+            return content, time.perf_counter() - started
+        return _run
+    
+    outcomes = run_concurrently(
+        *[_rewrite_variant(name, prompt) for name, prompt in prompts.items()],
+        return_exceptions=True
+    )
+    
+    variants = []
+    for name, outcome in zip(prompts, outcomes):
+        if isinstance(outcome, Exception):
+            variants.append({"name": name, "content": None, "latency": 0.0, "error": str(outcome)})
+        else:
+            content, latency = outcome
+            variants.append({"name": name, "content": content, "latency": latency, "error": None})
+    return variants
+
+
+def run_concurrently(*tasks, return_exceptions: bool = False) -> list:
+    """
+    在线程池中并发执行多个无参可调用对象，并按顺序返回结果。
+    
+    工作线程会挂载当前脚本的运行上下文，因此可以正常调用st.success等输出进度。
+    
+    Args:
+        tasks: 无参可调用对象
+        return_exceptions: 为True时把任务抛出的异常作为结果返回，而不是向上抛出
+        
+    Returns:
+        与tasks顺序一致的结果列表；return_exceptions为False时，任一任务抛出的异常会原样向上抛出
+    """
+    ctx = get_script_run_ctx()
+    
+    def _with_context(task):
+        def _run():
+            if ctx is not None:
+                add_script_run_ctx(threading.current_thread(), ctx)
+            return task()
+        return _run
+    
+    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+        futures = [executor.submit(_with_context(task)) for task in tasks]
+        if not return_exceptions:
+            return [future.result() for future in futures]
+        return [future.exception() or future.result() for future in futures]
+
+
+@st.cache_data(ttl=600, show_spinner=False)
+def check_chrome_mcp_version():
+    """
+    检查Chrome DevTools MCP是否可用。
+    
+    结果缓存10分钟，避免每次页面重跑都启动一次npx子进程。
+    
+    Returns:
+        可用时返回版本号字符串；命令执行失败返回空字符串；无法执行返回None
+    """
+    try:
+        result = subprocess.run(
+            ["npx", "chrome-devtools-mcp@latest", "--version"],
+            capture_output=True,
+            text=True,
+            timeout=10
+        )
+    except Exception:
+        return None
+    if result.returncode != 0:
+        return ""
+    return result.stdout.strip() or "unknown"
+
+
+def build_session_job(url: str) -> dict:
+    """根据当前会话中的API密钥和选项组装处理任务"""
+    return pipeline.build_job(
+        url,
+        firecrawl_key=st.session_state.firecrawl_key,
+        gemini_key=st.session_state.gemini_key,
+        cloudinary_name=st.session_state.cloudinary_name,
+        cloudinary_key=st.session_state.cloudinary_key,
+        cloudinary_secret=st.session_state.cloudinary_secret,
+        use_chrome_fallback=getattr(st.session_state, 'use_chrome_fallback', True),
+        chrome_fast_load=getattr(st.session_state, 'chrome_fast_load', True),
+        use_cache=getattr(st.session_state, 'use_cache', True),
+        custom_prompt=getattr(st.session_state, 'custom_prompt', None),
+        compact_prompt=getattr(st.session_state, 'compact_prompt', False),
+        repair_structure=getattr(st.session_state, 'repair_structure', True),
+        skip_duplicates=getattr(st.session_state, 'skip_duplicates', True),
+        deadline_seconds=getattr(st.session_state, 'article_deadline', Deadline.DEFAULT_BUDGET),
+        low_memory=getattr(st.session_state, 'low_memory', False),
+        owner=get_history_owner(),
+        image_options=dict(
+            optimize=getattr(st.session_state, 'optimize_images', False),
+            max_width=getattr(st.session_state, 'image_max_width', image_optimizer.DEFAULT_MAX_WIDTH),
+            image_format=getattr(st.session_state, 'image_format', "webp"),
+            quality=getattr(st.session_state, 'image_quality', image_optimizer.DEFAULT_QUALITY)
+        )
+    )
+
+
+PROMPT_TEMPLATES = {
+    "✨ 默认": DEFAULT_REWRITE_INSTRUCTION,
+    "📰 新闻风格": """请将以下文章改写为新闻报道风格：
+
+要求：
+1. 使用客观、中性的语言
+2. 保持Markdown格式和图片链接
+3. 突出事实和关键信息
+4. 语言简洁有力""",
+    "💬 口语化": """请将以下文章改写为更口语化的表达：
+
+要求：
+1. 使用轻松、自然的语言
+2. 保持Markdown格式和图片链接
+3. 增加亲和力和可读性
+4. 像和朋友聊天一样""",
+    "📚 专业学术": """请将以下文章改写为专业学术风格：
+
+要求：
+1. 使用严谨、专业的语言
+2. 保持Markdown格式和图片链接
+3. 增加逻辑性和深度分析
+4. 适合专业读者阅读""",
+}
+
+
+CURRENT_PROMPT_VARIANT = "📝 当前指令"
+
+
+def selected_variant_prompts(custom_prompt: str = None) -> dict:
+    """
+    返回用户勾选的多版本对比指令。
+    
+    Returns:
+        {版本名称: 改写指令}；未开启多版本对比时为空字典
+    """
+    prompts = {}
+    for name in getattr(st.session_state, 'variant_templates', []):
+        if name == CURRENT_PROMPT_VARIANT:
+            prompts[name] = custom_prompt
+        elif name in PROMPT_TEMPLATES:
+            prompts[name] = PROMPT_TEMPLATES[name]
+    return prompts
+
+
+def _apply_prompt_template(name: str):
+    """快速模板按钮回调：把模板写入改写指令输入框"""
+    st.session_state.custom_prompt_input = PROMPT_TEMPLATES[name]
+
+
+# 每个会话最多保留几篇已处理原文，用于切换改写指令时跳过提取和图片转存
+WORKING_SET_SIZE = 3
 
 
+def remember_source(job: dict, original_content: str, content_with_images: str):
+    """把已完成提取和图片转存的原文放入本会话的工作集（超出容量时淘汰最早的一篇）"""
+    working_set = st.session_state.setdefault("working_set", {})
+    key = pipeline.checkpoint_key(job, "images")
+    working_set.pop(key, None)
+    working_set[key] = {"original": original_content, "with_images": content_with_images}
+    while len(working_set) > WORKING_SET_SIZE:
+        working_set.pop(next(iter(working_set)))
+
+
+def recall_source(job: dict):
+    """
+    从本会话的工作集中取回已处理的原文。
+    
+    工作集按URL和图片相关设置区分，只改变改写指令时可以命中；禁用缓存时不复用。
+    
+    Returns:
+        包含original和with_images的字典，未命中时返回None
+    """
+    if not job["use_cache"]:
+        return None
+    return st.session_state.get("working_set", {}).get(pipeline.checkpoint_key(job, "images"))
+
+
+HISTORY_PAGE_SIZE = 10
+
+
+@st.cache_resource
+def get_history_store() -> HistoryStore:
+    """进程内共享的历史记录存储"""
+    return HistoryStore()
+
+
+HISTORY_OWNER_PARAM = "history"
+
+
+def get_history_owner() -> str:
+    """
+    当前编辑的历史记录标识；各编辑只能看到自己处理的文章。
+    
+    标识保存在页面地址的查询参数中，刷新或收藏页面地址后重新打开仍能看到之前的历史；
+    批量任务使用 --owner <标识> 时，结果也会出现在该标识的处理历史中
+    """
+    if "history_owner" not in st.session_state:
+        owner = st.experimental_get_query_params().get(HISTORY_OWNER_PARAM, [""])[0]
+        if not re.fullmatch(r"[0-9a-f]{32}", owner):
+            owner = uuid.uuid4().hex
+            st.experimental_set_query_params(**{HISTORY_OWNER_PARAM: owner})
+        st.session_state.history_owner = owner
+    return st.session_state.history_owner
+
+
+# 提取完成后预览的原文长度，以及流式改写时刷新预览的最短间隔（秒）
+PREVIEW_CHARS = 3000
+STREAM_REFRESH_INTERVAL = 0.2
+
+
+def render_extracted_preview(content: str):
+    """提取完成后立即显示原文预览，不必等到改写结束"""
+    with st.expander(f"👀 原文预览（{len(content)} 字符）", expanded=False):
+        st.markdown(content[:PREVIEW_CHARS] + ("\n\n……" if len(content) > PREVIEW_CHARS else ""))
+
+
+def image_progress_callback():
+    """在当前位置预留进度条，返回逐张更新进度的on_image回调；没有图片时不显示"""
+    bar = st.empty()
+    
+    def _on_image(url, new_url, done, total):
+        status = "" if new_url else "（上传失败，保留原链接）"
+        bar.progress(done / total, text=f"🖼️ 图片 {done}/{total}{status}")
+    return _on_image
+
+
+def rewrite_stream_callback():
+    """
+    在当前位置创建实时预览，返回(预览占位元素, on_chunk回调)。
+    改写完成后调用占位元素的empty()清除预览
+    """
+    live = st.empty()
+    last_render = [0.0]
+    
+    def _on_chunk(text, content):
+        # 分段较密时限制刷新频率，避免整段Markdown反复重绘
+        now = time.perf_counter()
+        if now - last_render[0] >= STREAM_REFRESH_INTERVAL:
+            last_render[0] = now
+            live.markdown(content + " ▌")
+    return live, _on_chunk
+
+
+def render_variants(results: list):
+    """
+    并排渲染多个改写版本。
+    
+    Args:
+        results: 历史记录摘要列表，额外包含name、latency和original_length
+    """
+    st.markdown("---")
+    st.subheader("🧪 **多版本对比**")
+    
+    columns = st.columns(len(results))
+    for column, result in zip(columns, results):
+        with column:
+            st.markdown(f"#### {result['name']}")
+            st.caption(f"⏱️ {result['latency']:.1f} 秒 | 📄 {result['length']} 字符 | 历史记录 #{result['id']}")
+            content = get_history_store().get_content(result["id"], get_history_owner())
+            if content is None:
+                st.warning("⚠️ 结果已被删除")
+                continue
+            st.markdown(content)
+            st.download_button(
+                label="📥 下载",
+                data=content,
+                file_name=f"rewritten_article_{result['id']}.md",
+                mime="text/markdown",
+                key=f"download_variant_{result['id']}",
+                use_container_width=True
+            )
+
+
+def render_result(result: dict):
+    """
+    渲染处理结果。
+    
+    页面上同一时间只渲染一份正文：预览、源码、下载三种视图按需切换，
+    正文在渲染所选视图时才从历史存储中读取。
+    
+    Args:
+        result: 历史记录摘要，额外包含original_length
+    """
+    st.markdown("---")
+    
+    # 显示处理摘要
+    original_length = result["original_length"]
+    rewritten_length = result["length"]
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("📄 原文字数", f"{original_length}")
+    with col2:
+        st.metric("✨ 改写字数", f"{rewritten_length}")
+    with col3:
+        change_percent = ((rewritten_length - original_length) / original_length) * 100 if original_length else 0.0
+        change_emoji = "📈" if change_percent > 0 else "📉" if change_percent < 0 else "➡️"
+        st.metric(f"{change_emoji} 长度变化", f"{change_percent:.1f}%")
+    
+    st.subheader("📖 **改写后的内容**（AI根据您的指令生成）")
+    view = st.radio(
+        "显示方式",
+        ["📖 预览", "💻 Markdown源码", "💾 下载文件"],
+        horizontal=True,
+        key="result_view",
+        label_visibility="collapsed"
+    )
+    
+    content = get_history_store().get_content(result["id"], get_history_owner())
+    if content is None:
+        st.warning("⚠️ 结果已被删除")
+        return
+    
+    if view == "📖 预览":
+        st.markdown(content)
+    elif view == "💻 Markdown源码":
+        # 代码块右上角自带复制按钮
+        st.caption("点击代码块右上角的按钮即可复制全部源码")
+        st.code(content, language="markdown", line_numbers=True)
+    else:
+        st.download_button(
+            label="📥 下载Markdown文件",
+            data=content,
+            file_name=f"rewritten_article_{result['id']}.md",
+            mime="text/markdown",
+            use_container_width=True
+        )
 
 
 def main():
@@ -243,8 +1220,6 @@ def main():
     st.markdown("---")
     
     # 初始化会话状态
-    if "history" not in st.session_state:
-        st.session_state.history = []
     if "api_configured" not in st.session_state:
         st.session_state.api_configured = False
     
@@ -410,7 +1385,8 @@ def main():
         url = st.text_input(
             "🔗 请输入公众号文章链接：",
             placeholder="https://mp.weixin.qq.com/s/xxx",
-            key="url_input"
+            key="url_input",
+            on_change=prefetch_article
         )
     with col2:
         process_button = st.button("🚀 开始处理", key="process_button", use_container_width=True)
@@ -431,41 +1407,115 @@ def main():
         # 保存设置到session state
         st.session_state.use_chrome_fallback = use_chrome_fallback
         
+        chrome_fast_load = st.checkbox(
+            "⚡ Chrome快速加载模式",
+            value=getattr(st.session_state, 'chrome_fast_load', True),
+            disabled=not use_chrome_fallback,
+            help="拦截图片、字体、样式和统计上报等资源，正文出现后立即提取，图片地址从data-src读取；个别页面提取不完整时可关闭"
+        )
+        st.session_state.chrome_fast_load = chrome_fast_load
+        
+        use_cache = st.checkbox(
+            "♻️ 复用缓存结果",
+            value=getattr(st.session_state, 'use_cache', True),
+            help="相同文章的提取结果、已转存的图片和相同指令的改写结果会被缓存到磁盘并复用；取消勾选可强制重新处理"
+        )
+        st.session_state.use_cache = use_cache
+        
+        skip_duplicates = st.checkbox(
+            "🔁 近似重复文章复用已有改写",
+            value=getattr(st.session_state, 'skip_duplicates', True),
+            disabled=not use_cache,
+            help="提取后与已改写的文章比对相似度，同一篇文章换了链接转载时直接复用之前的改写结果，跳过图片转存和AI改写"
+        )
+        st.session_state.skip_duplicates = skip_duplicates
+        
+        prefetch_enabled = st.checkbox(
+            "⚡ 输入链接后预先提取",
+            value=getattr(st.session_state, 'prefetch_enabled', True),
+            disabled=not use_cache,
+            help="输入链接并回车（或移开光标）后立即在后台提取正文，挑选改写指令的同时提取已在进行；未提交的预取结果30分钟后丢弃"
+        )
+        st.session_state.prefetch_enabled = prefetch_enabled
+        
+        article_deadline = st.number_input(
+            "⏰ 单篇处理时限（秒）",
+            min_value=0,
+            max_value=3600,
+            value=int(getattr(st.session_state, 'article_deadline', Deadline.DEFAULT_BUDGET)),
+            step=30,
+            help="提取、图片转存和AI改写共用的总时限，各步骤的超时不超过剩余时间；时限将到时跳过剩余图片的转存（保留原链接）和章节修复。0为不限制"
+        )
+        st.session_state.article_deadline = article_deadline
+        
         # 检查Chrome DevTools MCP是否可用
         chrome_status = st.empty()
-        try:
-            import subprocess
-            result = subprocess.run(
-                ["npx", "chrome-devtools-mcp@latest", "--version"],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            if result.returncode == 0:
-                chrome_status.success("✅ Chrome DevTools MCP 已安装并可用")
-                chrome_status.info(f"版本: {result.stdout.strip()}")
-            else:
-                chrome_status.warning("⚠️ Chrome DevTools MCP 未正确安装")
-        except Exception:
+        chrome_version = check_chrome_mcp_version()
+        if chrome_version is None:
             chrome_status.error("❌ Chrome DevTools MCP 不可用，请运行: npm install -g chrome-devtools-mcp")
+        elif chrome_version:
+            chrome_status.success(f"✅ Chrome DevTools MCP 已安装并可用（版本: {chrome_version}）")
+        else:
+            chrome_status.warning("⚠️ Chrome DevTools MCP 未正确安装")
+    
+    # 图片预处理选项
+    with st.expander("🖼️ 图片预处理选项", expanded=False):
+        st.markdown("### 📉 上传前压缩图片")
+        st.info("💡 上传到Cloudinary前在本地缩放、转码并去除元数据，减少上传时间和页面体积")
+        
+        optimize_images = st.checkbox(
+            "🗜️ 启用图片预处理",
+            value=getattr(st.session_state, 'optimize_images', False),
+            help="需要安装Pillow"
+        )
+        image_max_width = st.slider(
+            "📐 最大宽度（像素）",
+            min_value=320,
+            max_value=2560,
+            value=getattr(st.session_state, 'image_max_width', image_optimizer.DEFAULT_MAX_WIDTH),
+            step=80
+        )
+        image_format = st.selectbox(
+            "🎞️ 目标格式",
+            options=list(image_optimizer.SUPPORTED_FORMATS),
+            index=list(image_optimizer.SUPPORTED_FORMATS).index(getattr(st.session_state, 'image_format', "webp"))
+        )
+        image_quality = st.slider(
+            "🎚️ 压缩质量",
+            min_value=30,
+            max_value=100,
+            value=getattr(st.session_state, 'image_quality', image_optimizer.DEFAULT_QUALITY)
+        )
+        
+        # 保存设置到session state
+        st.session_state.optimize_images = optimize_images
+        st.session_state.image_max_width = image_max_width
+        st.session_state.image_format = image_format
+        st.session_state.image_quality = image_quality
+        
+        if optimize_images and not image_optimizer.is_available():
+            st.warning("⚠️ 未检测到Pillow，请运行: pip install Pillow")
+        
+        st.markdown("### ⚡ 延迟图片转存")
+        deferred_rehost = st.checkbox(
+            "🔀 改写与图片上传并行执行",
+            value=getattr(st.session_state, 'deferred_rehost', False),
+            help="先用占位链接进行AI改写，图片上传完成后再替换为Cloudinary链接，总耗时约为两者中较长的一个"
+        )
+        st.session_state.deferred_rehost = deferred_rehost
     
     # 自定义改写Prompt输入
     with st.expander("✏️ 自定义改写指令（可选）", expanded=False):
         st.markdown("### 📝 自定义AI改写指令")
         st.info("💡 如不填写，将使用默认的简洁流畅改写指令")
         
-        default_prompt = """请将以下Markdown格式的文章内容进行改写，使其表达方式更简洁、流畅。
-
-重要规则：
-1. 必须保持原文的Markdown格式不变，包括标题、列表、代码块等。
-2. 必须完整保留原文中所有的图片链接（![]()）。
-3. 不要添加任何与原文无关的评论或内容。
-4. 保持原文的核心观点和信息不变。
-5. 优化句式结构，使表达更加清晰流畅。"""
+        # 快速模板通过回调写入输入框，切换模板后再次处理同一篇文章只会重新执行改写
+        if "custom_prompt_input" not in st.session_state:
+            st.session_state.custom_prompt_input = PROMPT_TEMPLATES["✨ 默认"]
         
         custom_prompt = st.text_area(
             "🎯 请输入您的改写指令：",
-            value=default_prompt,
+            key="custom_prompt_input",
             height=150,
             help="您可以自定义AI如何改写文章，比如改变风格、调整语气等"
         )
@@ -473,38 +1523,48 @@ def main():
         # 预设模板选择
         st.markdown("#### 📋 快速模板")
         template_cols = st.columns(3)
+        template_help = {"📰 新闻风格": "改为新闻报道风格", "💬 口语化": "改为口语化表达", "📚 专业学术": "改为专业学术风格"}
         
-        with template_cols[0]:
-            if st.button("📰 新闻风格", help="改为新闻报道风格"):
-                custom_prompt = """请将以下文章改写为新闻报道风格：
-
-要求：
-1. 使用客观、中性的语言
-2. 保持Markdown格式和图片链接
-3. 突出事实和关键信息
-4. 语言简洁有力"""
+        for col, name in zip(template_cols, template_help):
+            with col:
+                st.button(
+                    name,
+                    help=template_help[name],
+                    on_click=_apply_prompt_template,
+                    args=(name,)
+                )
         
-        with template_cols[1]:
-            if st.button("💬 口语化", help="改为口语化表达"):
-                custom_prompt = """请将以下文章改写为更口语化的表达：
-
-要求：
-1. 使用轻松、自然的语言
-2. 保持Markdown格式和图片链接
-3. 增加亲和力和可读性
-4. 像和朋友聊天一样"""
+        st.session_state.custom_prompt = custom_prompt
         
-        with template_cols[2]:
-            if st.button("📚 专业学术", help="改为专业学术风格"):
-                custom_prompt = """请将以下文章改写为专业学术风格：
-
-要求：
-1. 使用严谨、专业的语言
-2. 保持Markdown格式和图片链接
-3. 增加逻辑性和深度分析
-4. 适合专业读者阅读"""
+        st.markdown("#### 🧪 多版本对比")
+        variant_templates = st.multiselect(
+            "选择两个及以上的指令，将针对同一原文并行生成多个版本并排对比",
+            options=[CURRENT_PROMPT_VARIANT] + [name for name in PROMPT_TEMPLATES],
+            default=getattr(st.session_state, 'variant_templates', []),
+            help="多个版本同时请求，总耗时约等于单次改写"
+        )
+        st.session_state.variant_templates = variant_templates
         
-        st.session_state.custom_prompt = custom_prompt
+        compact_prompt = st.checkbox(
+            "🗜️ 压缩Prompt",
+            value=getattr(st.session_state, 'compact_prompt', False),
+            help="将图片链接、URL和代码块替换为短占位符后再发送给AI，改写完成后原样还原，减少token消耗和延迟"
+        )
+        st.session_state.compact_prompt = compact_prompt
+        
+        repair_structure = st.checkbox(
+            "🩺 改写后结构校验",
+            value=getattr(st.session_state, 'repair_structure', True),
+            help="校验图片链接、标题和代码块是否与原文一致，只重新改写出问题的章节"
+        )
+        st.session_state.repair_structure = repair_structure
+        
+        low_memory = st.checkbox(
+            "🪶 低内存模式",
+            value=getattr(st.session_state, 'low_memory', False),
+            help="处理超长文章时按章节分段改写，不在会话中保留原文副本；不显示流式预览，也不与图片转存并行"
+        )
+        st.session_state.low_memory = low_memory
     
     st.markdown("---")
     
@@ -516,133 +1576,233 @@ def main():
         
         try:
             with st.spinner("🔄 正在处理中，请稍候..."):
-                # 步骤1: 获取文章内容
-                st.markdown("### 📄 步骤1: 获取文章内容")
+                job = build_session_job(url)
+                custom_prompt = job["custom_prompt"]
+                deadline = Deadline(job["deadline_seconds"])
                 
-                # 获取Chrome DevTools MCP设置
-                use_chrome_fallback = getattr(st.session_state, 'use_chrome_fallback', True)
+                # 同一篇文章只换了改写指令时，直接复用本会话已处理好的原文，只执行改写
+                working_source = recall_source(job)
+                resumed_from = None
+                if working_source:
+                    st.info("♻️ 本会话已处理过这篇文章，跳过提取和图片转存，仅重新改写")
+                else:
+                    # 如果上次处理中途失败，从最后完成的阶段继续
+                    resumed_from = pipeline.resume_stage(job)
+                    if resumed_from:
+                        stage_names = {"extract": "内容提取", "images": "图片转存"}
+                        st.info(f"♻️ 检测到上次未完成的处理，从检查点继续（已完成: {stage_names[resumed_from]}）")
                 
-                st.write("正在提取文章内容...")
-                if use_chrome_fallback:
-                    st.info("🔄 使用混合提取模式（Firecrawl + Chrome DevTools MCP）")
-                    original_content = get_content_with_fallback(
-                        url.strip(), 
-                        st.session_state.firecrawl_key, 
-                        use_chrome_fallback
-                    )
-                    st.success("✅ 文章内容获取成功")
+                # 步骤1: 获取文章内容
+                st.markdown("### 📄 步骤1: 获取文章内容")
+                if working_source:
+                    original_content = working_source["original"]
                 else:
-                    st.info("🔥 使用Firecrawl API提取")
-                    original_content = get_content_from_firecrawl(url.strip(), st.session_state.firecrawl_key)
-                    st.success("✅ 文章内容获取成功")
+                    original_content = pipeline.load_checkpoint(job, "extract") if resumed_from else None
+                if original_content is None:
+                    st.write("正在提取文章内容...")
+                    if job["use_chrome_fallback"]:
+                        st.info("🔄 使用混合提取模式（静态HTML + Firecrawl + Chrome DevTools MCP）")
+                    else:
+                        st.info("🔥 使用静态HTML + Firecrawl API提取")
+                    original_content = extract_article(
+                        job["url"],
+                        job["firecrawl_key"],
+                        job["use_chrome_fallback"],
+                        job["use_cache"],
+                        job["chrome_fast_load"],
+                        deadline
+                    )
+                    pipeline.save_checkpoint(job, "extract", original_content)
+                st.success("✅ 文章内容获取成功")
+                render_extracted_preview(original_content)
                 
-                # 步骤2: 处理图片
-                st.markdown("### 🖼️ 步骤2: 处理图片链接")
-                st.write("正在处理文章中的图片...")
-                content_with_images = process_images_with_cloudinary(
-                    original_content,
-                    st.session_state.cloudinary_name,
-                    st.session_state.cloudinary_key,
-                    st.session_state.cloudinary_secret
-                )
-                st.success("✅ 图片处理完成")
+                # 选择了两个及以上的指令时，多个版本并行改写
+                variant_prompts = selected_variant_prompts(custom_prompt)
+                deferred = (getattr(st.session_state, 'deferred_rehost', False) and len(variant_prompts) < 2
+                            and not job["low_memory"])
                 
-                # 步骤3: AI改写
-                st.markdown("### 🤖 步骤3: AI智能改写")
-                st.write("🔄 正在使用AI进行内容改写...")
-                st.info("💡 根据您的自定义指令进行智能改写")
+                # 同一篇文章的转载直接复用已有的改写结果（多版本对比时每次都重新改写）
+                duplicate = None
+                fingerprint = dedup_index.simhash(original_content)
+                original_length = len(original_content)
+                if len(variant_prompts) < 2:
+                    duplicate = pipeline.find_duplicate(job, original_content, get_history_store(), fingerprint)
                 
-                # 获取自定义prompt
-                custom_prompt = getattr(st.session_state, 'custom_prompt', None)
-                if custom_prompt:
-                    st.write("📝 使用自定义改写指令")
-                    with st.expander("查看当前改写指令", expanded=False):
-                        st.code(custom_prompt, language="text")
+                if working_source:
+                    content_with_images = working_source["with_images"]
+                else:
+                    content_with_images = pipeline.load_checkpoint(job, "images") if resumed_from == "images" else None
                 
-                final_content = rewrite_with_gemini(content_with_images, st.session_state.gemini_key, custom_prompt)
-                st.success("✅ 内容改写完成！")
+                if duplicate:
+                    st.info(
+                        f"🔁 与已处理文章近似重复（相似度 {duplicate['similarity']:.0%}，来源: {duplicate['url']}），"
+                        f"跳过图片转存和AI改写，直接复用已有的改写结果"
+                    )
+                    variants = [{"name": None, "content": duplicate["content"], "latency": None, "error": None}]
+                elif deferred and content_with_images is None:
+                    # 步骤2+3: 图片上传与AI改写并行执行
+                    st.markdown("### ⚡ 步骤2+3: 图片转存与AI改写并行执行")
+                    st.write("🔄 图片链接已替换为占位符，改写与上传同时进行...")
+                    if custom_prompt:
+                        with st.expander("查看当前改写指令", expanded=False):
+                            st.code(custom_prompt, language="text")
+                    
+                    tokenized_content, token_map = tokenize_image_urls(original_content)
+                    images_deadline = pipeline.image_deadline(deadline)
+                    on_image = image_progress_callback() if token_map else None
+                    live_preview, on_chunk = rewrite_stream_callback()
+                    uploaded, rewritten = run_concurrently(
+                        lambda: upload_images_to_cloudinary(
+                            list(token_map.values()),
+                            job["cloudinary_name"],
+                            job["cloudinary_key"],
+                            job["cloudinary_secret"],
+                            **job["image_options"],
+                            deadline=images_deadline,
+                            on_image=on_image
+                        ) if token_map else {},
+                        lambda: rewrite_with_gemini(
+                            tokenized_content, job["gemini_key"], custom_prompt, job["compact_prompt"], job["use_cache"],
+                            deadline, on_chunk
+                        ),
+                        return_exceptions=True
+                    )
+                    live_preview.empty()
+                    if isinstance(uploaded, Exception):
+                        raise uploaded
+                    
+                    # 图片转存完成即保存检查点，改写失败时重试无需重新上传
+                    content_with_images = restore_image_tokens(tokenized_content, token_map, uploaded)
+                    if not images_deadline.expired():
+                        pipeline.save_checkpoint(job, "images", content_with_images)
+                        remember_source(job, original_content, content_with_images)
+                    st.success(f"✅ 图片处理完成（{len(uploaded)}/{len(token_map)} 张已转存）")
+                    if isinstance(rewritten, Exception):
+                        raise rewritten
+                    
+                    if job["repair_structure"]:
+                        rewritten = repair_rewrite_sections(
+                            tokenized_content, rewritten, job["gemini_key"], custom_prompt, deadline
+                        )
+                    
+                    # 两者都完成后再替换为真实的secure_url
+                    final_content = restore_image_tokens(rewritten, token_map, uploaded)
+                    variants = [{"name": None, "content": final_content, "latency": None, "error": None}]
+                    st.success("✅ 内容改写完成！")
+                else:
+                    # 步骤2: 处理图片
+                    st.markdown("### 🖼️ 步骤2: 处理图片链接")
+                    if content_with_images is None:
+                        st.write("正在处理文章中的图片...")
+                        images_deadline = pipeline.image_deadline(deadline)
+                        content_with_images = process_images_with_cloudinary(
+                            original_content,
+                            job["cloudinary_name"],
+                            job["cloudinary_key"],
+                            job["cloudinary_secret"],
+                            **job["image_options"],
+                            deadline=images_deadline,
+                            on_image=image_progress_callback()
+                        )
+                        # 时限已到时可能跳过了部分图片，不保存检查点，重新处理时补传剩余图片
+                        if not images_deadline.expired():
+                            pipeline.save_checkpoint(job, "images", content_with_images)
+                            if not job["low_memory"]:
+                                remember_source(job, original_content, content_with_images)
+                    st.success("✅ 图片处理完成")
+                    if job["low_memory"]:
+                        # 改写阶段不再需要原文，先释放
+                        original_content = None
+                    
+                    if len(variant_prompts) >= 2:
+                        # 步骤3: 多版本并行改写，总耗时约等于最慢的一个版本
+                        st.markdown(f"### 🧪 步骤3: 并行生成 {len(variant_prompts)} 个改写版本")
+                        variants = rewrite_variants(
+                            content_with_images,
+                            job["gemini_key"],
+                            variant_prompts,
+                            job["compact_prompt"],
+                            job["use_cache"],
+                            job["repair_structure"],
+                            deadline
+                        )
+                        slowest = max(variant["latency"] for variant in variants)
+                        st.success(f"✅ {len(variants)} 个版本改写完成，总耗时 {slowest:.1f} 秒")
+                    else:
+                        # 步骤3: AI改写
+                        st.markdown("### 🤖 步骤3: AI智能改写")
+                        st.write("🔄 正在使用AI进行内容改写...")
+                        st.info("💡 根据您的自定义指令进行智能改写")
+                        
+                        if custom_prompt:
+                            st.write("📝 使用自定义改写指令")
+                            with st.expander("查看当前改写指令", expanded=False):
+                                st.code(custom_prompt, language="text")
+                        
+                        if job["low_memory"]:
+                            final_content = rewrite_segmented(
+                                content_with_images, job["gemini_key"], custom_prompt, job["compact_prompt"],
+                                job["use_cache"], job["repair_structure"], deadline
+                            )
+                        else:
+                            # 边生成边显示改写结果，完成后由下方的最终结果替换
+                            live_preview, on_chunk = rewrite_stream_callback()
+                            final_content = rewrite_with_gemini(
+                                content_with_images, job["gemini_key"], custom_prompt, job["compact_prompt"],
+                                job["use_cache"], deadline, on_chunk
+                            )
+                            live_preview.empty()
+                            if job["repair_structure"]:
+                                final_content = repair_rewrite_sections(
+                                    content_with_images, final_content, job["gemini_key"], custom_prompt, deadline
+                                )
+                        variants = [{"name": None, "content": final_content, "latency": None, "error": None}]
+                        st.success("✅ 内容改写完成！")
                 
                 # 显示改写统计信息
-                original_length = len(content_with_images)
-                rewritten_length = len(final_content)
-                st.info(f"📊 **改写统计**: 原文 {original_length} 字符 → 改写后 {rewritten_length} 字符")
-                
-                # 保存到历史记录
-                history_item = {
-                    "url": url.strip(),
-                    "title": f"文章_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
-                    "content": final_content,
-                    "processed_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                }
-                st.session_state.history.append(history_item)
+                for variant in variants:
+                    if not variant["error"]:
+                        label = f"（{variant['name']}）" if variant["name"] else ""
+                        st.info(
+                            f"📊 **改写统计**{label}: 原文 {len(content_with_images) if content_with_images else original_length} 字符 → "
+                            f"改写后 {len(variant['content'])} 字符"
+                        )
                 
-                # 显示最终结果
-                st.markdown("## 🎉 处理完成！")
-                st.success("✅ 文章处理成功！")
-                
-                # 显示处理摘要
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("📄 原文字数", f"{len(original_content)}")
-                with col2:
-                    st.metric("✨ 改写字数", f"{len(final_content)}")
-                with col3:
-                    change_percent = ((len(final_content) - len(original_content)) / len(original_content)) * 100
-                    change_emoji = "📈" if change_percent > 0 else "📉" if change_percent < 0 else "➡️"
-                    st.metric(f"{change_emoji} 长度变化", f"{change_percent:.1f}%")
-                
-                st.markdown("---")
-                
-                # 显示改写后的内容
-                st.subheader("📖 **改写后的内容**（AI根据您的指令生成）")
-                st.markdown("---")
-                st.markdown(final_content)
+                # 保存到历史记录：正文写入磁盘，会话中只保留摘要
+                timestamp = datetime.now()
+                current_results = []
+                for variant in variants:
+                    if variant["error"]:
+                        st.error(f"❌ {variant['name']} 改写失败: {variant['error']}")
+                        continue
+                    title = f"文章_{timestamp.strftime('%Y%m%d_%H%M%S')}"
+                    if variant["name"]:
+                        title += f"_{variant['name']}"
+                    history_item = get_history_store().add(
+                        url=job["url"],
+                        title=title,
+                        content=variant["content"],
+                        processed_at=timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+                        owner=job["owner"]
+                    )
+                    current_results.append(dict(
+                        history_item,
+                        name=variant["name"],
+                        latency=variant["latency"],
+                        original_length=original_length
+                    ))
                 
-                # 显示源码
-                st.subheader("💻 Markdown源码（可复制）")
+                if not current_results:
+                    raise Exception("所有改写版本均失败")
+                if len(variant_prompts) < 2 and not duplicate:
+                    pipeline.register_rewrite(job, None, current_results[0]["id"], fingerprint)
                 
-                # 使用两个列：一个显示代码，一个放复制按钮
-                col_code, col_copy = st.columns([4, 1])
+                st.session_state.current_results = current_results
+                pipeline.clear_checkpoints(job)
                 
-                with col_code:
-                    st.code(final_content, language="markdown", line_numbers=True, height=400)
+                st.markdown("## 🎉 处理完成！")
+                st.success("✅ 文章处理成功！")
                 
-                with col_copy:
-                    st.markdown("### 📋 复制操作")
-                    
-                    # 方式1：直接复制按钮
-                    if st.button("📋 复制源码", key="copy_button", use_container_width=True):
-                        st.session_state.clipboard_content = final_content
-                        st.toast("✅ Markdown源码已复制到剪贴板！", icon="✅")
-                    
-                    st.markdown("---")
-                    
-                    # 方式2：提供文本框供手动复制
-                    st.markdown("### 🔤 手动复制")
-                    st.text_area(
-                        "完整Markdown源码",
-                        value=final_content,
-                        height=200,
-                        help="您可以手动选择复制这些内容"
-                    )
-                    
-                    # 方式3：下载功能
-                    st.markdown("---")
-                    st.markdown("### 💾 下载文件")
-                    
-                    # 生成带时间戳的文件名
-                    import time
-                    filename = f"rewritten_article_{int(time.time())}.md"
-                    
-                    # 创建下载按钮
-                    st.download_button(
-                        label="📥 下载Markdown文件",
-                        data=final_content,
-                        file_name=filename,
-                        mime="text/markdown",
-                        use_container_width=True
-                    )
-                    
         except ValueError as e:
             st.error(f"❌ 配置错误: {str(e)}")
         except requests.exceptions.RequestException as e:
@@ -650,20 +1810,40 @@ def main():
         except Exception as e:
             st.error(f"❌ 处理过程中发生错误: {str(e)}")
     
-    # 显示历史记录
-    if st.session_state.history:
+    # 显示最近一次的处理结果（正文从结果存储按需读取，不随会话状态常驻内存）
+    current_results = getattr(st.session_state, 'current_results', None)
+    if current_results and len(current_results) > 1:
+        render_variants(current_results)
+    elif current_results:
+        render_result(current_results[0])
+    
+    # 显示历史记录（从磁盘分页按需加载，正文只在点击时读取）
+    history_store = get_history_store()
+    history_owner = get_history_owner()
+    if history_store.count(owner=history_owner) > 0:
         st.markdown("---")
         st.subheader("📚 处理历史")
         
         with st.expander("🕐 查看历史记录", expanded=False):
-            for i, item in enumerate(reversed(st.session_state.history), 1):
+            st.caption(
+                f"历史记录标识: `{history_owner}`（保存在页面地址中，收藏地址即可在下次打开时看到这些记录；"
+                f"批量任务加上 `--owner {history_owner}` 后结果也会显示在这里）"
+            )
+            search_query = st.text_input("🔍 搜索历史", key="history_query", placeholder="输入标题或正文关键词")
+            total = history_store.count(search_query.strip() or None, history_owner)
+            total_pages = max(1, -(-total // HISTORY_PAGE_SIZE))
+            page = st.number_input("页码", min_value=1, max_value=total_pages, value=1, step=1, key="history_page")
+            st.caption(f"共 {total} 条记录，第 {page}/{total_pages} 页")
+            
+            items = history_store.list_page(page, HISTORY_PAGE_SIZE, search_query.strip() or None, history_owner)
+            for i, item in enumerate(items, (page - 1) * HISTORY_PAGE_SIZE + 1):
                 with st.container():
                     st.markdown(f"**{i}. {item['title']}**")
                     st.markdown(f"🔗 原文链接: {item['url']}")
-                    st.markdown(f"⏰ 处理时间: {item['processed_at']}")
+                    st.markdown(f"⏰ 处理时间: {item['processed_at']} | 📄 {item['length']} 字符")
                     
-                    if st.button(f"查看内容 {i}", key=f"view_{i}"):
-                        st.code(item['content'], language="markdown", line_numbers=False)
+                    if st.button(f"查看内容 {i}", key=f"view_{item['id']}"):
+                        st.code(history_store.get_content(item['id'], history_owner) or "", language="markdown", line_numbers=False)
                     
                     st.markdown("---")
     
@@ -0,0 +1,50 @@
+"""
+文章URL规范化模块
+公众号文章链接常带有chksm、scene、sessionid等跟踪参数，同一篇文章会以许多不同的字符串出现。
+规范化后的URL用作缓存键、检查点键和历史记录中的链接
+"""
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+
+WEIXIN_HOST = "mp.weixin.qq.com"
+
+# 长链接 /s?__biz=...&mid=...&idx=...&sn=... 中唯一确定一篇文章的参数
+_WEIXIN_ARTICLE_PARAMS = ("__biz", "mid", "idx", "sn")
+
+# 其他网站上只去掉utm_*参数：from、spm之类的名字在部分网站上会影响返回的页面
+_TRACKING_PREFIX = "utm_"
+
+
+def canonicalize(url: str) -> str:
+    """
+    返回文章的规范URL
+
+    公众号链接统一为https，短链接 /s/<id> 去掉全部查询参数，长链接只保留
+    __biz、mid、idx、sn并按固定顺序排列；其他网站只去掉锚点和utm_*参数，
+    其余参数保持原样（不重新编码）。以#/或#!开头的片段是前端路由的一部分，予以保留。
+    无法解析的输入原样返回（去除首尾空白）。
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    if not parts.scheme or not parts.netloc:
+        return url
+
+    host = parts.netloc.lower()
+    if host == WEIXIN_HOST:
+        query = parse_qsl(parts.query, keep_blank_values=True)
+        path = parts.path.rstrip("/") or "/"
+        if path.startswith("/s/"):
+            query = []
+        else:
+            params = dict(query)
+            query = [(name, params[name]) for name in _WEIXIN_ARTICLE_PARAMS if name in params]
+        return urlunsplit(("https", host, path, urlencode(query), ""))
+
+    # 逐段过滤原始查询串，保留的参数不解码也不重新编码，没有utm_*参数时查询串原样不变
+    query = "&".join(piece for piece in parts.query.split("&") if not piece.startswith(_TRACKING_PREFIX))
+    # 单页应用用 #/ 或 #! 区分页面，去掉后不同文章会共用同一个缓存键
+    fragment = parts.fragment if parts.fragment.startswith(("/", "!")) else ""
+    return urlunsplit((parts.scheme.lower(), host, parts.path, query, fragment))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+图片扫描基准脚本
+在大文档上对比markdown_scanner与旧的 re.findall(r"!\[.*?\]\((.*?)\)") 的耗时，
+包括单纯扫描和转存时的扫描加替换，并检查两者在普通内联图片上的结果是否一致
+
+用法:
+    python bench_scanner.py                  # 默认文档规模
+    python bench_scanner.py --size 5000 --runs 10
+    python bench_scanner.py --long-line 20000  # 调整病态长行的长度
+"""
+
+import argparse
+import re
+import statistics
+import time
+
+import markdown_scanner
+
+
+LEGACY_PATTERN = r"!\[.*?\]\((.*?)\)"
+
+
+def legacy_scan(markdown_text: str) -> list:
+    """改造前process_images_with_cloudinary中的写法"""
+    return re.findall(LEGACY_PATTERN, markdown_text)
+
+
+def legacy_rehost(markdown_text: str) -> str:
+    """改造前的扫描加逐个str.replace替换（每个已上传的URL替换一遍全文）"""
+    processed = markdown_text
+    for url in dict.fromkeys(legacy_scan(markdown_text)):
+        processed = processed.replace(url, url + "?rehosted")
+    return processed
+
+
+def scanner_rehost(markdown_text: str) -> str:
+    """扫描一次后按位置拼接替换"""
+    spans = markdown_scanner.scan(markdown_text)
+    mapping = {url: url + "?rehosted" for url in markdown_scanner.unique_urls(spans)}
+    return markdown_scanner.replace_urls(markdown_text, mapping, spans)
+
+
+def build_article(paragraphs: int) -> str:
+    """生成一篇图文交错的大文档，图片URL有重复"""
+    lines = []
+    for i in range(paragraphs):
+        lines.append(f"## 第{i}节\n")
+        lines.append("这是一段用于测试的正文内容，包含[普通链接](https://example.com/page) 和一些文字。" * 3)
+        lines.append(f"![配图{i}](https://mmbiz.qpic.cn/mmbiz_png/{i % 50:04d}/640?wx_fmt=png)\n")
+    return "\n".join(lines)
+
+
+def build_long_line(length: int) -> str:
+    """病态输入：一行中有大量未闭合的图片语法"""
+    return "![x" * (length // 3) + "\n"
+
+
+def measure(function, text: str, runs: int) -> float:
+    """返回多次运行的中位数耗时（毫秒）"""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function(text)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比图片扫描器与旧正则的耗时")
+    parser.add_argument("--size", type=int, default=2000, help="大文档的段落数")
+    parser.add_argument("--long-line", type=int, default=9000, help="病态长行的字符数")
+    parser.add_argument("--runs", type=int, default=5, help="测量次数")
+    args = parser.parse_args()
+
+    print("⏱️ 图片扫描基准")
+    print("=" * 50)
+
+    article = build_article(args.size)
+    legacy_urls = legacy_scan(article)
+    scanned_urls = [span.url for span in markdown_scanner.scan(article)]
+    if legacy_urls != scanned_urls:
+        print("❌ 扫描结果与旧正则不一致")
+        return 1
+    print(f"✅ 结果一致: {len(scanned_urls)} 处图片，去重后 {len(markdown_scanner.unique_urls(markdown_scanner.scan(article)))} 个URL")
+
+    cases = [
+        (f"大文档（{len(article) // 1024} KB）", article),
+        (f"病态长行（{args.long_line} 字符）", build_long_line(args.long_line)),
+    ]
+    for name, text in cases:
+        legacy_ms = measure(legacy_scan, text, args.runs)
+        scanner_ms = measure(markdown_scanner.scan, text, args.runs)
+        print(f"📊 {name} 扫描: 旧正则 {legacy_ms:.1f} ms, 扫描器 {scanner_ms:.1f} ms "
+              f"（{legacy_ms / max(scanner_ms, 1e-6):.1f}x）")
+
+    legacy_ms = measure(legacy_rehost, article, args.runs)
+    scanner_ms = measure(scanner_rehost, article, args.runs)
+    print(f"📊 {cases[0][0]} 扫描+替换: 旧写法 {legacy_ms:.1f} ms, 扫描器 {scanner_ms:.1f} ms "
+          f"（{legacy_ms / max(scanner_ms, 1e-6):.1f}x）")
+
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+启动耗时基准脚本
+使用 python -X importtime 测量导入 app 模块的耗时，用于跟踪冷启动回归
+
+用法:
+    python bench_startup.py                 # 默认测量5次取中位数
+    python bench_startup.py --runs 10 --top 20
+    python bench_startup.py --budget-ms 1500 # 超出预算时返回非0退出码
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# 这些SDK应当在首次使用时才加载，出现在启动导入链中视为回归；
+# 框架本身（import streamlit）就会加载的模块不算在内，例如streamlit自己会导入PIL
+LAZY_MODULES = [
+    "google.generativeai",
+    "cloudinary",
+    "chrome_extractor",
+    "PIL",
+]
+
+
+def profile_import(module: str):
+    """
+    在全新的解释器中导入模块并解析 -X importtime 输出
+
+    Returns:
+        (总耗时毫秒, {模块名: 累计耗时毫秒})
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        error_lines = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        raise RuntimeError("\n".join(error_lines[-5:]) or f"导入 {module} 失败")
+
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        name = parts[2].strip()
+        cumulative[name] = int(parts[1].strip()) / 1000
+
+    return cumulative.get(module, sum(cumulative.values())), cumulative
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量应用模块的导入耗时")
+    parser.add_argument("--module", default="app", help="要测量的模块，默认app")
+    parser.add_argument("--runs", type=int, default=5, help="测量次数")
+    parser.add_argument("--top", type=int, default=15, help="显示耗时最高的模块数量")
+    parser.add_argument("--budget-ms", type=float, default=None, help="启动耗时预算（毫秒）")
+    args = parser.parse_args()
+
+    print(f"⏱️ 启动耗时基准 - import {args.module}")
+    print("=" * 50)
+
+    totals = []
+    last_profile = {}
+    for _ in range(args.runs):
+        try:
+            total, last_profile = profile_import(args.module)
+        except RuntimeError as e:
+            print(f"❌ 导入失败: {e}")
+            return 1
+        totals.append(total)
+
+    median = statistics.median(totals)
+    print(f"📊 {args.runs} 次测量: 中位数 {median:.1f} ms, 最小 {min(totals):.1f} ms, 最大 {max(totals):.1f} ms")
+
+    print(f"\n🔝 累计耗时最高的 {args.top} 个模块:")
+    top_level = {name: ms for name, ms in last_profile.items() if "." not in name or name in LAZY_MODULES}
+    for name, ms in sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"   {ms:8.1f} ms  {name}")
+
+    exit_code = 0
+    try:
+        _, framework_profile = profile_import("streamlit")
+    except RuntimeError:
+        framework_profile = {}
+    eager = [name for name in LAZY_MODULES if name in last_profile and name not in framework_profile]
+    if eager:
+        print(f"\n❌ 以下模块应延迟加载，却在启动时被导入: {', '.join(eager)}")
+        exit_code = 1
+    else:
+        print("\n✅ 重量级SDK均未在启动时导入")
+
+    if args.budget_ms is not None and median > args.budget_ms:
+        print(f"❌ 启动耗时 {median:.1f} ms 超出预算 {args.budget_ms:.1f} ms")
+        exit_code = 1
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    exit(main())
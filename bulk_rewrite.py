@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""
+离线批量改写模块
+夜间积压的文章不需要交互式延迟：先把已完成提取和图片转存的原文登记到本地任务台账，
+再打包成批量请求提交给模型服务商，之后异步轮询收取结果，写入改写缓存和历史记录。
+批量接口的吞吐更高、单价更低；本地模拟服务商用于测试和演练
+
+用法:
+    python bulk_rewrite.py submit urls.txt --prompt-file prompt.txt
+    python bulk_rewrite.py collect --wait
+    python bulk_rewrite.py status
+    python bulk_rewrite.py submit urls.txt --provider local   # 不调用真实API，结果为原文
+    python bulk_rewrite.py collect --provider local
+    python bulk_rewrite.py collect --owner <标识>   # 结果显示在页面上该历史记录标识的处理历史中
+
+API密钥从环境变量读取，与worker_pool.py相同
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import cache_store
+
+
+DEFAULT_LEDGER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data", "bulk_jobs.db")
+# 本地演练的结果不是真正的改写，写入单独的历史记录，不出现在页面的处理历史中
+DRILL_HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data", "bulk_drill_history.db")
+
+# 每个批次最多包含的文章数
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_POLL_INTERVAL = 60
+
+# 条目状态
+QUEUED = "queued"
+SUBMITTED = "submitted"
+DONE = "done"
+FAILED = "failed"
+
+# 批次状态（统一后的取值，服务商各自的状态在轮询时转换）
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+
+
+class BulkLedger:
+    """本地任务台账：记录每篇文章的排队、提交、完成状态，以及每个批次的进度"""
+
+    def __init__(self, db_path: str = DEFAULT_LEDGER_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS batches (
+                id TEXT PRIMARY KEY,
+                provider TEXT NOT NULL,
+                status TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                error TEXT,
+                submitted_at TEXT NOT NULL,
+                finished_at TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                source TEXT NOT NULL,
+                custom_prompt TEXT,
+                request_key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                batch_id TEXT,
+                result TEXT,
+                error TEXT,
+                history_id INTEGER,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS items_status ON items (status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS items_batch ON items (batch_id)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    def add_item(self, url: str, source: str, custom_prompt: Optional[str], request_key: str) -> int:
+        """登记一篇待改写的文章，返回条目ID"""
+        now = self._now()
+        cursor = self._connect().execute(
+            "INSERT INTO items (url, source, custom_prompt, request_key, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (url, source, custom_prompt, request_key, QUEUED, now, now)
+        )
+        return cursor.lastrowid
+
+    def get_item(self, item_id: int) -> Optional[Dict[str, Any]]:
+        """按ID读取条目"""
+        row = self._connect().execute("SELECT * FROM items WHERE id = ?", (item_id,)).fetchone()
+        return dict(row) if row else None
+
+    def items(self, status: Optional[str] = None, batch_id: Optional[str] = None,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按状态或批次列出条目（按登记顺序）"""
+        conditions, params = [], []
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        if batch_id is not None:
+            conditions.append("batch_id = ?")
+            params.append(batch_id)
+        sql = "SELECT * FROM items"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY id"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        return [dict(row) for row in self._connect().execute(sql, params).fetchall()]
+
+    def update_item(self, item_id: int, **fields):
+        """更新条目字段"""
+        fields["updated_at"] = self._now()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._connect().execute(f"UPDATE items SET {assignments} WHERE id = ?", (*fields.values(), item_id))
+
+    def add_batch(self, batch_id: str, provider: str, item_ids: List[int]):
+        """记录一个已提交的批次，并把其中的条目标记为已提交"""
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            conn.execute(
+                "INSERT INTO batches (id, provider, status, size, submitted_at) VALUES (?, ?, ?, ?, ?)",
+                (batch_id, provider, RUNNING, len(item_ids), self._now())
+            )
+            conn.executemany(
+                "UPDATE items SET status = ?, batch_id = ?, updated_at = ? WHERE id = ?",
+                [(SUBMITTED, batch_id, self._now(), item_id) for item_id in item_ids]
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def open_batches(self) -> List[Dict[str, Any]]:
+        """尚未结束的批次"""
+        rows = self._connect().execute(
+            "SELECT * FROM batches WHERE status = ? ORDER BY submitted_at", (RUNNING,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def finish_batch(self, batch_id: str, status: str, error: Optional[str] = None):
+        """标记批次结束"""
+        self._connect().execute(
+            "UPDATE batches SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, error, self._now(), batch_id)
+        )
+
+    def counts(self) -> Dict[str, int]:
+        """各状态的条目数量"""
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+class LocalBatchProvider:
+    """
+    本地模拟服务商：不调用任何API，按给定函数生成结果（默认原样返回原文），
+    延迟latency秒后批次才算完成。结果保存在磁盘缓存中，提交和收取可以在不同进程中进行。
+    演练结果写入单独的缓存命名空间，不会被交互式改写当作缓存命中
+    """
+
+    name = "local"
+    cache_namespace = "bulk_local_rewrite"
+
+    def __init__(self, rewrite: Callable[[str], str] = None, latency: float = 0):
+        self.rewrite = rewrite or (lambda source: source)
+        self.latency = latency
+
+    def submit(self, requests: List[Dict[str, str]]) -> str:
+        batch_id = f"local-{uuid.uuid4().hex[:12]}"
+        results = {}
+        for request in requests:
+            try:
+                results[request["key"]] = {"text": self.rewrite(request["source"])}
+            except Exception as e:
+                results[request["key"]] = {"error": str(e)}
+        cache_store.get_cache().set(
+            "bulk_local", batch_id, {"ready_at": time.time() + self.latency, "results": results}
+        )
+        return batch_id
+
+    def poll(self, batch_id: str) -> Dict[str, Any]:
+        batch = cache_store.get_cache().get("bulk_local", batch_id)
+        if batch is None:
+            return {"status": FAILED, "error": "本地模拟批次不存在（缓存已清理）"}
+        if time.time() < batch["ready_at"]:
+            return {"status": RUNNING}
+        return {"status": SUCCEEDED, "results": batch["results"]}
+
+
+class GeminiBatchProvider:
+    """Gemini批量接口（models/{model}:batchGenerateContent），请求以内联方式提交"""
+
+    name = "gemini"
+    cache_namespace = cache_store.REWRITE
+    API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+    _STATES = {
+        "BATCH_STATE_SUCCEEDED": SUCCEEDED,
+        "BATCH_STATE_FAILED": FAILED,
+        "BATCH_STATE_CANCELLED": FAILED,
+        "BATCH_STATE_EXPIRED": FAILED,
+    }
+
+    def __init__(self, api_key: str, model_name: str = "gemini-2.5-flash"):
+        if not api_key:
+            raise ValueError("Gemini API Key未配置")
+        self.api_key = api_key
+        self.model_name = model_name
+
+    def _request(self, method: str, url: str, **kwargs) -> Dict[str, Any]:
+        # 延迟导入：只有使用Gemini批量接口时才需要
+        import requests
+
+        response = requests.request(method, url, headers={"x-goog-api-key": self.api_key}, timeout=60, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def submit(self, requests: List[Dict[str, str]]) -> str:
+        body = {
+            "batch": {
+                "display_name": f"writere-{datetime.now().strftime('%Y%m%d-%H%M%S')}",
+                "input_config": {
+                    "requests": {
+                        "requests": [
+                            {
+                                "request": {"contents": [{"parts": [{"text": request["prompt"]}]}]},
+                                "metadata": {"key": request["key"]}
+                            }
+                            for request in requests
+                        ]
+                    }
+                }
+            }
+        }
+        operation = self._request("POST", f"{self.API_BASE}/models/{self.model_name}:batchGenerateContent", json=body)
+        return operation["name"]
+
+    def poll(self, batch_id: str) -> Dict[str, Any]:
+        operation = self._request("GET", f"{self.API_BASE}/{batch_id}")
+        metadata = operation.get("metadata") or {}
+        state = metadata.get("state") or operation.get("state")
+        status = self._STATES.get(state, RUNNING)
+        if status == RUNNING:
+            return {"status": RUNNING}
+        if status == FAILED:
+            return {"status": FAILED, "error": json.dumps(operation.get("error") or state, ensure_ascii=False)}
+
+        output = operation.get("response") or metadata.get("output") or {}
+        responses = (output.get("inlinedResponses") or {}).get("inlinedResponses", [])
+        results = {}
+        for item in responses:
+            key = (item.get("metadata") or {}).get("key")
+            if key is None:
+                continue
+            if item.get("error"):
+                results[key] = {"error": item["error"].get("message", "未知错误")}
+                continue
+            candidates = (item.get("response") or {}).get("candidates") or [{}]
+            parts = (candidates[0].get("content") or {}).get("parts") or []
+            text = "".join(part.get("text", "") for part in parts).strip()
+            results[key] = {"text": text} if text else {"error": "Gemini API返回空内容"}
+        return {"status": SUCCEEDED, "results": results}
+
+
+class BulkRewriter:
+    """离线批量改写：登记 → 分批提交 → 轮询收取"""
+
+    def __init__(self, ledger: BulkLedger, provider, batch_size: int = DEFAULT_BATCH_SIZE,
+                 prompt_builder: Callable[[str, Optional[str]], str] = None, history_store=None,
+                 owner: str = ""):
+        """
+        Args:
+            ledger: 任务台账
+            provider: 批量服务商（LocalBatchProvider或GeminiBatchProvider）
+            batch_size: 每个批次最多包含的文章数
+            prompt_builder: (原文, 改写指令) -> prompt，默认使用应用的build_rewrite_prompt
+            history_store: 结果写入的历史记录存储，为None时不写入
+            owner: 写入历史记录时的所属者（页面上的历史记录标识）
+        """
+        self.ledger = ledger
+        self.provider = provider
+        self.batch_size = batch_size
+        self.prompt_builder = prompt_builder
+        self.history_store = history_store
+        self.owner = owner
+
+    def _build_prompt(self, source: str, custom_prompt: Optional[str]) -> str:
+        if self.prompt_builder is None:
+            # 延迟导入，与pipeline相同，只在真正组装prompt时才加载应用模块
+            from app import build_rewrite_prompt
+            self.prompt_builder = build_rewrite_prompt
+        return self.prompt_builder(source, custom_prompt)
+
+    def enqueue(self, url: str, source: str, custom_prompt: Optional[str] = None) -> int:
+        """
+        登记一篇已完成图片转存的文章；相同原文和指令此前已改写过时直接记为完成
+
+        Returns:
+            条目ID
+        """
+        # 与rewrite_with_gemini使用相同的缓存键，真实服务商的批量结果和交互式改写互相复用
+        request_key = cache_store.make_key(source, custom_prompt, False)
+        item_id = self.ledger.add_item(url, source, custom_prompt, request_key)
+        cached = cache_store.get_cache().get(self.provider.cache_namespace, request_key)
+        if cached is not None:
+            self._complete(self.ledger.get_item(item_id), cached)
+        return item_id
+
+    def submit_pending(self) -> List[str]:
+        """把排队中的文章按batch_size分批提交，返回新批次ID列表"""
+        batch_ids = []
+        while True:
+            items = self.ledger.items(status=QUEUED, limit=self.batch_size)
+            if not items:
+                break
+            requests = [
+                {"key": str(item["id"]), "prompt": self._build_prompt(item["source"], item["custom_prompt"]),
+                 "source": item["source"]}
+                for item in items
+            ]
+            batch_id = self.provider.submit(requests)
+            self.ledger.add_batch(batch_id, self.provider.name, [item["id"] for item in items])
+            batch_ids.append(batch_id)
+        return batch_ids
+
+    def collect(self) -> Dict[str, int]:
+        """
+        轮询所有未结束的批次并收取已完成的结果
+
+        Returns:
+            本次收取的统计 {"done": 完成数, "failed": 失败数, "running": 仍在进行的批次数}
+        """
+        stats = {"done": 0, "failed": 0, "running": 0}
+        for batch in self.ledger.open_batches():
+            if batch["provider"] != self.provider.name:
+                continue
+            outcome = self.provider.poll(batch["id"])
+            if outcome["status"] == RUNNING:
+                stats["running"] += 1
+                continue
+
+            results = outcome.get("results", {})
+            for item in self.ledger.items(batch_id=batch["id"], status=SUBMITTED):
+                result = results.get(str(item["id"]))
+                if outcome["status"] == SUCCEEDED and result and result.get("text"):
+                    self._complete(item, result["text"])
+                    stats["done"] += 1
+                else:
+                    error = (result or {}).get("error") or outcome.get("error") or "批次结果中缺少该条目"
+                    self.ledger.update_item(item["id"], status=FAILED, error=error)
+                    stats["failed"] += 1
+            self.ledger.finish_batch(batch["id"], outcome["status"], outcome.get("error"))
+        return stats
+
+    def requeue_failed(self) -> int:
+        """把失败的条目重新排队，返回数量"""
+        failed = self.ledger.items(status=FAILED)
+        for item in failed:
+            self.ledger.update_item(item["id"], status=QUEUED, batch_id=None, error=None)
+        return len(failed)
+
+    def run(self, poll_interval: float = DEFAULT_POLL_INTERVAL, timeout: Optional[float] = None) -> Dict[str, int]:
+        """提交排队中的文章并等待所有批次结束，返回累计统计"""
+        self.submit_pending()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        totals = {"done": 0, "failed": 0}
+        while True:
+            stats = self.collect()
+            totals["done"] += stats["done"]
+            totals["failed"] += stats["failed"]
+            if not stats["running"]:
+                return totals
+            if deadline is not None and time.monotonic() + poll_interval > deadline:
+                raise TimeoutError(f"仍有 {stats['running']} 个批次未完成")
+            time.sleep(poll_interval)
+
+    def _complete(self, item: Dict[str, Any], text: str):
+        cache_store.get_cache().set(self.provider.cache_namespace, item["request_key"], text)
+        history_id = None
+        if self.history_store is not None:
+            history_id = self.history_store.add(
+                url=item["url"],
+                title=f"文章_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+                content=text,
+                owner=self.owner
+            )["id"]
+        self.ledger.update_item(item["id"], status=DONE, result=text, history_id=history_id, error=None)
+
+
+def _build_rewriter(args, ledger: BulkLedger) -> BulkRewriter:
+    from history_store import HistoryStore
+
+    if args.provider == "local":
+        provider, history_store = LocalBatchProvider(), HistoryStore(DRILL_HISTORY_PATH)
+    else:
+        provider = GeminiBatchProvider(
+            os.environ.get("GEMINI_API_KEY", ""), os.environ.get("GEMINI_BATCH_MODEL", "gemini-2.5-flash")
+        )
+        history_store = HistoryStore()
+    return BulkRewriter(ledger, provider, batch_size=getattr(args, "batch_size", DEFAULT_BATCH_SIZE),
+                        history_store=history_store, owner=args.owner)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线批量改写公众号文章")
+    parser.add_argument("--ledger", default=DEFAULT_LEDGER_PATH, help="任务台账数据库路径")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    provider_parser = argparse.ArgumentParser(add_help=False)
+    provider_parser.add_argument("--provider", choices=["gemini", "local"], default="gemini",
+                                 help="批量服务商（local为本地演练，结果为原文）")
+    provider_parser.add_argument("--owner", default=os.environ.get("WRITERE_HISTORY_OWNER", ""),
+                                 help="历史记录标识（页面处理历史中显示），收取的结果会出现在该标识的处理历史中")
+
+    submit_parser = subparsers.add_parser("submit", parents=[provider_parser],
+                                          help="提取并转存图片后登记文章，然后分批提交")
+    submit_parser.add_argument("url_file", help="每行一个文章URL的文本文件")
+    submit_parser.add_argument("--prompt-file", default=None, help="自定义改写指令文件")
+    submit_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="每个批次的文章数")
+    submit_parser.add_argument("--no-chrome", action="store_true", help="禁用Chrome DevTools MCP降级")
+
+    collect_parser = subparsers.add_parser("collect", parents=[provider_parser], help="收取已完成批次的结果")
+    collect_parser.add_argument("--wait", action="store_true", help="一直等到所有批次结束")
+    collect_parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL, help="轮询间隔秒数")
+
+    subparsers.add_parser("retry", parents=[provider_parser], help="把失败的文章重新排队并提交")
+    subparsers.add_parser("status", help="查看台账统计")
+    args = parser.parse_args()
+
+    ledger = BulkLedger(args.ledger)
+    # status只读台账，不需要服务商和API密钥
+    rewriter = _build_rewriter(args, ledger) if args.command != "status" else None
+
+    if args.command == "submit":
+        import pipeline
+        import stage_scheduler
+        from app import extract_article, process_images_with_cloudinary
+
+        # 提取和图片转存与页面共用服务商并发，按批量通道排队，不挤占编辑的交互式请求
+        stage_scheduler.set_default_lane(stage_scheduler.BATCH)
+
+        with open(args.url_file, "r", encoding="utf-8") as f:
+            urls = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+        custom_prompt = None
+        if args.prompt_file:
+            with open(args.prompt_file, "r", encoding="utf-8") as f:
+                custom_prompt = f.read().strip() or None
+
+        for url in urls:
+            job = pipeline.build_job_from_env(url, custom_prompt=custom_prompt, use_chrome_fallback=not args.no_chrome)
+            try:
+                original = extract_article(job["url"], job["firecrawl_key"], job["use_chrome_fallback"], job["use_cache"],
+                                           job["chrome_fast_load"])
+                source = process_images_with_cloudinary(
+                    original, job["cloudinary_name"], job["cloudinary_key"], job["cloudinary_secret"],
+                    **job["image_options"]
+                )
+            except Exception as e:
+                print(f"❌ {job['url']}: {e}")
+                continue
+            rewriter.enqueue(job["url"], source, custom_prompt)
+            print(f"📝 已登记 {job['url']}")
+        batch_ids = rewriter.submit_pending()
+        print(f"🚀 已提交 {len(batch_ids)} 个批次: {', '.join(batch_ids) or '无'}")
+    elif args.command == "collect":
+        if args.wait:
+            stats = rewriter.run(args.poll_interval)
+        else:
+            stats = rewriter.collect()
+        print(f"📥 本次完成 {stats['done']} 篇，失败 {stats['failed']} 篇")
+    elif args.command == "retry":
+        requeued = rewriter.requeue_failed()
+        batch_ids = rewriter.submit_pending()
+        print(f"🔁 重新排队 {requeued} 篇，提交 {len(batch_ids)} 个批次")
+
+    counts = ledger.counts()
+    print("📊 台账: " + ", ".join(f"{status} {counts.get(status, 0)}" for status in (QUEUED, SUBMITTED, DONE, FAILED)))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,108 @@
+"""
+磁盘缓存模块
+基于SQLite的键值缓存，按命名空间区分内容提取、图片转存和AI改写等结果。
+同一个数据库文件可以被多个进程同时读写，用于在工作进程之间共享缓存
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data", "cache.db")
+
+# 常用命名空间
+EXTRACT = "extract"
+IMAGE = "image"
+REWRITE = "rewrite"
+CHECKPOINT = "checkpoint"
+PREFETCH = "prefetch"
+
+# 文章提取结果的缓存时间，页面编辑或删除后一天内会重新抓取
+EXTRACT_TTL = 24 * 3600
+# 输入链接后预先提取的结果在提交前的保留时间，用户没有提交时很快过期
+PREFETCH_TTL = 30 * 60
+
+
+def make_key(*parts: Any) -> str:
+    """将任意可JSON序列化的参数组合成稳定的缓存键"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """SQLite键值缓存，值以JSON存储，支持可选的过期时间"""
+
+    def __init__(self, db_path: str = DEFAULT_CACHE_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        # 每个线程使用独立连接；多进程之间依靠SQLite文件锁和WAL模式保证一致性。
+        # fork出的子进程不能沿用父进程的连接，因此按进程号区分
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        """读取缓存，不存在或已过期时返回default"""
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()
+        if row is None:
+            return default
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.delete(namespace, key)
+            return default
+        return json.loads(value)
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        """写入缓存，ttl为过期秒数，None表示永不过期"""
+        expires_at = time.time() + ttl if ttl is not None else None
+        self._connect().execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (namespace, key, json.dumps(value, ensure_ascii=False), expires_at)
+        )
+
+    def delete(self, namespace: str, key: str):
+        """删除一条缓存"""
+        self._connect().execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def clear(self, namespace: Optional[str] = None):
+        """清空指定命名空间（或全部）的缓存"""
+        if namespace is None:
+            self._connect().execute("DELETE FROM cache")
+        else:
+            self._connect().execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_cache() -> DiskCache:
+    """返回当前进程的默认磁盘缓存（所有进程共享同一个数据库文件）"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = DiskCache(os.environ.get("WRITERE_CACHE_PATH", DEFAULT_CACHE_PATH))
+        return _default_cache
@@ -6,24 +6,43 @@ import asyncio
 import json
 import subprocess
 import tempfile
+import threading
 import os
 from typing import Optional, Dict, Any
+from urllib.parse import urlsplit
 import requests
+from requests.adapters import HTTPAdapter
+
+import firecrawl_client
+import wechat_html
+from deadline import Deadline
 
 
 class ChromeDevToolsExtractor:
     """Chrome DevTools MCP内容提取器"""
     
-    def __init__(self):
+    # 快速加载模式下拦截的资源类型：正文只需要文档本身，图片地址从data-src读取
+    BLOCKED_RESOURCE_TYPES = ["image", "media", "font", "stylesheet", "ping", "other"]
+    # 正文容器选择器，按优先级排列（#js_content为公众号文章正文）
+    CONTENT_SELECTORS = ["#js_content", ".rich_media_content", ".article-content", ".content", ".article", ".post-content"]
+    
+    def __init__(self, fast_load: bool = True):
+        """
+        Args:
+            fast_load: 是否使用快速加载模式：拦截图片、字体、样式等非文档资源，
+                正文容器有内容后立即提取，不等待网络空闲
+        """
         self.mcp_command = ["npx", "chrome-devtools-mcp@latest"]
         self.timeout = 60  # 60秒超时
+        self.fast_load = fast_load
         
-    async def extract_wechat_article(self, url: str) -> str:
+    async def extract_wechat_article(self, url: str, timeout: float = None) -> str:
         """
         使用Chrome DevTools MCP提取微信公众号文章
         
         Args:
             url: 文章URL
+            timeout: 本次提取的超时秒数，默认使用self.timeout
             
         Returns:
             提取的Markdown格式文本
@@ -33,7 +52,7 @@ class ChromeDevToolsExtractor:
             script_content = self._create_extraction_script(url)
             
             # 执行Chrome DevTools MCP
-            result = await self._execute_mcp_script(script_content)
+            result = await self._execute_mcp_script(script_content, timeout)
             
             # 处理提取结果
             return self._process_extracted_content(result)
@@ -41,24 +60,60 @@ class ChromeDevToolsExtractor:
         except Exception as e:
             raise Exception(f"Chrome DevTools MCP提取失败: {str(e)}")
     
+    def _create_navigation_script(self) -> str:
+        """页面导航与等待正文加载的脚本片段"""
+        selectors = json.dumps(", ".join(self.CONTENT_SELECTORS))
+        if not self.fast_load:
+            return """
+        // 1. 导航并等待网络空闲
+        await page.goto(url, { 
+            waitUntil: 'networkidle2',
+            timeout: 30000 
+        });
+        
+        // 2. 等待主要内容加载
+        await page.waitForSelector('.rich_media_content', { timeout: 10000 })
+            .catch(() => page.waitForSelector('.article-content', { timeout: 10000 }))
+            .catch(() => page.waitForSelector('.content', { timeout: 10000 }));
+"""
+        return f"""
+        // 1. 拦截非文档资源（图片、字体、样式、统计上报等），只下载正文所需内容
+        const blockedTypes = new Set({json.dumps(self.BLOCKED_RESOURCE_TYPES)});
+        await page.setRequestInterception(true);
+        page.on('request', request => {{
+            if (blockedTypes.has(request.resourceType())) {{
+                request.abort();
+            }} else {{
+                request.continue();
+            }}
+        }});
+        await page.goto(url, {{ 
+            waitUntil: 'domcontentloaded',
+            timeout: 15000 
+        }});
+        
+        // 2. 正文容器有文字后立即继续，不等待网络空闲
+        await page.waitForFunction(selectors => {{
+            const element = document.querySelector(selectors);
+            return element && element.textContent.trim().length > 0;
+        }}, {{ timeout: 10000, polling: 200 }}, {selectors}).catch(() => null);
+        
+        // 懒加载图片的真实地址在data-src中，写回src后再提取（图片请求本身已被拦截）
+        await page.evaluate(() => {{
+            document.querySelectorAll('img[data-src]').forEach(img => {{
+                img.setAttribute('src', img.getAttribute('data-src'));
+            }});
+        }});
+"""
+    
     def _create_extraction_script(self, url: str) -> str:
         """创建提取脚本"""
         return f"""
 // Chrome DevTools MCP 提取脚本
 async function extractWechatArticle(url) {{
+    const page = await newPage();
     try {{
-        // 1. 创建新页面并导航
-        const page = await newPage();
-        await page.goto(url, {{ 
-            waitUntil: 'networkidle2',
-            timeout: 30000 
-        }});
-        
-        // 2. 等待主要内容加载
-        await page.waitForSelector('.rich_media_content', {{ timeout: 10000 }})
-            .catch(() => page.waitForSelector('.article-content', {{ timeout: 10000 }}))
-            .catch(() => page.waitForSelector('.content', {{ timeout: 10000 }}));
-        
+{self._create_navigation_script()}
         // 3. 移除不必要的元素
         await page.evaluate(() => {{
             const elementsToRemove = [
@@ -72,16 +127,8 @@ async function extractWechatArticle(url) {{
         }});
         
         // 4. 提取文章内容
-        const content = await page.evaluate(() => {{
+        const content = await page.evaluate(selectors => {{
             // 尝试多个可能的内容选择器
-            const selectors = [
-                '.rich_media_content',
-                '.article-content', 
-                '.content',
-                '.article',
-                '.post-content'
-            ];
-            
             for (const selector of selectors) {{
                 const element = document.querySelector(selector);
                 if (element) {{
@@ -91,7 +138,7 @@ async function extractWechatArticle(url) {{
             
             // 如果都没找到，返回body内容
             return document.body.innerHTML;
-        }});
+        }}, {json.dumps(self.CONTENT_SELECTORS)});
         
         // 5. 获取文章标题
         const title = await page.evaluate(() => {{
@@ -138,14 +185,14 @@ async function extractWechatArticle(url) {{
 }}
 
 // 执行提取
-extractWechatArticle('{url}').then(result => {{
+extractWechatArticle({json.dumps(url)}).then(result => {{
     console.log(JSON.stringify({{ success: true, content: result }}));
 }}).catch(error => {{
     console.log(JSON.stringify({{ success: false, error: error.message }}));
 }});
 """
     
-    async def _execute_mcp_script(self, script_content: str) -> Dict[str, Any]:
+    async def _execute_mcp_script(self, script_content: str, timeout: float = None) -> Dict[str, Any]:
         """执行MCP脚本"""
         try:
             # 创建临时文件
@@ -159,7 +206,7 @@ extractWechatArticle('{url}').then(result => {{
                     self.mcp_command + [temp_file],
                     capture_output=True,
                     text=True,
-                    timeout=self.timeout
+                    timeout=timeout or self.timeout
                 )
                 
                 if result.returncode == 0:
@@ -232,28 +279,106 @@ extractWechatArticle('{url}').then(result => {{
             return html_content
 
 
+class StaticHtmlExtractor:
+    """公众号文章静态HTML提取器：直接请求页面并解析首屏HTML中的正文，不调用API也不启动浏览器"""
+    
+    SUPPORTED_HOSTS = ("mp.weixin.qq.com",)
+    HEADERS = {
+        "User-Agent": (
+            "Mozilla/5.0 (iPhone; CPU iPhone OS 16_0 like Mac OS X) AppleWebKit/605.1.15 "
+            "(KHTML, like Gecko) Mobile/15E148 MicroMessenger/8.0.40"
+        ),
+        "Accept": "text/html,application/xhtml+xml",
+        "Accept-Language": "zh-CN,zh;q=0.9",
+    }
+    
+    # 进程内共享一个带连接池的Session，复用到mp.weixin.qq.com的TLS连接
+    _session = None
+    _session_lock = threading.Lock()
+    
+    def __init__(self, timeout: float = 10):
+        self.timeout = timeout
+    
+    @classmethod
+    def supports(cls, url: str) -> bool:
+        """是否为可以直接解析的公众号文章链接"""
+        return urlsplit(url).netloc.lower() in cls.SUPPORTED_HOSTS
+    
+    @classmethod
+    def _get_session(cls) -> requests.Session:
+        with cls._session_lock:
+            if cls._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update(cls.HEADERS)
+                cls._session = session
+            return cls._session
+    
+    def extract(self, url: str, timeout: float = None) -> str:
+        """
+        请求页面并把正文转换为Markdown
+        
+        Args:
+            url: 文章URL
+            timeout: 本次请求的超时秒数，默认使用self.timeout
+        
+        Raises:
+            Exception: 网络请求失败、遇到验证页或正文为空时抛出，调用方应降级到其他提取方式
+        """
+        response = self._get_session().get(url, timeout=timeout or self.timeout)
+        response.raise_for_status()
+        if not response.encoding or response.encoding.lower() == "iso-8859-1":
+            # 响应头未声明编码时requests默认按ISO-8859-1解码，公众号页面实际为UTF-8
+            response.encoding = "utf-8"
+        page_html = response.text
+        
+        content = wechat_html.to_markdown(page_html)
+        if not content:
+            # 只在拿不到正文时才判断是否为验证页，避免正文中恰好出现提示文字造成误判
+            reason = wechat_html.detect_blocked(page_html) or "页面中没有找到正文内容"
+            raise Exception(f"静态HTML提取失败: {reason}")
+        return content
+
+
 class HybridExtractor:
     """混合提取器 - 结合Firecrawl和Chrome DevTools MCP"""
     
-    def __init__(self, firecrawl_api_key: str = None):
+    def __init__(self, firecrawl_api_key: str = None, fast_load: bool = True):
         self.firecrawl_api_key = firecrawl_api_key
-        self.chrome_extractor = ChromeDevToolsExtractor()
+        self.static_extractor = StaticHtmlExtractor()
+        self.chrome_extractor = ChromeDevToolsExtractor(fast_load=fast_load)
     
-    async def extract_content(self, url: str, use_chrome_fallback: bool = True) -> str:
+    async def extract_content(self, url: str, use_chrome_fallback: bool = True, deadline: Deadline = None) -> str:
         """
-        提取内容，优先使用Firecrawl，失败后使用Chrome DevTools MCP
+        提取内容：公众号文章先直接解析静态HTML，再依次尝试Firecrawl和Chrome DevTools MCP
         
         Args:
             url: 文章URL
             use_chrome_fallback: 是否在Firecrawl失败时使用Chrome DevTools MCP
+            deadline: 单篇处理时限，各提取方式的超时不超过剩余时间，时限已到时不再尝试下一种方式
             
         Returns:
             提取的内容
+            
+        Raises:
+            DeadlineExceeded: 前面的方式失败后时限已到
         """
-        # 首先尝试Firecrawl API
+        deadline = deadline or Deadline()
+        
+        # 公众号文章的正文就在首屏HTML中，直接请求最快也最省
+        if self.static_extractor.supports(url):
+            try:
+                return self.static_extractor.extract(url, deadline.timeout(self.static_extractor.timeout))
+            except Exception as e:
+                print(f"{e}，尝试其他提取方式...")
+        
+        # 然后尝试Firecrawl API
         if self.firecrawl_api_key:
+            deadline.check("内容提取")
             try:
-                return await self._extract_with_firecrawl(url)
+                return await self._extract_with_firecrawl(url, deadline.timeout(30))
             except Exception as e:
                 print(f"Firecrawl提取失败: {e}")
                 if use_chrome_fallback:
@@ -263,31 +388,16 @@ class HybridExtractor:
         
         # 降级到Chrome DevTools MCP
         if use_chrome_fallback:
-            return await self.chrome_extractor.extract_wechat_article(url)
+            deadline.check("内容提取")
+            return await self.chrome_extractor.extract_wechat_article(
+                url, deadline.timeout(self.chrome_extractor.timeout)
+            )
         else:
             raise Exception("Firecrawl提取失败且未启用Chrome DevTools MCP降级")
     
-    async def _extract_with_firecrawl(self, url: str) -> str:
-        """使用Firecrawl API提取内容"""
-        headers = {
-            "Authorization": f"Bearer {self.firecrawl_api_key}",
-            "Content-Type": "application/json"
-        }
-        payload = {"url": url}
-        
-        response = requests.post(
-            "https://api.firecrawl.dev/v0/scrape",
-            json=payload,
-            headers=headers,
-            timeout=30
-        )
-        response.raise_for_status()
-        
-        data = response.json()
-        if data.get("success") and "markdown" in data.get("data", {}):
-            return data["data"]["markdown"]
-        else:
-            raise Exception(f"Firecrawl API返回错误: {data.get('error', '未知错误')}")
+    async def _extract_with_firecrawl(self, url: str, timeout: float = 30) -> str:
+        """使用Firecrawl API提取内容（只请求正文Markdown）"""
+        return firecrawl_client.scrape(url, self.firecrawl_api_key, timeout)
 
 
 # 使用示例
@@ -0,0 +1,142 @@
+"""
+第三方SDK客户端缓存模块
+按凭据缓存配置好的Cloudinary和Gemini客户端，同一组密钥在所有会话和线程间复用，
+且不修改SDK的全局配置，不同会话使用不同密钥时互不影响
+"""
+import hashlib
+import threading
+from typing import Dict, Optional
+
+
+_lock = threading.Lock()
+_cloudinary_clients: Dict[str, "CloudinaryClient"] = {}
+_gemini_clients: Dict[str, object] = {}
+_gemini_model_names: Dict[str, str] = {}
+_instructed_models: Dict[str, object] = {}
+
+# 带system instruction的模型按(API Key, 模型, 指令模板哈希)缓存；
+# 自定义指令可能很多，超出上限时淘汰最久未使用的
+MAX_INSTRUCTED_MODELS = 64
+
+
+def _credential_key(*parts: str) -> str:
+    """将凭据转换为缓存键，避免在缓存中直接以明文密钥为键"""
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+class CloudinaryClient:
+    """绑定一组凭据的Cloudinary客户端，凭据随每次调用传入，不依赖cloudinary.config()全局状态"""
+
+    def __init__(self, cloud_name: str, api_key: str, api_secret: str):
+        self._credentials = {
+            "cloud_name": cloud_name,
+            "api_key": api_key,
+            "api_secret": api_secret
+        }
+
+    def upload(self, file, **options) -> dict:
+        """上传文件，参数与cloudinary.uploader.upload一致"""
+        # 延迟导入Cloudinary SDK，只有真正上传图片时才加载
+        import cloudinary.uploader
+
+        return cloudinary.uploader.upload(file, **options, **self._credentials)
+
+
+def get_cloudinary_client(cloud_name: str, api_key: str, api_secret: str) -> CloudinaryClient:
+    """
+    获取指定凭据的Cloudinary客户端（按凭据缓存）
+
+    Raises:
+        ValueError: 如果凭据不完整
+    """
+    if not all([cloud_name, api_key, api_secret]):
+        raise ValueError("Cloudinary配置未完成")
+
+    key = _credential_key(cloud_name, api_key, api_secret)
+    with _lock:
+        client = _cloudinary_clients.get(key)
+        if client is None:
+            client = _cloudinary_clients[key] = CloudinaryClient(cloud_name, api_key, api_secret)
+    return client
+
+
+def get_gemini_client(api_key: str):
+    """
+    获取指定API Key的Gemini GenerativeService客户端（按API Key缓存，线程安全）
+
+    Raises:
+        ValueError: 如果API Key为空
+    """
+    if not api_key:
+        raise ValueError("Gemini API Key未配置")
+
+    key = _credential_key(api_key)
+    with _lock:
+        client = _gemini_clients.get(key)
+        if client is None:
+            # 延迟导入Gemini SDK，只有真正改写时才加载
+            from google.ai import generativelanguage as glm
+
+            client = _gemini_clients[key] = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+    return client
+
+
+def get_gemini_model(api_key: str, model_name: str, **model_kwargs):
+    """
+    创建绑定到指定API Key客户端的GenerativeModel，不调用genai.configure()
+
+    Args:
+        api_key: Gemini API密钥
+        model_name: 模型名称
+        model_kwargs: 透传给GenerativeModel的其他参数
+    """
+    import google.generativeai as genai
+
+    model = genai.GenerativeModel(model_name, **model_kwargs)
+    model._client = get_gemini_client(api_key)
+    return model
+
+
+def template_hash(instruction: str) -> str:
+    """指令模板的哈希，内容相同的模板得到相同的值"""
+    return hashlib.sha256(instruction.encode("utf-8")).hexdigest()[:16]
+
+
+def get_instructed_model(api_key: str, model_name: str, instruction: str):
+    """
+    获取以instruction作为system instruction的GenerativeModel（按API Key、模型和模板哈希缓存）
+
+    指令只在首次使用时编译进模型对象，之后每次请求只需发送原文；
+    每次请求的指令前缀完全相同，也便于服务端对重复前缀做隐式缓存
+
+    Args:
+        api_key: Gemini API密钥
+        model_name: 模型名称
+        instruction: 改写指令模板（不含原文）
+    """
+    key = _credential_key(api_key, model_name, template_hash(instruction))
+    with _lock:
+        # 命中时移到末尾，淘汰总是从最久未使用的一端开始
+        model = _instructed_models.pop(key, None)
+        if model is not None:
+            _instructed_models[key] = model
+            return model
+
+    model = get_gemini_model(api_key, model_name, system_instruction=instruction)
+    with _lock:
+        model = _instructed_models.setdefault(key, model)
+        while len(_instructed_models) > MAX_INSTRUCTED_MODELS:
+            _instructed_models.pop(next(iter(_instructed_models)))
+    return model
+
+
+def get_selected_model_name(api_key: str) -> Optional[str]:
+    """返回该API Key此前探测成功的模型名称，未探测过时返回None"""
+    with _lock:
+        return _gemini_model_names.get(_credential_key(api_key))
+
+
+def set_selected_model_name(api_key: str, model_name: str):
+    """记录该API Key可用的模型名称，后续请求无需重新探测"""
+    with _lock:
+        _gemini_model_names[_credential_key(api_key)] = model_name
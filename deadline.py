@@ -0,0 +1,69 @@
+"""
+单篇文章处理时限模块
+每篇文章开始处理时创建一个Deadline，随调用依次传给提取、图片转存和AI改写。
+各阶段的网络调用以剩余时间作为超时上限；时间不够时跳过可省略的步骤（例如剩余图片的转存），
+而不是让一篇文章无限拖长
+"""
+import time
+from typing import Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """处理时限已用完，后续必需的步骤无法执行"""
+
+
+class Deadline:
+    """单篇文章的处理时限；budget为空或不大于0时不限制"""
+
+    DEFAULT_BUDGET = 5 * 60
+
+    def __init__(self, budget: Optional[float] = None):
+        self.budget = budget if budget and budget > 0 else None
+        self.started = time.monotonic()
+        self.expires_at = None if self.budget is None else self.started + self.budget
+
+    def remaining(self) -> Optional[float]:
+        """剩余秒数（不小于0）；不限制时返回None"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        """时限是否已到"""
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def timeout(self, default: float, minimum: float = 1.0) -> float:
+        """
+        单次调用的超时：原有的固定超时与剩余时间中较小的一个
+
+        Args:
+            default: 不受时限约束时使用的超时
+            minimum: 超时下限，避免剩余时间极短时传出0或负数
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return max(minimum, min(default, remaining))
+
+    def check(self, stage: str):
+        """
+        时限已到时抛出DeadlineExceeded
+
+        Args:
+            stage: 即将执行的阶段名称，用于错误信息
+        """
+        if self.expired():
+            raise DeadlineExceeded(f"单篇处理时限 {self.budget:.0f} 秒已用完，未能完成{stage}")
+
+    def reserve(self, seconds: float) -> "Deadline":
+        """
+        返回一个提前seconds秒到期的子时限，为后续阶段预留时间
+
+        例如图片转存使用预留了改写时间的子时限，图片较多时跳过剩余上传，改写仍有时间完成
+        """
+        child = Deadline()
+        child.budget = self.budget
+        child.started = self.started
+        if self.expires_at is not None:
+            child.expires_at = self.expires_at - seconds
+        return child
@@ -0,0 +1,176 @@
+"""
+近似重复文章检测模块
+对提取出的Markdown正文计算64位SimHash指纹，并用分段索引快速查找汉明距离很小的已处理文章，
+用于识别同一篇文章在不同URL下的转载，直接复用已有的改写结果
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, Any, Optional
+
+import cache_store
+
+
+FINGERPRINT_BITS = 64
+# 64位指纹分成4段，每段16位；汉明距离不超过3时至少有一段完全相同（抽屉原理）
+_BANDS = 4
+_BAND_BITS = FINGERPRINT_BITS // _BANDS
+DEFAULT_MAX_DISTANCE = 3
+
+_SHINGLE_SIZE = 4
+# 正文文字少于此长度（例如只有图片的文章）时不计算指纹：特征太少，不同文章的指纹会相同
+MIN_TEXT_LENGTH = 50
+# 每次统计的特征数
+_SHINGLE_BLOCK = 4096
+# 图片和链接地址在转载和转存后通常不同，不参与指纹计算
+_LINK_PATTERN = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+# 只匹配RFC 3986允许的字符，紧跟在URL后面的中文正文仍参与指纹计算
+_URL_PATTERN = re.compile(r"https?://[A-Za-z0-9\-._~:/?#@!$&*+,;=%]+")
+_NOISE_PATTERN = re.compile(r"[\s#*_>`~\-|]+")
+
+
+def normalize(markdown_text: str) -> str:
+    """去掉链接地址、Markdown标记和空白，只保留正文文字"""
+    text = _LINK_PATTERN.sub(r"\1", markdown_text)
+    text = _URL_PATTERN.sub("", text)
+    return _NOISE_PATTERN.sub("", text).lower()
+
+
+def simhash(markdown_text: str) -> int:
+    """
+    计算正文的64位SimHash指纹
+
+    以连续4个字符为特征（对中文按字切分同样有效），特征出现次数即为权重。
+    正文文字不足MIN_TEXT_LENGTH时返回0，表示无法判断是否重复，不应参与查找和登记。
+    """
+    text = normalize(markdown_text)
+    if len(text) < MIN_TEXT_LENGTH:
+        return 0
+    total = max(1, len(text) - _SHINGLE_SIZE + 1)
+
+    # 按块处理特征：每块的哈希二进制串按列转置统计，逐位计数交给C实现完成，
+    # 临时对象只与块大小有关，长文章的额外内存不随正文长度增长
+    counts = [0] * FINGERPRINT_BITS
+    for block_start in range(0, total, _SHINGLE_BLOCK):
+        bit_strings = [
+            format(int.from_bytes(
+                hashlib.blake2b(text[i:i + _SHINGLE_SIZE].encode("utf-8"), digest_size=8).digest(), "big"
+            ), "064b")
+            for i in range(block_start, min(block_start + _SHINGLE_BLOCK, total))
+        ]
+        for bit, column in enumerate(zip(*bit_strings)):
+            counts[bit] += column.count("1")
+
+    half = total / 2
+    fingerprint = 0
+    for count in counts:
+        fingerprint = (fingerprint << 1) | (count > half)
+    return fingerprint
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """两个指纹之间不同的位数"""
+    return bin(a ^ b).count("1")
+
+
+def similarity(a: int, b: int) -> float:
+    """指纹相似度（0-1）"""
+    return 1 - hamming_distance(a, b) / FINGERPRINT_BITS
+
+
+def _bands(fingerprint: int):
+    mask = (1 << _BAND_BITS) - 1
+    return [(fingerprint >> (band * _BAND_BITS)) & mask for band in range(_BANDS)]
+
+
+class DuplicateIndex:
+    """SimHash近似重复索引，与磁盘缓存共用同一个SQLite文件，多进程共享"""
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path or os.environ.get("WRITERE_CACHE_PATH", cache_store.DEFAULT_CACHE_PATH)
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS simhash_index (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fingerprint TEXT NOT NULL,
+                url TEXT NOT NULL,
+                prompt_key TEXT NOT NULL,
+                history_id INTEGER NOT NULL,
+                band0 INTEGER NOT NULL,
+                band1 INTEGER NOT NULL,
+                band2 INTEGER NOT NULL,
+                band3 INTEGER NOT NULL
+            )
+        """)
+        for band in range(_BANDS):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS simhash_band{band} ON simhash_index (band{band})")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def add(self, fingerprint: int, url: str, prompt_key: str, history_id: int):
+        """登记一篇已改写的文章"""
+        self._connect().execute(
+            "INSERT INTO simhash_index (fingerprint, url, prompt_key, history_id, band0, band1, band2, band3) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (format(fingerprint, "016x"), url, prompt_key, history_id, *_bands(fingerprint))
+        )
+
+    def find(self, fingerprint: int, prompt_key: Optional[str] = None,
+             max_distance: int = DEFAULT_MAX_DISTANCE) -> Optional[Dict[str, Any]]:
+        """
+        查找最相似的已处理文章
+
+        Args:
+            fingerprint: 待查文章的指纹
+            prompt_key: 只匹配使用相同改写指令的记录；None表示不限
+            max_distance: 允许的最大汉明距离（不超过3时保证不漏检）
+
+        Returns:
+            包含url、history_id、prompt_key、distance和similarity的字典，未找到时返回None
+        """
+        bands = _bands(fingerprint)
+        where = " OR ".join(f"band{band} = ?" for band in range(_BANDS))
+        rows = self._connect().execute(
+            f"SELECT fingerprint, url, prompt_key, history_id FROM simhash_index WHERE ({where}) "
+            f"ORDER BY id DESC",
+            bands
+        ).fetchall()
+
+        best = None
+        for hex_fingerprint, url, row_prompt_key, history_id in rows:
+            if prompt_key is not None and row_prompt_key != prompt_key:
+                continue
+            distance = hamming_distance(fingerprint, int(hex_fingerprint, 16))
+            if distance <= max_distance and (best is None or distance < best["distance"]):
+                best = {
+                    "url": url,
+                    "history_id": history_id,
+                    "prompt_key": row_prompt_key,
+                    "distance": distance,
+                    "similarity": 1 - distance / FINGERPRINT_BITS
+                }
+        return best
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_index() -> DuplicateIndex:
+    """返回当前进程的默认近似重复索引"""
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = DuplicateIndex()
+        return _default_index
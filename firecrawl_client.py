@@ -0,0 +1,136 @@
+"""
+Firecrawl API客户端模块
+统一封装单篇抓取和批量抓取：只请求正文Markdown（onlyMainContent），
+复用带连接池的HTTP会话；大量URL排队时使用批量接口提交后轮询结果
+"""
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+API_BASE = "https://api.firecrawl.dev/v1"
+
+# 只要正文Markdown：不要原始HTML、截图和链接列表，去掉导航、页脚等非正文区域
+SCRAPE_OPTIONS = {
+    "formats": ["markdown"],
+    "onlyMainContent": True,
+}
+
+BATCH_POLL_INTERVAL = 2
+BATCH_TIMEOUT = 15 * 60
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    """进程内共享的HTTP会话，复用到Firecrawl的TLS连接"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=16))
+            _session = session
+        return _session
+
+
+def _headers(api_key: str) -> Dict[str, str]:
+    if not api_key:
+        raise ValueError("Firecrawl API Key未配置")
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+
+def scrape(url: str, api_key: str, timeout: float = 30) -> str:
+    """
+    抓取单篇文章的正文Markdown
+
+    Raises:
+        ValueError: 未配置API Key，或API返回错误
+        requests.exceptions.RequestException: 网络请求失败
+    """
+    response = _get_session().post(
+        f"{API_BASE}/scrape",
+        json=dict(SCRAPE_OPTIONS, url=url),
+        headers=_headers(api_key),
+        timeout=timeout
+    )
+    response.raise_for_status()
+
+    data = response.json()
+    markdown = (data.get("data") or {}).get("markdown")
+    if data.get("success") and markdown:
+        return markdown
+    raise ValueError(f"Firecrawl API返回错误: {data.get('error', '未返回正文内容')}")
+
+
+def batch_scrape(urls: Iterable[str], api_key: str, poll_interval: float = BATCH_POLL_INTERVAL,
+                 timeout: float = BATCH_TIMEOUT) -> Dict[str, Optional[str]]:
+    """
+    批量抓取：一次提交所有URL，轮询直到任务结束
+
+    Args:
+        urls: 文章URL列表
+        api_key: Firecrawl API密钥
+        poll_interval: 轮询间隔秒数
+        timeout: 等待整个批次完成的最长秒数
+
+    Returns:
+        {URL: 正文Markdown}，抓取失败的URL对应None
+
+    Raises:
+        ValueError: 未配置API Key、提交失败或批次失败
+        TimeoutError: 超过timeout仍未完成
+        requests.exceptions.RequestException: 网络请求失败
+    """
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return {}
+
+    session = _get_session()
+    headers = _headers(api_key)
+    response = session.post(
+        f"{API_BASE}/batch/scrape",
+        json=dict(SCRAPE_OPTIONS, urls=urls),
+        headers=headers,
+        timeout=30
+    )
+    response.raise_for_status()
+    submitted = response.json()
+    if not submitted.get("success") or not submitted.get("id"):
+        raise ValueError(f"Firecrawl批量任务提交失败: {submitted.get('error', '未知错误')}")
+
+    status_url = f"{API_BASE}/batch/scrape/{submitted['id']}"
+    deadline = time.monotonic() + timeout
+    while True:
+        response = session.get(status_url, headers=headers, timeout=30)
+        response.raise_for_status()
+        status = response.json()
+        if status.get("status") == "completed":
+            break
+        if status.get("status") == "failed":
+            raise ValueError(f"Firecrawl批量任务失败: {status.get('error', '未知错误')}")
+        if time.monotonic() + poll_interval > deadline:
+            raise TimeoutError(f"Firecrawl批量任务超过 {timeout:.0f} 秒仍未完成")
+        time.sleep(poll_interval)
+
+    results = {url: None for url in urls}
+    # 结果较多时分页返回，next指向下一页
+    while True:
+        for item in status.get("data") or []:
+            metadata = item.get("metadata") or {}
+            source_url = metadata.get("sourceURL") or metadata.get("url")
+            if source_url in results and item.get("markdown"):
+                results[source_url] = item["markdown"]
+        next_url = status.get("next")
+        if not next_url:
+            break
+        response = session.get(next_url, headers=headers, timeout=30)
+        response.raise_for_status()
+        status = response.json()
+    return results
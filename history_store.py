@@ -0,0 +1,205 @@
+"""
+处理历史存储模块
+使用SQLite将处理过的文章持久化到磁盘，支持分页读取和全文搜索，
+会话中只需保留轻量的摘要信息，内容在需要查看时才按需加载。
+每条记录带有所属者（页面上的历史记录标识，批量任务用--owner指定，默认为空字符串），
+页面只列出和读取本标识的记录；记录总数超过上限时删除最早的记录
+"""
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data", "history.db")
+
+# 最多保留的记录数，超出时删除最早的记录
+DEFAULT_MAX_ROWS = 10000
+
+# trigram分词器支持中文子串匹配，但要求查询至少3个字符
+_FTS_MIN_QUERY_LENGTH = 3
+
+
+class HistoryStore:
+    """基于SQLite的处理历史存储"""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, max_rows: Optional[int] = DEFAULT_MAX_ROWS):
+        """
+        Args:
+            db_path: 数据库路径，":memory:"为内存数据库
+            max_rows: 最多保留的记录数，为None时不限制
+        """
+        self.db_path = db_path
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self.fts_enabled = False
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # 内存数据库只在单个连接内有效，需要复用同一个连接
+        self._shared_conn = sqlite3.connect(db_path, check_same_thread=False) if db_path == ":memory:" else None
+        self._init_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._shared_conn is not None:
+            return self._shared_conn
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _close(self, conn: sqlite3.Connection):
+        if conn is not self._shared_conn:
+            conn.close()
+
+    def _init_schema(self):
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS history (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        url TEXT NOT NULL,
+                        title TEXT NOT NULL,
+                        content TEXT NOT NULL,
+                        length INTEGER NOT NULL,
+                        processed_at TEXT NOT NULL,
+                        owner TEXT NOT NULL DEFAULT ''
+                    )
+                """)
+                # 旧版本创建的表没有owner列，原有记录归入批量任务（空字符串）
+                columns = [row[1] for row in conn.execute("PRAGMA table_info(history)")]
+                if "owner" not in columns:
+                    conn.execute("ALTER TABLE history ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_history_owner ON history(owner, id)")
+                try:
+                    conn.execute("""
+                        CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+                            title, content, content='history', content_rowid='id', tokenize='trigram'
+                        )
+                    """)
+                    conn.execute("""
+                        CREATE TRIGGER IF NOT EXISTS history_ai AFTER INSERT ON history BEGIN
+                            INSERT INTO history_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+                        END
+                    """)
+                    conn.execute("""
+                        CREATE TRIGGER IF NOT EXISTS history_ad AFTER DELETE ON history BEGIN
+                            INSERT INTO history_fts(history_fts, rowid, title, content)
+                            VALUES ('delete', old.id, old.title, old.content);
+                        END
+                    """)
+                    self.fts_enabled = True
+                except sqlite3.OperationalError:
+                    # SQLite未编译FTS5或版本过低，退化为LIKE搜索
+                    self.fts_enabled = False
+                conn.commit()
+            finally:
+                self._close(conn)
+
+    def add(self, url: str, title: str, content: str, processed_at: Optional[str] = None,
+            owner: str = "") -> Dict[str, Any]:
+        """
+        保存一条处理记录
+
+        Args:
+            owner: 记录所属者，页面上为历史记录标识，批量任务默认为空字符串
+
+        Returns:
+            不含正文的摘要字典（id、url、title、length、processed_at）
+        """
+        processed_at = processed_at or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            conn = self._connect()
+            try:
+                cursor = conn.execute(
+                    "INSERT INTO history (url, title, content, length, processed_at, owner) VALUES (?, ?, ?, ?, ?, ?)",
+                    (url, title, content, len(content), processed_at, owner)
+                )
+                if self.max_rows is not None:
+                    conn.execute(
+                        "DELETE FROM history WHERE id <= (SELECT id FROM history ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                        (self.max_rows,)
+                    )
+                conn.commit()
+                item_id = cursor.lastrowid
+            finally:
+                self._close(conn)
+        return {"id": item_id, "url": url, "title": title, "length": len(content), "processed_at": processed_at}
+
+    def _where(self, query: Optional[str], owner: Optional[str] = None):
+        """根据搜索词和所属者生成WHERE子句和参数"""
+        conditions, params = [], ()
+        if owner is not None:
+            conditions.append("owner = ?")
+            params += (owner,)
+        if query and self.fts_enabled and len(query) >= _FTS_MIN_QUERY_LENGTH:
+            phrase = '"' + query.replace('"', '""') + '"'
+            conditions.append("id IN (SELECT rowid FROM history_fts WHERE history_fts MATCH ?)")
+            params += (phrase,)
+        elif query:
+            pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            conditions.append("(title LIKE ? ESCAPE '\\' OR content LIKE ? ESCAPE '\\')")
+            params += (pattern, pattern)
+        if not conditions:
+            return "", ()
+        return "WHERE " + " AND ".join(conditions), params
+
+    def count(self, query: Optional[str] = None, owner: Optional[str] = None) -> int:
+        """返回记录总数（可按搜索词过滤）；owner为None时统计所有所属者的记录"""
+        where, params = self._where(query, owner)
+        with self._lock:
+            conn = self._connect()
+            try:
+                return conn.execute(f"SELECT COUNT(*) FROM history {where}", params).fetchone()[0]
+            finally:
+                self._close(conn)
+
+    def list_page(self, page: int = 1, page_size: int = 10, query: Optional[str] = None,
+                  owner: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        按处理时间倒序分页读取摘要，不加载正文
+
+        Args:
+            page: 页码，从1开始
+            page_size: 每页条数
+            query: 可选的全文搜索词
+            owner: 只列出该所属者的记录，为None时列出全部
+        """
+        where, params = self._where(query, owner)
+        offset = max(page - 1, 0) * page_size
+        with self._lock:
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    f"SELECT id, url, title, length, processed_at FROM history {where} "
+                    f"ORDER BY id DESC LIMIT ? OFFSET ?",
+                    params + (page_size, offset)
+                ).fetchall()
+            finally:
+                self._close(conn)
+        return [
+            {"id": row[0], "url": row[1], "title": row[2], "length": row[3], "processed_at": row[4]}
+            for row in rows
+        ]
+
+    def get_content(self, item_id: int, owner: Optional[str] = None) -> Optional[str]:
+        """按id读取正文，不存在或不属于owner时返回None；owner为None时不检查所属者"""
+        where, params = self._where(None, owner)
+        where = f"{where} AND id = ?" if where else "WHERE id = ?"
+        with self._lock:
+            conn = self._connect()
+            try:
+                row = conn.execute(f"SELECT content FROM history {where}", params + (item_id,)).fetchone()
+            finally:
+                self._close(conn)
+        return row[0] if row else None
+
+    def delete(self, item_id: int):
+        """删除一条记录"""
+        with self._lock:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM history WHERE id = ?", (item_id,))
+                conn.commit()
+            finally:
+                self._close(conn)
@@ -0,0 +1,203 @@
+"""
+图片预处理模块
+在上传到Cloudinary之前，于本地进程池中对图片进行缩放、转码并去除元数据，减小上传体积
+"""
+import io
+import importlib.util
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, List
+
+import requests
+
+from deadline import Deadline
+
+
+DEFAULT_MAX_WIDTH = 1280
+DEFAULT_QUALITY = 80
+SUPPORTED_FORMATS = ("webp", "jpeg")
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def is_available() -> bool:
+    """检查图片预处理依赖（Pillow）是否可用，不会实际导入Pillow"""
+    return importlib.util.find_spec("PIL") is not None
+
+
+def _load_pillow():
+    """延迟导入Pillow（可选依赖），避免拖慢应用启动"""
+    try:
+        from PIL import Image
+    except ImportError:
+        raise RuntimeError("图片预处理需要安装Pillow: pip install Pillow")
+    return Image
+
+
+def optimize_image_bytes(data: bytes, max_width: int = DEFAULT_MAX_WIDTH,
+                         image_format: str = "webp", quality: int = DEFAULT_QUALITY) -> bytes:
+    """
+    缩放并转码单张图片，同时去除EXIF/ICC等元数据
+
+    Args:
+        data: 原始图片字节
+        max_width: 最大宽度，超过时按比例缩小
+        image_format: 目标格式，webp或jpeg
+        quality: 目标压缩质量（1-100）
+
+    Returns:
+        处理后的图片字节；如果处理后反而更大，或是动图，则返回原始字节
+
+    Raises:
+        RuntimeError: 如果未安装Pillow
+        ValueError: 如果目标格式不受支持
+    """
+    Image = _load_pillow()
+    from PIL import ImageOps
+
+    image_format = image_format.lower()
+    if image_format not in SUPPORTED_FORMATS:
+        raise ValueError(f"不支持的图片格式: {image_format}")
+
+    with Image.open(io.BytesIO(data)) as img:
+        # 动图转码会丢失动画，保持原样
+        if getattr(img, "is_animated", False):
+            return data
+
+        img.load()
+        # 去除元数据前先按EXIF方向旋转，手机竖拍的照片不会变成横向
+        img = ImageOps.exif_transpose(img)
+
+        # 先转为RGB/RGBA再缩放：调色板和灰度透明图上LANCZOS会退化为最近邻插值
+        # JPEG不支持透明通道，WebP统一使用RGB/RGBA
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        if image_format == "jpeg" or not has_alpha:
+            img = img.convert("RGB")
+        else:
+            img = img.convert("RGBA")
+
+        if img.width > max_width:
+            height = max(1, round(img.height * max_width / img.width))
+            img = img.resize((max_width, height), Image.LANCZOS)
+
+        # 丢弃元数据（EXIF、ICC profile、注释等）
+        img.info = {}
+
+        output = io.BytesIO()
+        img.save(output, format=image_format.upper(), quality=quality, optimize=True)
+        optimized = output.getvalue()
+
+    return optimized if len(optimized) < len(data) else data
+
+
+def _download_and_optimize(task: Dict[str, Any]) -> Dict[str, Any]:
+    """进程池任务：下载并处理单张图片"""
+    url = task["url"]
+    result = {"url": url, "original_bytes": 0, "optimized_bytes": 0, "data": None, "error": None}
+    try:
+        response = requests.get(url, timeout=task.get("timeout", 30))
+        response.raise_for_status()
+        original = response.content
+        optimized = optimize_image_bytes(
+            original,
+            max_width=task["max_width"],
+            image_format=task["image_format"],
+            quality=task["quality"]
+        )
+        result.update(original_bytes=len(original), optimized_bytes=len(optimized), data=optimized)
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """进程内共享的预处理进程池，首次使用时创建"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # 与worker_pool相同使用spawn启动，避免从带有线程的Streamlit进程fork出不一致的子进程
+            _pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _reset_pool(broken: ProcessPoolExecutor):
+    """工作进程异常退出后进程池不可再用，丢弃后下次重新创建"""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False)
+
+
+def optimize_images(urls: List[str], max_width: int = DEFAULT_MAX_WIDTH, image_format: str = "webp",
+                    quality: int = DEFAULT_QUALITY, timeout: float = 30,
+                    deadline: Deadline = None) -> Dict[str, Dict[str, Any]]:
+    """
+    在进程内共享的进程池中批量下载并预处理图片
+
+    Args:
+        urls: 图片URL列表（重复URL只处理一次）
+        max_width: 最大宽度
+        image_format: 目标格式，webp或jpeg
+        quality: 目标压缩质量
+        timeout: 单张图片的下载超时秒数
+        deadline: 单篇处理时限，到时不再等待尚未完成的图片
+
+    Returns:
+        以URL为键的结果字典，每项包含original_bytes、optimized_bytes、data和error；
+        时限内未完成的图片error为超时说明，由调用方上传原图
+
+    Raises:
+        RuntimeError: 如果未安装Pillow
+    """
+    _load_pillow()
+
+    unique_urls = list(dict.fromkeys(urls))
+    if not unique_urls:
+        return {}
+
+    tasks = [
+        {"url": url, "max_width": max_width, "image_format": image_format, "quality": quality, "timeout": timeout}
+        for url in unique_urls
+    ]
+    pool = _get_pool()
+    futures = {pool.submit(_download_and_optimize, task): task["url"] for task in tasks}
+    done, pending = wait(futures, timeout=(deadline or Deadline()).remaining())
+
+    results = {}
+    for future, url in futures.items():
+        result = {"url": url, "original_bytes": 0, "optimized_bytes": 0, "data": None, "error": None}
+        if future in pending:
+            future.cancel()
+            result["error"] = "处理时限已到，未完成预处理"
+        else:
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:
+                _reset_pool(pool)
+                result["error"] = f"预处理进程异常退出: {e}"
+        results[url] = result
+    return results
+
+
+def summarize_savings(results: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    汇总一篇文章的图片压缩效果
+
+    Returns:
+        包含count、original_bytes、optimized_bytes、saved_bytes、saved_percent的字典
+    """
+    succeeded = [item for item in results.values() if not item.get("error")]
+    original = sum(item["original_bytes"] for item in succeeded)
+    optimized = sum(item["optimized_bytes"] for item in succeeded)
+    saved = original - optimized
+    return {
+        "count": len(succeeded),
+        "original_bytes": original,
+        "optimized_bytes": optimized,
+        "saved_bytes": saved,
+        "saved_percent": (saved / original * 100) if original else 0.0
+    }
@@ -0,0 +1,335 @@
+"""
+Markdown图片/链接扫描模块
+单遍扫描Markdown文本，找出内联图片、引用式图片、<img>标签（以及可选的普通链接）中的URL位置，
+供图片转存、prompt压缩和改写结构校验共用。
+
+所有正则预编译且只做锚定匹配，失败的候选位置不会反复回扫同一段文本，
+长行和大量未闭合的括号也保持线性耗时。围栏代码块中的内容不视为图片。
+
+性能取舍：逐个候选在Python中处理，比旧写法一次C实现的 re.findall 慢。文中只有普通内联图片时
+（没有<img>标签、围栏代码块和引用定义，每个 ![ 都是简单的 ![alt](url)）走整篇正则的快速路径，
+468 KB的文档约为旧正则的2倍（多出的是位置、标题和校验）；其余情况走逐个候选的扫描，约为旧正则的4-5倍。
+换来的是病态长行上快几十到上百倍，以及按位置替换时整体比旧写法快约4倍（bench_scanner.py）。
+"""
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+
+class ImageSpan(NamedTuple):
+    """一处URL出现的位置；start/end是URL本身在文本中的偏移，替换时只改这一段"""
+    url: str
+    start: int
+    end: int
+    kind: str  # inline、reference、html或link
+    alt: str = ""
+    title: Optional[str] = None
+
+
+# 候选起点按类别分别用带字面前缀的正则查找（正则引擎可以快速跳过无关文本），
+# 每类只在扫描位置越过上次结果后才重新查找，整篇文本每类只扫一遍
+_LINE_START_PATTERN = re.compile(r"\n {0,3}(?:(?P<fence>`{3,}|~{3,})|(?P<definition>\[))")
+_FIRST_LINE_PATTERN = re.compile(r" {0,3}(?:(?P<fence>`{3,}|~{3,})|(?P<definition>\[))")
+_IMAGE_START_PATTERN = re.compile(r"!\[")
+_HTML_START_PATTERN = re.compile(r"<[iI][mM][gG]\b")
+_LINK_START_PATTERN = re.compile(r"\[")
+_BRACKET_PATTERN = re.compile(r"[\[\]]")
+# 紧跟在 ] 之后的内联目标：(url "title")，url可用尖括号包裹
+_INLINE_TARGET_PATTERN = re.compile(
+    r"\(\s*(?:<(?P<angle>[^<>\n]*)>|(?P<url>[^\s()<>]+))"
+    r"(?:\s+(?:\"(?P<t1>[^\"\n]*)\"|'(?P<t2>[^'\n]*)'|\((?P<t3>[^()\n]*)\)))?\s*\)"
+)
+# 紧跟在 ] 之后的引用标签：[label] 或 []
+_REFERENCE_LABEL_PATTERN = re.compile(r"\[(?P<label>[^\[\]\n]*)\]")
+# 引用定义中 ] 之后的部分：: url "title"
+_DEFINITION_PATTERN = re.compile(
+    r":[ \t]*(?:<(?P<angle>[^<>\n]+)>|(?P<url>\S+))"
+    r"(?:[ \t]+(?:\"(?P<t1>[^\"\n]*)\"|'(?P<t2>[^'\n]*)'|\((?P<t3>[^()\n]*)\)))?[ \t]*$",
+    re.MULTILINE
+)
+# <img>标签中的src，微信文章中常见的data-src作为备选
+_IMG_SRC_PATTERN = re.compile(
+    r"\s(?P<name>data-src|src)\s*=\s*(?:\"(?P<q1>[^\"]*)\"|'(?P<q2>[^']*)'|(?P<bare>[^\s\"'>]+))",
+    re.IGNORECASE
+)
+# 快速路径：标签中没有方括号、紧跟内联目标的图片
+_SIMPLE_IMAGE_PATTERN = re.compile(r"!\[(?P<alt>[^\[\]\n]*)\]" + _INLINE_TARGET_PATTERN.pattern)
+# 围栏代码块的结束行，按标记字符和最小长度缓存
+_FENCE_CLOSERS: Dict[str, "re.Pattern"] = {}
+
+
+def _fence_closer(marker: str):
+    pattern = _FENCE_CLOSERS.get(marker)
+    if pattern is None:
+        pattern = re.compile(rf"^ {{0,3}}{re.escape(marker[0])}{{{len(marker)},}}[ \t]*$", re.MULTILINE)
+        _FENCE_CLOSERS[marker] = pattern
+    return pattern
+
+
+def _normalize_label(label: str) -> str:
+    return " ".join(label.split()).lower()
+
+
+def _target(match):
+    """从目标匹配中取出(url, start, end, title)"""
+    group = "angle" if match.group("angle") is not None else "url"
+    t1, t2, t3 = match.group("t1", "t2", "t3")
+    title = t1 if t1 is not None else t2 if t2 is not None else t3
+    return match.group(group), match.start(group), match.end(group), title
+
+
+class _Closer:
+    """记住下一个结束字符的位置，多个候选起点共享同一次查找，避免反复回扫"""
+
+    def __init__(self, text: str, char: str):
+        self.text = text
+        self.char = char
+        self.position = -1
+
+    def after(self, position: int) -> int:
+        """position及之后第一个结束字符的位置，不存在时返回文本长度"""
+        if self.position < position:
+            found = self.text.find(self.char, position)
+            self.position = len(self.text) if found == -1 else found
+        return self.position
+
+
+class _Brackets:
+    """按行配对方括号（标签中允许成对嵌套的方括号），每行只计算一次"""
+
+    def __init__(self, text: str, line_end: _Closer):
+        self.text = text
+        self.line_end = line_end
+        self.start = self.end = -1
+        self.pairs: Dict[int, int] = {}
+
+    def closing(self, position: int) -> Optional[int]:
+        """position处的 [ 在同一行内对应的 ] 的位置，没有配对时返回None"""
+        if not self.start <= position < self.end:
+            self.start = self.text.rfind("\n", 0, position) + 1
+            self.end = self.line_end.after(position)
+            self.pairs = {}
+            opened = []
+            for bracket in _BRACKET_PATTERN.finditer(self.text, self.start, self.end):
+                if bracket.group() == "[":
+                    opened.append(bracket.start())
+                elif opened:
+                    self.pairs[opened.pop()] = bracket.start()
+        return self.pairs.get(position)
+
+
+class _Candidates:
+    """某一类候选起点的查找结果缓存"""
+
+    def __init__(self, text: str, pattern, kind: str):
+        self.text = text
+        self.pattern = pattern
+        self.kind = kind
+        self.match = None
+        self.exhausted = False
+
+    def after(self, position: int):
+        """position及之后的第一个候选，没有时返回None"""
+        if not self.exhausted and (self.match is None or self.match.start() < position):
+            self.match = self.pattern.search(self.text, position)
+            self.exhausted = self.match is None
+        return None if self.exhausted else self.match
+
+
+def _scan_simple(text: str) -> Optional[List[ImageSpan]]:
+    """
+    快速路径：文中只有简单内联图片时用一次正则扫描整篇文本
+
+    有<img>标签、围栏代码块或引用定义，或者有任何一个 ![ 不是简单内联图片时返回None，
+    交给逐个候选的扫描处理，两者对简单内联图片的结果完全相同
+    """
+    if (_HTML_START_PATTERN.search(text) or _LINE_START_PATTERN.search(text)
+            or _FIRST_LINE_PATTERN.match(text)):
+        return None
+    matches = list(_SIMPLE_IMAGE_PATTERN.finditer(text))
+    if len(matches) != text.count("!["):
+        return None
+    # 逐项创建结果是快速路径的主要开销，这里直接取分组，不经过_target
+    spans = []
+    make = ImageSpan._make
+    for match in matches:
+        url, angle, alt, t1, t2, t3 = match.group("url", "angle", "alt", "t1", "t2", "t3")
+        if url is None:
+            url = angle
+            start, end = match.span("angle")
+        else:
+            start, end = match.span("url")
+        spans.append(make((url, start, end, "inline", alt, t1 if t1 is not None else t2 if t2 is not None else t3)))
+    return spans
+
+
+def scan(markdown_text: str, include_links: bool = False) -> List[ImageSpan]:
+    """
+    扫描文本中的图片（和链接）URL
+
+    Args:
+        markdown_text: Markdown文本
+        include_links: 是否同时返回普通链接 [text](url) 的目标
+
+    Returns:
+        按出现位置排序的ImageSpan列表；同一个URL多次出现时每处各有一项，
+        多个引用式图片共用一个定义时该定义只出现一次
+    """
+    text = markdown_text
+    if not include_links:
+        simple = _scan_simple(text)
+        if simple is not None:
+            return simple
+    length = len(text)
+    spans = []
+    definitions: Dict[str, ImageSpan] = {}
+    references = []  # [(引用标签, alt)]
+    close_bracket = _Closer(text, "]")
+    close_angle = _Closer(text, ">")
+    line_end = _Closer(text, "\n")
+    brackets = _Brackets(text, line_end)
+    sources = [
+        _Candidates(text, _LINE_START_PATTERN, "line"),
+        _Candidates(text, _IMAGE_START_PATTERN, "image"),
+        _Candidates(text, _HTML_START_PATTERN, "html"),
+    ]
+    if include_links:
+        sources.append(_Candidates(text, _LINK_START_PATTERN, "link"))
+
+    position = 0
+    first_line = _FIRST_LINE_PATTERN.match(text)
+    while True:
+        if first_line is not None:
+            match, kind = first_line, "line"
+            first_line = None
+        else:
+            match = None
+            for source in sources:
+                candidate = source.after(position)
+                if candidate is not None and (match is None or candidate.start() < match.start()):
+                    match, kind = candidate, source.kind
+            if match is None:
+                break
+
+        if kind == "line" and match.group("fence"):
+            # 跳到闭合的围栏之后；未闭合时代码块延续到文末
+            closed = _fence_closer(match.group("fence")).search(text, line_end.after(match.end()) + 1)
+            if closed is None:
+                break
+            position = closed.end()
+            continue
+
+        if kind == "html":
+            tag_end = close_angle.after(match.end())
+            if tag_end == length:
+                # 没有闭合的 > 时不是标签，跳过后继续扫描其后的图片
+                position = match.end()
+                continue
+            attributes = {}
+            for attribute in _IMG_SRC_PATTERN.finditer(text, match.end(), tag_end):
+                group = next(name for name in ("q1", "q2", "bare") if attribute.group(name) is not None)
+                attributes.setdefault(attribute.group("name").lower(), (attribute, group))
+            source = attributes.get("src") or attributes.get("data-src")
+            if source:
+                attribute, group = source
+                spans.append(ImageSpan(attribute.group(group), attribute.start(group), attribute.end(group), "html"))
+            position = tag_end + 1
+            continue
+
+        # 方括号标签不跨行，可以包含成对的方括号；找不到同一行内配对的 ] 时从下一个字符继续
+        label_start = match.end()
+        label_end = close_bracket.after(label_start)
+        if label_end > line_end.after(label_start):
+            label_end = None
+        elif text.find("[", label_start, label_end) != -1:
+            # 标签中还有 [，按整行配对查找对应的 ]
+            label_end = brackets.closing(label_start - 1)
+        if label_end is None:
+            position = label_start
+            continue
+        after_label = label_end + 1
+
+        if kind != "image":
+            if kind == "line":
+                definition = _DEFINITION_PATTERN.match(text, after_label)
+                if definition:
+                    url, url_start, url_end, title = _target(definition)
+                    label = _normalize_label(text[label_start:label_end])
+                    definitions.setdefault(label, ImageSpan(url, url_start, url_end, "reference", "", title))
+                    position = definition.end()
+                    continue
+            # 带链接的图片 [![alt](img)](href) 交给内层的图片处理
+            if include_links and not text.startswith("![", label_start):
+                target = _INLINE_TARGET_PATTERN.match(text, after_label)
+                if target:
+                    url, url_start, url_end, title = _target(target)
+                    spans.append(ImageSpan(url, url_start, url_end, "link", text[label_start:label_end], title))
+                    position = target.end()
+                    continue
+            position = label_start
+            continue
+
+        alt = text[label_start:label_end]
+        target = _INLINE_TARGET_PATTERN.match(text, after_label)
+        if target:
+            url, url_start, url_end, title = _target(target)
+            spans.append(ImageSpan(url, url_start, url_end, "inline", alt, title))
+            position = target.end()
+            continue
+
+        reference = _REFERENCE_LABEL_PATTERN.match(text, after_label)
+        if reference:
+            references.append((reference.group("label") or alt, alt))
+            position = reference.end()
+        else:
+            # 简写形式 ![label]，有同名定义时才算图片
+            references.append((alt, alt))
+            position = after_label
+
+    # 引用定义可能出现在使用处之后，扫描结束后再统一解析
+    used = {}
+    for label, alt in references:
+        definition = definitions.get(_normalize_label(label))
+        if definition is not None and definition.start not in used:
+            used[definition.start] = definition._replace(alt=alt)
+    spans.extend(used.values())
+    spans.sort(key=lambda span: span.start)
+    return spans
+
+
+def image_urls(markdown_text: str) -> List[str]:
+    """返回文中所有图片URL，去重并保持首次出现的顺序"""
+    return unique_urls(scan(markdown_text))
+
+
+def unique_urls(spans: Iterable[ImageSpan]) -> List[str]:
+    """从扫描结果中取出去重后的URL列表"""
+    return list(dict.fromkeys(span.url for span in spans))
+
+
+def replace_urls(markdown_text: str, replacements: Dict[str, str], spans: List[ImageSpan] = None) -> str:
+    """
+    按扫描到的位置替换URL，只改动图片（和链接）目标本身，正文中恰好相同的文字不受影响
+
+    Args:
+        markdown_text: 原文
+        replacements: {原URL: 新URL}，不在映射中的URL保持原样
+        spans: 已有的扫描结果，省略时重新扫描图片
+
+    Returns:
+        替换后的文本
+    """
+    if spans is None:
+        spans = scan(markdown_text)
+    pieces = []
+    position = 0
+    for span in spans:
+        new_url = replacements.get(span.url)
+        if new_url is None:
+            continue
+        pieces.append(markdown_text[position:span.start])
+        pieces.append(new_url)
+        position = span.end
+    if not pieces:
+        return markdown_text
+    pieces.append(markdown_text[position:])
+    return "".join(pieces)
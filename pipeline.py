@@ -0,0 +1,365 @@
+"""
+文章处理流水线模块
+不依赖页面交互的完整处理流程（提取 → 图片转存 → AI改写），
+供批量处理和工作进程使用。所有阶段共享磁盘缓存和历史记录存储
+"""
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, Callable, Iterator, NamedTuple, Optional
+
+import article_url
+import cache_store
+import dedup_index
+import image_optimizer
+from deadline import Deadline
+
+
+# 检查点保留时间：失败的文章在此期间重试都可以从上次完成的阶段继续
+CHECKPOINT_TTL = 7 * 24 * 3600
+
+# 图片转存最多为AI改写预留的秒数（不超过总时限的三分之一）：图片较多时跳过剩余上传，保证改写有时间完成
+REWRITE_RESERVE = 60
+
+# 各阶段输出所依赖的设置项；设置变化后对应阶段及之后的检查点自动失效
+_STAGE_SETTINGS = {
+    "extract": ("use_chrome_fallback",),
+    "images": ("use_chrome_fallback", "cloudinary_name", "image_options"),
+}
+
+
+class Extracted(NamedTuple):
+    """正文已提取（或从检查点恢复）"""
+    url: str
+    content: str
+
+
+class ImageDone(NamedTuple):
+    """一张图片处理完；new_url为None表示上传失败，保留原链接"""
+    url: str
+    new_url: Optional[str]
+    done: int
+    total: int
+
+
+class RewriteChunk(NamedTuple):
+    """流式改写收到一段文本；content为本次尝试已生成的全文，重试时从头开始"""
+    text: str
+    content: str
+
+
+class Finished(NamedTuple):
+    """处理结束（成功、复用近似重复文章或失败），result与run_pipeline的返回值相同"""
+    result: Dict[str, Any]
+
+
+def build_job(url: str, **settings) -> Dict[str, Any]:
+    """
+    组装一个处理任务，未指定的设置使用默认值
+
+    Args:
+        url: 文章URL，规范化后去掉跟踪参数
+        settings: 覆盖默认值的设置项，键与返回值中的字段一致
+
+    Returns:
+        可序列化（可跨进程传递）的任务字典
+    """
+    job = {
+        "url": article_url.canonicalize(url),
+        "firecrawl_key": "",
+        "gemini_key": "",
+        "cloudinary_name": "",
+        "cloudinary_key": "",
+        "cloudinary_secret": "",
+        "use_chrome_fallback": True,
+        "chrome_fast_load": True,
+        "use_cache": True,
+        "custom_prompt": None,
+        "compact_prompt": False,
+        "repair_structure": True,
+        "skip_duplicates": True,
+        "deadline_seconds": Deadline.DEFAULT_BUDGET,
+        "low_memory": False,
+        # 历史记录所属者：页面上的历史记录标识，批量任务默认为空字符串
+        "owner": "",
+        "image_options": {
+            "optimize": False,
+            "max_width": image_optimizer.DEFAULT_MAX_WIDTH,
+            "image_format": "webp",
+            "quality": image_optimizer.DEFAULT_QUALITY
+        }
+    }
+    job.update(settings)
+    return job
+
+
+def image_deadline(deadline: Deadline) -> Deadline:
+    """图片转存阶段使用的时限：在单篇时限的基础上为改写预留时间"""
+    return deadline.reserve(min(REWRITE_RESERVE, (deadline.budget or 0) / 3))
+
+
+def build_job_from_env(url: str, **settings) -> Dict[str, Any]:
+    """使用环境变量中的API密钥组装任务（变量名与secrets.toml一致）"""
+    credentials = {
+        "firecrawl_key": os.environ.get("FIRECRAWL_API_KEY", ""),
+        "gemini_key": os.environ.get("GEMINI_API_KEY", ""),
+        "cloudinary_name": os.environ.get("CLOUDINARY_CLOUD_NAME", ""),
+        "cloudinary_key": os.environ.get("CLOUDINARY_API_KEY", ""),
+        "cloudinary_secret": os.environ.get("CLOUDINARY_API_SECRET", "")
+    }
+    credentials.update(settings)
+    return build_job(url, **credentials)
+
+
+def checkpoint_key(job: Dict[str, Any], stage: str) -> str:
+    """检查点键：URL加上该阶段依赖的设置项的哈希"""
+    settings = {name: job[name] for name in _STAGE_SETTINGS[stage]}
+    return cache_store.make_key(stage, job["url"], settings)
+
+
+def load_checkpoint(job: Dict[str, Any], stage: str) -> Optional[str]:
+    """读取某阶段的检查点输出，不存在时返回None"""
+    return cache_store.get_cache().get(cache_store.CHECKPOINT, checkpoint_key(job, stage))
+
+
+def save_checkpoint(job: Dict[str, Any], stage: str, content: str):
+    """保存某阶段的输出"""
+    cache_store.get_cache().set(cache_store.CHECKPOINT, checkpoint_key(job, stage), content, ttl=CHECKPOINT_TTL)
+
+
+def clear_checkpoints(job: Dict[str, Any]):
+    """文章处理成功后清除其所有检查点"""
+    cache = cache_store.get_cache()
+    for stage in _STAGE_SETTINGS:
+        cache.delete(cache_store.CHECKPOINT, checkpoint_key(job, stage))
+
+
+def resume_stage(job: Dict[str, Any]) -> Optional[str]:
+    """
+    查找可以继续的位置
+
+    Returns:
+        最后一个已完成阶段的名称（extract或images），没有可用检查点或禁用缓存时返回None
+    """
+    if not job["use_cache"]:
+        return None
+    for stage in reversed(list(_STAGE_SETTINGS)):
+        if load_checkpoint(job, stage) is not None:
+            return stage
+    return None
+
+
+# 未缓存的文章达到该数量时才使用Firecrawl批量接口，数量少时逐篇抓取更快
+BATCH_EXTRACT_MIN_URLS = 5
+
+
+def prefetch_extractions(jobs, min_urls: int = BATCH_EXTRACT_MIN_URLS) -> int:
+    """
+    通过Firecrawl批量接口一次提交所有尚未缓存的文章，结果写入提取缓存，
+    之后各工作进程处理这些文章时直接命中缓存；批量抓取失败的文章仍按常规方式逐篇提取。
+    公众号文章可以直接解析静态HTML，比Firecrawl更快更省，不参与批量抓取
+
+    Args:
+        jobs: build_job返回的任务列表，禁用缓存、未配置Firecrawl密钥或支持静态HTML解析的任务不参与预取
+        min_urls: 待预取的文章少于该数量时不使用批量接口
+
+    Returns:
+        成功预取的文章数
+    """
+    import firecrawl_client
+    from chrome_extractor import StaticHtmlExtractor
+
+    cache = cache_store.get_cache()
+    pending = {}
+    for job in jobs:
+        if not (job["use_cache"] and job["firecrawl_key"]) or StaticHtmlExtractor.supports(job["url"]):
+            continue
+        if cache.get(cache_store.EXTRACT, cache_store.make_key(job["url"])) is None:
+            pending.setdefault(job["firecrawl_key"], []).append(job["url"])
+
+    prefetched = 0
+    for api_key, urls in pending.items():
+        if len(urls) < min_urls:
+            continue
+        for url, content in firecrawl_client.batch_scrape(urls, api_key).items():
+            if content:
+                cache.set(cache_store.EXTRACT, cache_store.make_key(url), content, ttl=cache_store.EXTRACT_TTL)
+                prefetched += 1
+    return prefetched
+
+
+def _duplicate_prompt_key(job: Dict[str, Any]) -> str:
+    """只有改写设置相同的近似重复文章才能复用改写结果"""
+    return cache_store.make_key(job["custom_prompt"], job["compact_prompt"], job["repair_structure"])
+
+
+def find_duplicate(job: Dict[str, Any], original_content: str, history_store,
+                   fingerprint: int = None) -> Optional[Dict[str, Any]]:
+    """
+    在已改写的文章中查找提取结果的近似重复
+
+    Args:
+        job: 任务字典，禁用缓存或skip_duplicates为False时不查找
+        original_content: 刚提取出的Markdown正文
+        history_store: 用于确认匹配到的历史记录仍然存在
+        fingerprint: 已算好的正文指纹，传入时不再重新计算
+
+    Returns:
+        dedup_index.DuplicateIndex.find的结果，额外包含历史记录正文content；未找到时返回None
+    """
+    if not (job["use_cache"] and job["skip_duplicates"]):
+        return None
+    if fingerprint is None:
+        fingerprint = dedup_index.simhash(original_content)
+    if not fingerprint:
+        # 正文太短（例如只有图片）时没有可比的指纹
+        return None
+    match = dedup_index.get_index().find(fingerprint, _duplicate_prompt_key(job))
+    if match is None:
+        return None
+    content = history_store.get_content(match["history_id"])
+    if content is None:
+        return None
+    return dict(match, content=content)
+
+
+def register_rewrite(job: Dict[str, Any], original_content: str, history_id: int, fingerprint: int = None):
+    """把改写完成的文章登记到近似重复索引；传入fingerprint时不再重新计算指纹，original_content可为None"""
+    if fingerprint is None:
+        fingerprint = dedup_index.simhash(original_content)
+    if not fingerprint:
+        return
+    dedup_index.get_index().add(fingerprint, job["url"], _duplicate_prompt_key(job), history_id)
+
+
+def run_pipeline(job: Dict[str, Any], on_event: Callable[[Any], None] = None) -> Dict[str, Any]:
+    """
+    执行一篇文章的完整处理流程
+
+    Args:
+        job: build_job返回的任务字典
+        on_event: 阶段事件回调，依次收到Extracted、若干ImageDone和RewriteChunk，最后一定收到Finished
+
+    Returns:
+        包含url、content、original_length、history_id、timings（各阶段耗时秒数）、
+        resumed_from（从哪个阶段的检查点继续，None表示从头开始）、duplicate_of（复用了哪篇
+        近似重复文章的改写结果）和error的字典；
+        失败时content为None，error为错误信息，已完成阶段的输出保留为检查点。
+        job["deadline_seconds"]限制整篇文章的处理时间，时限将到时跳过剩余图片转存和章节修复；
+        job["low_memory"]为True时按章节分段改写，适合超长文章
+    """
+    # 延迟导入：工作进程只在真正执行任务时才加载应用模块和SDK
+    from app import (extract_article, process_images_with_cloudinary, rewrite_with_gemini, repair_rewrite_sections,
+                     rewrite_segmented)
+    from history_store import HistoryStore
+
+    result = {"url": job["url"], "content": None, "original_length": 0, "history_id": None,
+              "timings": {}, "resumed_from": resume_stage(job), "duplicate_of": None, "error": None}
+    history_store = HistoryStore()
+    deadline = Deadline(job["deadline_seconds"])
+    emit = on_event or (lambda event: None)
+    try:
+        started = time.perf_counter()
+        original_content = load_checkpoint(job, "extract") if result["resumed_from"] else None
+        if original_content is None:
+            original_content = extract_article(
+                job["url"], job["firecrawl_key"], job["use_chrome_fallback"], job["use_cache"], job["chrome_fast_load"],
+                deadline
+            )
+            save_checkpoint(job, "extract", original_content)
+        result["original_length"] = len(original_content)
+        result["timings"]["extract"] = time.perf_counter() - started
+        emit(Extracted(job["url"], original_content))
+
+        # 同一篇文章的转载直接复用已有的改写结果，跳过图片转存和改写
+        # 指纹只算一次，查重和登记共用；之后不再需要原文
+        fingerprint = dedup_index.simhash(original_content)
+        duplicate = find_duplicate(job, original_content, history_store, fingerprint)
+        if duplicate:
+            history_item = history_store.add(
+                url=job["url"],
+                title=f"文章_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+                content=duplicate["content"],
+                owner=job["owner"]
+            )
+            result.update(history_id=history_item["id"], content=duplicate["content"], duplicate_of=duplicate["url"])
+            clear_checkpoints(job)
+            emit(Finished(result))
+            return result
+
+        started = time.perf_counter()
+        content_with_images = load_checkpoint(job, "images") if result["resumed_from"] == "images" else None
+        if content_with_images is None:
+            images_deadline = image_deadline(deadline)
+            content_with_images = process_images_with_cloudinary(
+                original_content,
+                job["cloudinary_name"],
+                job["cloudinary_key"],
+                job["cloudinary_secret"],
+                **job["image_options"],
+                deadline=images_deadline,
+                on_image=lambda url, new_url, done, total: emit(ImageDone(url, new_url, done, total))
+            )
+            # 时限已到时可能跳过了部分图片，不保存检查点，重试时补传剩余图片
+            if not images_deadline.expired():
+                save_checkpoint(job, "images", content_with_images)
+        result["timings"]["images"] = time.perf_counter() - started
+        # 改写阶段会产生若干份正文大小的中间结果，先释放不再使用的原文
+        original_content = None
+
+        started = time.perf_counter()
+        if job["low_memory"]:
+            # 逐段改写，不发送RewriteChunk事件
+            final_content = rewrite_segmented(
+                content_with_images, job["gemini_key"], job["custom_prompt"], job["compact_prompt"],
+                job["use_cache"], job["repair_structure"], deadline
+            )
+        else:
+            final_content = rewrite_with_gemini(
+                content_with_images, job["gemini_key"], job["custom_prompt"], job["compact_prompt"],
+                job["use_cache"], deadline,
+                # 没有事件订阅者时不使用流式接口
+                on_chunk=(lambda text, content: emit(RewriteChunk(text, content))) if on_event else None
+            )
+            if job["repair_structure"]:
+                final_content = repair_rewrite_sections(
+                    content_with_images, final_content, job["gemini_key"], job["custom_prompt"], deadline
+                )
+        result["timings"]["rewrite"] = time.perf_counter() - started
+
+        history_item = history_store.add(
+            url=job["url"],
+            title=f"文章_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+            content=final_content,
+            owner=job["owner"]
+        )
+        register_rewrite(job, None, history_item["id"], fingerprint)
+        result["history_id"] = history_item["id"]
+        result["content"] = final_content
+        clear_checkpoints(job)
+    except Exception as e:
+        result["error"] = str(e)
+    emit(Finished(result))
+    return result
+
+
+def stream_pipeline(job: Dict[str, Any]) -> Iterator[Any]:
+    """
+    在后台线程中执行run_pipeline，按发生顺序产出阶段事件，最后一个事件为Finished
+
+    用法:
+        for event in stream_pipeline(job):
+            if isinstance(event, RewriteChunk):
+                print(event.text, end="", flush=True)
+    """
+    events = queue.Queue()
+    worker = threading.Thread(target=run_pipeline, args=(job, events.put), daemon=True)
+    worker.start()
+    while True:
+        event = events.get()
+        yield event
+        if isinstance(event, Finished):
+            break
+    worker.join()
@@ -0,0 +1,96 @@
+"""
+Prompt压缩模块
+将Markdown中需要原样保留的长片段（图片/链接URL、代码块）替换为短占位符，
+改写完成后再精确还原，从而减少发送给模型的token数量
+"""
+import re
+from typing import Dict, List, Tuple
+
+import markdown_scanner
+
+
+PLACEHOLDER_RULE = "文中形如<<U1>>、<<C1>>的占位符代表链接或代码块，必须原样保留在原来的位置，不要修改、删除或翻译。"
+
+# 围栏代码块（```或~~~），整体作为一个原样片段
+_FENCE_PATTERN = re.compile(r"^(`{3,}|~{3,})[^\n]*\n.*?^\1[ \t]*$", re.MULTILINE | re.DOTALL)
+# 裸URL：只匹配RFC 3986允许的字符，中文正文和全角标点紧跟在URL后面时在此处结束
+_BARE_URL_PATTERN = re.compile(r"https?://[A-Za-z0-9\-._~:/?#@!$&*+,;=%]+")
+_PLACEHOLDER_PATTERN = re.compile(r"<<[UC]\d+>>")
+
+# 短于该长度的URL替换后收益不大，保持原样
+MIN_URL_LENGTH = 24
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的token数量（无需调用API）
+
+    中日韩字符按每字1个token计算，其余字符按每4个字符1个token计算。
+    """
+    cjk = sum(1 for ch in text if "一" <= ch <= "鿿" or "　" <= ch <= "ヿ")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def compact(markdown_text: str) -> Tuple[str, Dict[str, str]]:
+    """
+    将URL和代码块替换为短占位符
+
+    Args:
+        markdown_text: 原始Markdown文本
+
+    Returns:
+        (压缩后的文本, {占位符: 原始片段})，相同片段复用同一个占位符
+    """
+    placeholders = {}
+    reverse = {}
+    counters = {"U": 0, "C": 0}
+
+    def _placeholder(kind: str, span: str) -> str:
+        if span not in reverse:
+            counters[kind] += 1
+            key = f"<<{kind}{counters[kind]}>>"
+            reverse[span] = key
+            placeholders[key] = span
+        return reverse[span]
+
+    def _fence(match):
+        return _placeholder("C", match.group(0))
+
+    def _bare_url(match):
+        url = match.group(0)
+        if len(url) < MIN_URL_LENGTH:
+            return url
+        return _placeholder("U", url)
+
+    compacted = _FENCE_PATTERN.sub(_fence, markdown_text)
+    # 图片/链接目标（含引用定义和<img>标签）只替换URL本身，标题等保持原样
+    targets = markdown_scanner.scan(compacted, include_links=True)
+    compacted = markdown_scanner.replace_urls(compacted, {
+        span.url: _placeholder("U", span.url)
+        for span in targets
+        if len(span.url) >= MIN_URL_LENGTH and not _PLACEHOLDER_PATTERN.fullmatch(span.url)
+    }, targets)
+    compacted = _BARE_URL_PATTERN.sub(_bare_url, compacted)
+    return compacted, placeholders
+
+
+def restore(text: str, placeholders: Dict[str, str]) -> str:
+    """
+    将占位符还原为原始片段
+
+    Args:
+        text: 包含占位符的文本（通常是模型的改写结果）
+        placeholders: compact返回的映射
+
+    Returns:
+        还原后的文本；未知的占位符保持原样
+    """
+    if not placeholders:
+        return text
+    return _PLACEHOLDER_PATTERN.sub(lambda m: placeholders.get(m.group(0), m.group(0)), text)
+
+
+def missing_placeholders(text: str, placeholders: Dict[str, str]) -> List[str]:
+    """返回在改写结果中丢失的占位符列表"""
+    present = set(_PLACEHOLDER_PATTERN.findall(text))
+    return [key for key in placeholders if key not in present]
@@ -0,0 +1,162 @@
+"""
+改写结果结构校验模块
+对比原文与改写结果的Markdown结构（图片链接、标题、代码块），
+定位出问题的章节，以便只重新改写受影响的部分，而不是整篇文章
+"""
+import re
+from typing import Dict, List, Any, Iterator, Tuple
+
+import markdown_scanner
+
+
+# 以下模式都用match从行首匹配；不写^，才能用pos参数在原文中按行偏移匹配
+_HEADING_PATTERN = re.compile(r"(#{1,6})\s+\S")
+_FENCE_PATTERN = re.compile(r"\s{0,3}(`{3,}|~{3,})")
+# 与str.splitlines(keepends=True)相同的分行规则
+_LINE_PATTERN = re.compile(r"[^\n\r\v\f\x1c-\x1e\x85\u2028\u2029]*(?:\r\n|[\n\r\v\f\x1c-\x1e\x85\u2028\u2029]|\Z)")
+
+
+def _line_spans(text: str) -> Iterator[Tuple[int, int]]:
+    """逐行返回(起始, 结束)偏移，不生成整篇的行列表"""
+    for match in _LINE_PATTERN.finditer(text):
+        if match.end() > match.start():
+            yield match.start(), match.end()
+
+
+def section_spans(markdown_text: str) -> List[Tuple[int, int]]:
+    """
+    按ATX标题（#）拆分章节，返回每个章节在原文中的(起始, 结束)偏移，代码块内的#不会被当作标题
+
+    只记录偏移、不复制正文，长文章按需切片处理。章节划分与split_sections一致。
+    """
+    spans = []
+    start = 0
+    fence = None
+
+    for line_start, line_end in _line_spans(markdown_text):
+        fence_match = _FENCE_PATTERN.match(markdown_text, line_start, line_end)
+        if fence_match:
+            marker = fence_match.group(1)
+            if fence is None:
+                fence = marker
+            elif marker[0] == fence[0] and len(marker) >= len(fence):
+                fence = None
+        elif fence is None and _HEADING_PATTERN.match(markdown_text, line_start, line_end):
+            spans.append((start, line_start))
+            start = line_start
+
+    spans.append((start, len(markdown_text)))
+    return spans
+
+
+def split_sections(markdown_text: str) -> List[str]:
+    """
+    按ATX标题（#）将Markdown拆分为章节，代码块内的#不会被当作标题
+
+    第一个章节是首个标题之前的内容（可能为空字符串），之后每个章节以标题行开头。
+    所有章节拼接后与原文完全一致。
+    """
+    return [markdown_text[start:end] for start, end in section_spans(markdown_text)]
+
+
+def segment_spans(markdown_text: str, max_chars: int) -> List[Tuple[int, int]]:
+    """
+    把相邻章节合并为不超过max_chars字符的分段，返回每段的(起始, 结束)偏移
+
+    分段只在章节边界切开，单个章节超过max_chars时独立成段。所有分段首尾相接覆盖全文，
+    用于超长文章逐段处理，任一时刻只需持有一段正文的副本。
+    """
+    segments = []
+    start = end = 0
+    for section_start, section_end in section_spans(markdown_text):
+        if section_end - start > max_chars and end > start:
+            segments.append((start, end))
+            start = section_start
+        end = section_end
+    if end > start or not segments:
+        segments.append((start, end))
+    return segments
+
+
+def section_structure(section: str) -> Dict[str, Any]:
+    """
+    提取单个章节的结构信息
+
+    Returns:
+        包含heading_level（无标题时为0）、images（图片URL列表）、
+        fences（代码块数量）和unclosed_fence（是否存在未闭合代码块）的字典
+    """
+    heading = _HEADING_PATTERN.match(section)
+    fences = 0
+    fence = None
+    for line in section.splitlines():
+        fence_match = _FENCE_PATTERN.match(line)
+        if not fence_match:
+            continue
+        marker = fence_match.group(1)
+        if fence is None:
+            fence = marker
+            fences += 1
+        elif marker[0] == fence[0] and len(marker) >= len(fence):
+            fence = None
+
+    return {
+        "heading_level": len(heading.group(1)) if heading else 0,
+        "images": markdown_scanner.image_urls(section),
+        "fences": fences,
+        "unclosed_fence": fence is not None
+    }
+
+
+def validate(original: str, rewritten: str) -> List[Dict[str, Any]]:
+    """
+    对比原文与改写结果的结构差异
+
+    Args:
+        original: 改写前的Markdown
+        rewritten: 改写后的Markdown
+
+    Returns:
+        缺陷列表，每项包含section（章节序号，None表示无法定位到单个章节）、
+        type（heading/image/code_fence）和detail。列表为空表示结构一致。
+    """
+    original_sections = split_sections(original)
+    rewritten_sections = split_sections(rewritten)
+
+    original_structures = [section_structure(s) for s in original_sections]
+    rewritten_structures = [section_structure(s) for s in rewritten_sections]
+
+    original_levels = [s["heading_level"] for s in original_structures[1:]]
+    rewritten_levels = [s["heading_level"] for s in rewritten_structures[1:]]
+    if original_levels != rewritten_levels:
+        # 标题结构变了，章节无法一一对应，只能整体处理
+        return [{
+            "section": None,
+            "type": "heading",
+            "detail": f"标题结构不一致: 原文 {len(original_levels)} 个标题，改写后 {len(rewritten_levels)} 个"
+        }]
+
+    defects = []
+    for index, (before, after) in enumerate(zip(original_structures, rewritten_structures)):
+        missing = [url for url in before["images"] if url not in after["images"]]
+        if missing:
+            defects.append({
+                "section": index,
+                "type": "image",
+                "detail": f"丢失 {len(missing)} 个图片链接: {', '.join(missing[:3])}"
+            })
+        if after["unclosed_fence"] or after["fences"] != before["fences"]:
+            defects.append({
+                "section": index,
+                "type": "code_fence",
+                "detail": f"代码块不一致: 原文 {before['fences']} 个，改写后 {after['fences']} 个"
+                          + ("（存在未闭合代码块）" if after["unclosed_fence"] else "")
+            })
+    return defects
+
+
+def defective_sections(defects: List[Dict[str, Any]]) -> List[int]:
+    """返回需要重新改写的章节序号（去重并排序）；存在无法定位的缺陷时返回空列表"""
+    if any(defect["section"] is None for defect in defects):
+        return []
+    return sorted({defect["section"] for defect in defects})
@@ -0,0 +1,67 @@
+"""
+请求合并模块
+同一个键的并发调用只执行一次，其余调用等待并共享同一个结果（或异常），
+用于避免多人同时提交同一篇文章时重复提取和重复改写
+"""
+import threading
+from typing import Any, Callable, Dict
+
+
+class _Call:
+    """一次进行中的调用"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """进程内的请求合并器，线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        执行fn并返回其结果；若相同key的调用正在进行，则等待它完成并返回同一个结果
+
+        Args:
+            key: 合并键，通常是缓存键
+            fn: 实际执行的无参函数
+
+        Raises:
+            fn抛出的异常，所有等待者都会收到同一个异常
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # 先移除再唤醒，之后到达的调用会重新执行而不是拿到旧结果
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self, key: str) -> bool:
+        """相同key的调用是否正在进行"""
+        with self._lock:
+            return key in self._calls
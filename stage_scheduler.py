@@ -0,0 +1,310 @@
+"""
+阶段调度模块
+页面上的交互式请求和worker_pool、bulk_rewrite的批量任务共用同一批服务商（Firecrawl、Cloudinary、Gemini）。
+提取、图片转存和改写各有固定数量的并发槽位，所有进程通过同一个SQLite文件排队领取：
+
+- 分为interactive（编辑在页面上提交的文章）和batch（批量任务）两条通道，各进程设置自己的默认通道
+- 槽位空出时按通道权重做加权公平分配：比较各通道最近一段时间内获得的槽位数与权重之比，
+  编辑提交的单篇文章不会排在上百篇积压文章之后
+- 等待超过aging秒的请求直接按先来后到放行，批量任务不会被持续到来的交互式请求饿死
+
+各阶段的槽位数默认见STAGE_CAPACITY，可用环境变量WRITERE_STAGE_CAPACITY调整：
+一个整数表示所有阶段相同，或按阶段指定，例如 "extract=8,images=8,rewrite=6"
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from deadline import Deadline
+
+
+DEFAULT_SCHEDULER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data", "scheduler.db")
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+LANE_WEIGHTS = {INTERACTIVE: 4, BATCH: 1}
+STAGE_CAPACITY = {"extract": 4, "images": 4, "rewrite": 4}
+STAGE_NAMES = {"extract": "内容提取", "images": "图片转存", "rewrite": "AI改写"}
+
+# 等待超过该秒数的请求不再参与加权比较，按排队顺序优先放行
+AGING_SECONDS = 30
+# 加权公平分配统计的时间窗口
+SHARE_WINDOW = 60
+# 持有者进程崩溃时槽位的最长占用时间
+LEASE_TTL = 15 * 60
+# 排队者超过该秒数没有刷新，视为已退出
+WAITER_TTL = 10
+
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 0.5
+
+_default_lane = INTERACTIVE
+
+
+def set_default_lane(lane: str):
+    """设置当前进程的默认通道；批量处理的进程启动时设为BATCH"""
+    global _default_lane
+    if lane not in LANE_WEIGHTS:
+        raise ValueError(f"未知的调度通道: {lane}")
+    _default_lane = lane
+
+
+def get_default_lane() -> str:
+    """返回当前进程的默认通道"""
+    return _default_lane
+
+
+class StageScheduler:
+    """跨进程的阶段并发槽位调度器，线程安全"""
+
+    def __init__(self, db_path: str = DEFAULT_SCHEDULER_PATH, capacity: Dict[str, int] = None,
+                 weights: Dict[str, float] = None, aging: float = AGING_SECONDS):
+        """
+        Args:
+            db_path: 调度数据库路径，共享调度的进程必须使用同一个文件
+            capacity: {阶段: 并发槽位数}，默认STAGE_CAPACITY
+            weights: {通道: 权重}，默认LANE_WEIGHTS
+            aging: 等待超过该秒数的请求优先放行
+        """
+        self.db_path = db_path
+        self.capacity = dict(STAGE_CAPACITY, **(capacity or {}))
+        self.weights = dict(weights or LANE_WEIGHTS)
+        self.aging = aging
+        self._local = threading.local()
+        # 同一进程内释放槽位时立即唤醒等待的线程，不必等到下一次轮询
+        self._released = threading.Condition()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS slots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                stage TEXT NOT NULL,
+                lane TEXT NOT NULL,
+                acquired_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS waiters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                stage TEXT NOT NULL,
+                lane TEXT NOT NULL,
+                enqueued_at REAL NOT NULL,
+                seen_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS grants (
+                stage TEXT NOT NULL,
+                lane TEXT NOT NULL,
+                granted_at REAL NOT NULL,
+                waited REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_slots_stage ON slots(stage);
+            CREATE INDEX IF NOT EXISTS idx_waiters_stage ON waiters(stage, enqueued_at);
+            CREATE INDEX IF NOT EXISTS idx_grants_stage ON grants(stage, granted_at);
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        # 与DiskCache相同：每个线程一个连接，按进程号区分，多进程依靠WAL和文件锁
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _next_waiter(self, conn: sqlite3.Connection, stage: str, now: float) -> Optional[int]:
+        """按老化和加权公平规则选出下一个应获得槽位的排队者"""
+        waiters = conn.execute(
+            "SELECT id, lane, enqueued_at FROM waiters WHERE stage = ? ORDER BY enqueued_at, id", (stage,)
+        ).fetchall()
+        if not waiters:
+            return None
+        for waiter_id, _, enqueued_at in waiters:
+            if now - enqueued_at >= self.aging:
+                return waiter_id
+
+        heads = {}
+        for waiter_id, lane, _ in waiters:
+            heads.setdefault(lane, waiter_id)
+        granted = dict(conn.execute(
+            "SELECT lane, COUNT(*) FROM grants WHERE stage = ? AND granted_at >= ? GROUP BY lane",
+            (stage, now - SHARE_WINDOW)
+        ).fetchall())
+        # 最近获得的槽位数与权重之比最小的通道优先；相同时权重高的优先
+        lane = min(heads, key=lambda name: (granted.get(name, 0) / self.weights[name], -self.weights[name]))
+        return heads[lane]
+
+    def _try_grant(self, conn: sqlite3.Connection, stage: str, waiter_id: int, lane: str,
+                   enqueued_at: float) -> Optional[int]:
+        """轮到该排队者且有空闲槽位时领取槽位，返回槽位ID；lane为排队者当前所在的通道"""
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            refreshed = conn.execute(
+                "UPDATE waiters SET seen_at = ?, lane = ? WHERE id = ?", (now, lane, waiter_id)
+            ).rowcount
+            if not refreshed:
+                # 排队者仍在等待，但刷新间隔超过了WAITER_TTL（例如长时间等待数据库锁），
+                # 记录已被当作退出的排队者清理；按原排队时间重新登记，否则永远轮不到
+                conn.execute(
+                    "INSERT INTO waiters (id, stage, lane, enqueued_at, seen_at) VALUES (?, ?, ?, ?, ?)",
+                    (waiter_id, stage, lane, enqueued_at, now)
+                )
+            conn.execute("DELETE FROM slots WHERE expires_at < ?", (now,))
+            conn.execute("DELETE FROM waiters WHERE seen_at < ?", (now - WAITER_TTL,))
+            conn.execute("DELETE FROM grants WHERE granted_at < ?", (now - SHARE_WINDOW,))
+
+            active = conn.execute("SELECT COUNT(*) FROM slots WHERE stage = ?", (stage,)).fetchone()[0]
+            if active >= self.capacity[stage] or self._next_waiter(conn, stage, now) != waiter_id:
+                conn.execute("COMMIT")
+                return None
+
+            lane, enqueued_at = conn.execute(
+                "SELECT lane, enqueued_at FROM waiters WHERE id = ?", (waiter_id,)
+            ).fetchone()
+            slot_id = conn.execute(
+                "INSERT INTO slots (stage, lane, acquired_at, expires_at) VALUES (?, ?, ?, ?)",
+                (stage, lane, now, now + LEASE_TTL)
+            ).lastrowid
+            conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+            conn.execute(
+                "INSERT INTO grants (stage, lane, granted_at, waited) VALUES (?, ?, ?, ?)",
+                (stage, lane, now, now - enqueued_at)
+            )
+            conn.execute("COMMIT")
+            return slot_id
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def acquire(self, stage: str, lane: str = None, deadline: Deadline = None,
+                promote: threading.Event = None) -> int:
+        """
+        排队领取一个阶段槽位，阻塞直到获得
+
+        Args:
+            stage: 阶段名称，extract、images或rewrite
+            lane: 调度通道，默认使用当前进程的默认通道
+            deadline: 单篇处理时限，排队时间计入时限
+            promote: 排队期间被设置时改到交互通道排队（例如有真实请求在等待这次预取）
+
+        Returns:
+            槽位ID，用完后传给release
+
+        Raises:
+            ValueError: 阶段或通道未知
+            DeadlineExceeded: 排队期间时限已到
+        """
+        lane = lane or _default_lane
+        if stage not in self.capacity:
+            raise ValueError(f"未知的处理阶段: {stage}")
+        if lane not in self.weights:
+            raise ValueError(f"未知的调度通道: {lane}")
+        deadline = deadline or Deadline()
+
+        conn = self._connect()
+        enqueued_at = time.time()
+        waiter_id = conn.execute(
+            "INSERT INTO waiters (stage, lane, enqueued_at, seen_at) VALUES (?, ?, ?, ?)",
+            (stage, lane, enqueued_at, enqueued_at)
+        ).lastrowid
+        slot_id = None
+        interval = POLL_INTERVAL
+        try:
+            while True:
+                current = INTERACTIVE if promote is not None and promote.is_set() else lane
+                slot_id = self._try_grant(conn, stage, waiter_id, current, enqueued_at)
+                if slot_id is not None:
+                    return slot_id
+                deadline.check(STAGE_NAMES.get(stage, stage))
+                with self._released:
+                    self._released.wait(deadline.timeout(interval, minimum=0.01))
+                interval = min(interval * 2, MAX_POLL_INTERVAL)
+        finally:
+            if slot_id is None:
+                conn.execute("DELETE FROM waiters WHERE id = ?", (waiter_id,))
+
+    def release(self, slot_id: int):
+        """归还槽位"""
+        self._connect().execute("DELETE FROM slots WHERE id = ?", (slot_id,))
+        with self._released:
+            self._released.notify_all()
+
+    @contextmanager
+    def slot(self, stage: str, lane: str = None, deadline: Deadline = None, promote: threading.Event = None):
+        """在with块内占用一个阶段槽位，参数同acquire"""
+        slot_id = self.acquire(stage, lane, deadline, promote)
+        try:
+            yield slot_id
+        finally:
+            self.release(slot_id)
+
+    def stats(self, stage: str) -> Dict[str, Dict[str, float]]:
+        """
+        阶段的调度统计
+
+        Returns:
+            {"active": {通道: 占用槽位数}, "waiting": {通道: 排队数},
+             "granted": {通道: 时间窗口内获得的槽位数}, "max_wait": {通道: 时间窗口内的最长排队秒数}}
+        """
+        conn = self._connect()
+        since = time.time() - SHARE_WINDOW
+        return {
+            "active": dict(conn.execute(
+                "SELECT lane, COUNT(*) FROM slots WHERE stage = ? GROUP BY lane", (stage,)
+            ).fetchall()),
+            "waiting": dict(conn.execute(
+                "SELECT lane, COUNT(*) FROM waiters WHERE stage = ? GROUP BY lane", (stage,)
+            ).fetchall()),
+            "granted": dict(conn.execute(
+                "SELECT lane, COUNT(*) FROM grants WHERE stage = ? AND granted_at >= ? GROUP BY lane", (stage, since)
+            ).fetchall()),
+            "max_wait": dict(conn.execute(
+                "SELECT lane, MAX(waited) FROM grants WHERE stage = ? AND granted_at >= ? GROUP BY lane", (stage, since)
+            ).fetchall()),
+        }
+
+
+def capacity_from_env(value: str = None) -> Dict[str, int]:
+    """
+    解析WRITERE_STAGE_CAPACITY（或传入的value）中的槽位数配置
+
+    Returns:
+        {阶段: 槽位数}，未配置时为空字典
+
+    Raises:
+        ValueError: 格式错误、阶段未知或槽位数小于1
+    """
+    value = (os.environ.get("WRITERE_STAGE_CAPACITY", "") if value is None else value).strip()
+    if not value:
+        return {}
+    if value.isdigit():
+        capacity = {stage: int(value) for stage in STAGE_CAPACITY}
+    else:
+        capacity = {}
+        for item in value.split(","):
+            stage, _, count = item.partition("=")
+            stage = stage.strip()
+            if stage not in STAGE_CAPACITY or not count.strip().isdigit():
+                raise ValueError(f"无法解析阶段槽位配置: {item}")
+            capacity[stage] = int(count)
+    if any(count < 1 for count in capacity.values()):
+        raise ValueError(f"阶段槽位数至少为1: {value}")
+    return capacity
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> StageScheduler:
+    """返回当前进程的默认调度器（所有进程共享同一个数据库文件）"""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = StageScheduler(
+                os.environ.get("WRITERE_SCHEDULER_PATH", DEFAULT_SCHEDULER_PATH), capacity_from_env()
+            )
+        return _default_scheduler
@@ -94,6 +94,1085 @@ def test_api_structure():
     print("Cloudinary响应结构:", json.dumps(mock_cloudinary_response, indent=2, ensure_ascii=False))
     print("Gemini响应结构:", json.dumps(mock_gemini_response, indent=2, ensure_ascii=False))
 
+def test_prompt_compaction():
+    """测试Prompt压缩与还原"""
+    print("\n🗜️ 测试Prompt压缩...")
+    
+    from prompt_compactor import compact, restore, estimate_tokens, missing_placeholders
+    
+    test_markdown = """
+# 测试文章
+
+![图片1](https://mmbiz.qpic.cn/mmbiz_jpg/xxx1/640?wx_fmt=jpeg "封面")
+详见 [原文](https://mp.weixin.qq.com/s/abcdefghijklmnop) 或 https://example.com/a/long/bare/url
+
+```python
+print("https://example.com/inside/code/block")
+```
+
+![图片1](https://mmbiz.qpic.cn/mmbiz_jpg/xxx1/640?wx_fmt=jpeg)
+"""
+    
+    compacted, placeholders = compact(test_markdown)
+    assert "mmbiz.qpic.cn" not in compacted
+    assert "```" not in compacted
+    assert compacted.count("<<U1>>") == 2, "相同URL应复用同一个占位符"
+    assert restore(compacted, placeholders) == test_markdown
+    assert estimate_tokens(compacted) < estimate_tokens(test_markdown)
+    assert missing_placeholders(compacted.replace("<<C1>>", ""), placeholders) == ["<<C1>>"]
+    
+    # 中文正文里URL后面通常没有空格，占位符不能吞掉后面的文字
+    chinese = "详情请访问https://example.com/a/long/path/here，这是一段很长的中文正文内容需要改写。"
+    compacted, placeholders = compact(chinese)
+    assert compacted == "详情请访问<<U1>>，这是一段很长的中文正文内容需要改写。", compacted
+    assert placeholders["<<U1>>"] == "https://example.com/a/long/path/here"
+    assert restore(compacted, placeholders) == chinese
+    
+    print(f"✅ 替换 {len(placeholders)} 处片段，约 {estimate_tokens(test_markdown)} → {estimate_tokens(compacted)} tokens")
+
+def test_markdown_scanner():
+    """测试Markdown图片扫描"""
+    print("\n🔍 测试图片扫描...")
+    
+    from markdown_scanner import scan, image_urls, replace_urls
+    
+    test_markdown = """![封面](https://mmbiz.qpic.cn/a.png "标题") 正文提到 https://mmbiz.qpic.cn/a.png
+![引用图][pic] 和 [![带链接](https://mmbiz.qpic.cn/b.png)](https://example.com)
+<img class="rich" data-src="https://mmbiz.qpic.cn/c.png">
+```
+![代码中的图片](https://mmbiz.qpic.cn/code.png)
+```
+![封面](https://mmbiz.qpic.cn/a.png)
+
+[pic]: https://mmbiz.qpic.cn/d.png
+"""
+    
+    assert image_urls(test_markdown) == [
+        "https://mmbiz.qpic.cn/a.png",
+        "https://mmbiz.qpic.cn/b.png",
+        "https://mmbiz.qpic.cn/c.png",
+        "https://mmbiz.qpic.cn/d.png",
+    ], "应识别标题、引用式、带链接的图片和<img>标签，去重并跳过代码块"
+    assert scan(test_markdown)[0].title == "标题"
+    
+    replaced = replace_urls(test_markdown, {"https://mmbiz.qpic.cn/a.png": "https://res.cloudinary.com/a.png"})
+    assert replaced.count("https://res.cloudinary.com/a.png") == 2
+    assert "正文提到 https://mmbiz.qpic.cn/a.png" in replaced, "正文中的相同文字不应被替换"
+    
+    # 未闭合的<img不影响之后的图片；标签中可以有成对的方括号
+    assert image_urls("<img src=x\n![a](http://x/2.png)") == ["http://x/2.png"]
+    assert image_urls("![a [b] c](http://x/1.png)") == ["http://x/1.png"]
+    assert image_urls("![a](http://x/1.png) [注] ![b [c]](http://x/2.png)") == ["http://x/1.png", "http://x/2.png"]
+    
+    # 只有简单内联图片时走快速路径，结果应与逐个候选的扫描完全相同（末尾的<img强制走逐个扫描）
+    for simple in (
+        '![a](http://x/1.png "标题") 正文 ![](<http://x/2 b.png>)\n![c](\n  http://x/3.png \'t\' )',
+        "![a](http://x/1.png) ![b][ref]",
+        "![a](http://x/![b](http://x/2.png)",
+        "段落 [链接](http://x/page) ![图](http://x/1.png)",
+    ):
+        assert scan(simple) == scan(simple + "\n<img"), simple
+    
+    # 大量未闭合的图片语法不应导致回溯
+    assert scan("![x" * 20000) == []
+    assert scan("<img " * 20000) == []
+    assert scan("![[" * 20000 + "]") == []
+    
+    print("✅ 图片扫描正常")
+
+def test_wechat_html():
+    """测试公众号静态HTML解析"""
+    print("\n📰 测试静态HTML解析...")
+    
+    from wechat_html import to_markdown, detect_blocked
+    
+    page = """<html><head><meta property="og:title" content="测试&amp;文章"></head><body>
+<div class="rich_media_content" id="js_content" style="visibility: hidden;">
+<section><h2>第一节</h2><p>这是<strong>重点</strong>内容，见<a href="https://example.com">链接</a>。</p>
+<p><img data-src="https://mmbiz.qpic.cn/1.png" src="data:image/gif;base64,xx"></p>
+<ul><li>要点一</li></ul><script>track()</script></section></div>
+<div id="js_pc_qr_code">扫码关注</div></body></html>"""
+    
+    markdown = to_markdown(page)
+    assert markdown.startswith("# 测试&文章\n\n## 第一节")
+    assert "这是**重点**内容，见[链接](https://example.com)。" in markdown
+    assert "![](https://mmbiz.qpic.cn/1.png)" in markdown, "图片地址应取自data-src"
+    assert "- 要点一" in markdown
+    assert "track()" not in markdown and "扫码关注" not in markdown
+    
+    # 省略了</p>、</li>的正文在正文元素结束时一并关闭，之后的页面内容不应混入
+    unclosed = """<html><body><div id="js_content"><p>第一段<p>第二段<ul><li>甲<li>乙</ul></div>
+<div id="js_pc_qr_code">扫码关注</div><footer>页脚文字</footer></body></html>"""
+    assert to_markdown(unclosed) == "第一段\n\n第二段\n\n- 甲\n\n- 乙", to_markdown(unclosed)
+    
+    verify_page = "<html><body><p>环境异常</p><p>完成验证后即可继续访问</p></body></html>"
+    assert to_markdown(verify_page) == ""
+    assert detect_blocked(verify_page) is not None
+    
+    print("✅ 静态HTML解析正常")
+
+def test_image_optimizer():
+    """测试图片预处理（需要Pillow）"""
+    print("\n🖼️ 测试图片预处理...")
+    
+    import importlib.util
+    if importlib.util.find_spec("PIL") is None:
+        print("⚠️ 未安装Pillow，跳过图片预处理测试")
+        return
+    
+    import io
+    import random
+    from PIL import Image
+    from image_optimizer import optimize_image_bytes
+    
+    def encode(image, image_format, **options):
+        output = io.BytesIO()
+        image.save(output, format=image_format, **options)
+        return output.getvalue()
+    
+    # 超宽图片按比例缩小、转为WebP并去掉EXIF
+    exif = Image.Exif()
+    exif[0x010F] = "Camera"
+    photo = encode(Image.linear_gradient("L").resize((2000, 1000)).convert("RGB"), "JPEG", quality=95, exif=exif)
+    with Image.open(io.BytesIO(optimize_image_bytes(photo))) as result:
+        assert result.format == "WEBP" and result.size == (1280, 640)
+        assert not dict(result.getexif()) and "exif" not in result.info, "应去除元数据"
+    
+    # 去除EXIF前按方向标记旋转，竖拍的照片保持竖向
+    exif[0x0112] = 6
+    rotated = encode(Image.linear_gradient("L").resize((1200, 600)).convert("RGB"), "JPEG", quality=95, exif=exif)
+    with Image.open(io.BytesIO(optimize_image_bytes(rotated))) as result:
+        assert result.size == (600, 1200), "应按EXIF方向旋转"
+    
+    # 调色板图片先转为RGB再缩放：相邻两列灰度互补，缩小一半后应接近均匀的灰色，
+    # 最近邻插值会保留原来的随机灰度
+    random.seed(0)
+    stripes = Image.new("P", (2560, 64))
+    stripes.putpalette([level for level in range(256) for _ in range(3)])
+    levels = [random.randrange(256) for _ in range(1280 * 64)]
+    stripes.putdata([value for level in levels for value in (level, 255 - level)])
+    with Image.open(io.BytesIO(optimize_image_bytes(encode(stripes, "PNG"), image_format="jpeg"))) as result:
+        gray = list(result.convert("L").getdata())
+        mean = sum(gray) / len(gray)
+        spread = (sum((value - mean) ** 2 for value in gray) / len(gray)) ** 0.5
+        assert result.size == (1280, 32) and spread < 40, "缩放应使用LANCZOS插值"
+    
+    # 带透明通道的图片转JPEG时去掉透明通道
+    transparent = encode(Image.new("RGBA", (1600, 400), (255, 0, 0, 128)), "PNG")
+    with Image.open(io.BytesIO(optimize_image_bytes(transparent, image_format="jpeg"))) as result:
+        assert result.format == "JPEG" and result.mode == "RGB" and result.size == (1280, 320)
+    
+    # 动图保持原样
+    frames = [Image.new("RGB", (2000, 100), color) for color in ("red", "blue")]
+    animated = io.BytesIO()
+    frames[0].save(animated, format="GIF", save_all=True, append_images=frames[1:])
+    assert optimize_image_bytes(animated.getvalue()) == animated.getvalue(), "动图不应转码"
+    
+    # 处理后反而更大时返回原始字节
+    random.seed(0)
+    noise = Image.new("RGB", (64, 64))
+    noise.putdata([(random.randrange(256),) * 3 for _ in range(64 * 64)])
+    small = encode(noise, "JPEG", quality=5)
+    assert optimize_image_bytes(small, quality=100) == small
+    
+    try:
+        optimize_image_bytes(small, image_format="gif")
+        assert False, "不支持的格式应抛出ValueError"
+    except ValueError:
+        pass
+    
+    print("✅ 图片预处理正常")
+
+def test_rewrite_validation():
+    """测试改写结果结构校验"""
+    print("\n🩺 测试改写结构校验...")
+    
+    from rewrite_validator import split_sections, validate, defective_sections
+    
+    original = """导语 ![封面](https://example.com/cover.jpg)
+
+# 第一节
+正文 ![图片1](https://example.com/1.jpg)
+
+```bash
+# 这不是标题
+```
+
+## 第二节
+结尾
+"""
+    rewritten = """新导语 ![封面](https://example.com/cover.jpg)
+
+# 第一节
+改写后的正文
+
+```bash
+# 这不是标题
+```
+
+## 第二节
+新结尾
+"""
+    
+    sections = split_sections(original)
+    assert len(sections) == 3, "代码块中的#不应被识别为标题"
+    assert "".join(sections) == original
+    
+    assert validate(original, original) == []
+    defects = validate(original, rewritten)
+    assert [d["type"] for d in defects] == ["image"]
+    assert defective_sections(defects) == [1]
+    
+    broken = rewritten.replace("```bash", "").replace("## 第二节", "第二节")
+    assert defective_sections(validate(original, broken)) == [], "标题变化时无法定位到单个章节"
+    
+    print(f"✅ 定位到缺陷章节: {defective_sections(defects)}")
+
+def test_history_store():
+    """测试磁盘历史记录的分页和搜索"""
+    print("\n📚 测试历史记录存储...")
+    
+    from history_store import HistoryStore
+    
+    store = HistoryStore(":memory:")
+    for i in range(25):
+        topic = "人工智能" if i % 5 == 0 else "日常随笔"
+        store.add(f"https://mp.weixin.qq.com/s/{i}", f"文章_{i}", f"# {topic}\n第{i}篇内容")
+    
+    assert store.count() == 25
+    first_page = store.list_page(1, 10)
+    assert len(first_page) == 10 and first_page[0]["title"] == "文章_24", "应按时间倒序分页"
+    assert "content" not in first_page[0], "分页摘要不应包含正文"
+    assert len(store.list_page(3, 10)) == 5
+    assert store.count("人工智能") == 5
+    assert store.count("AI") == 0
+    assert store.get_content(first_page[0]["id"]).startswith("# 日常随笔")
+    
+    # 页面会话只能看到自己的记录，未指定所属者时（批量任务、查重）可以读取全部
+    mine = store.add("https://mp.weixin.qq.com/s/mine", "我的文章", "# 人工智能\n会话A的内容", owner="session-a")
+    store.add("https://mp.weixin.qq.com/s/other", "别人的文章", "# 人工智能\n会话B的内容", owner="session-b")
+    assert store.count(owner="session-a") == 1 and store.count() == 27
+    assert store.count("人工智能", "session-a") == 1
+    assert [item["title"] for item in store.list_page(1, 10, owner="session-a")] == ["我的文章"]
+    assert store.get_content(mine["id"], "session-b") is None, "不应读取其他会话的记录"
+    assert store.get_content(mine["id"], "session-a") == store.get_content(mine["id"])
+    
+    # 超过保留上限时删除最早的记录，全文索引同步清理
+    capped = HistoryStore(":memory:", max_rows=3)
+    for i in range(5):
+        capped.add(f"https://mp.weixin.qq.com/s/{i}", f"文章_{i}", f"# 人工智能\n第{i}篇内容")
+    assert capped.count() == 3 and capped.count("人工智能") == 3
+    assert [item["title"] for item in capped.list_page(1, 10)] == ["文章_4", "文章_3", "文章_2"]
+    
+    print(f"✅ 分页与搜索正常（全文索引: {'启用' if store.fts_enabled else '未启用'}）")
+
+def test_client_cache():
+    """测试按凭据缓存客户端"""
+    print("\n🔐 测试客户端缓存...")
+    
+    from clients import get_cloudinary_client, get_selected_model_name, set_selected_model_name, template_hash
+    
+    client_a = get_cloudinary_client("cloud-a", "key-a", "secret-a")
+    assert get_cloudinary_client("cloud-a", "key-a", "secret-a") is client_a, "相同凭据应复用同一个客户端"
+    assert get_cloudinary_client("cloud-b", "key-b", "secret-b") is not client_a, "不同凭据应使用不同客户端"
+    
+    try:
+        get_cloudinary_client("cloud-a", "", "secret-a")
+        assert False, "凭据不完整时应抛出ValueError"
+    except ValueError:
+        pass
+    
+    set_selected_model_name("gemini-key-a", "gemini-2.5-flash")
+    assert get_selected_model_name("gemini-key-a") == "gemini-2.5-flash"
+    assert get_selected_model_name("gemini-key-b") is None
+    
+    assert template_hash("改写指令") == template_hash("改写指令"), "相同指令模板应得到相同哈希"
+    assert template_hash("改写指令") != template_hash("改写指令\n附加规则")
+    
+    # 带指令的模型超出上限时淘汰最久未使用的
+    import clients
+    previous_factory, previous_limit = clients.get_gemini_model, clients.MAX_INSTRUCTED_MODELS
+    clients.get_gemini_model = lambda api_key, model_name, **kwargs: object()
+    clients.MAX_INSTRUCTED_MODELS = 2
+    try:
+        first = clients.get_instructed_model("gemini-key-lru", "gemini-2.5-flash", "指令一")
+        second = clients.get_instructed_model("gemini-key-lru", "gemini-2.5-flash", "指令二")
+        assert clients.get_instructed_model("gemini-key-lru", "gemini-2.5-flash", "指令一") is first
+        clients.get_instructed_model("gemini-key-lru", "gemini-2.5-flash", "指令三")
+        assert clients.get_instructed_model("gemini-key-lru", "gemini-2.5-flash", "指令一") is first, "最近用过的模型应保留"
+        assert clients.get_instructed_model("gemini-key-lru", "gemini-2.5-flash", "指令二") is not second
+    finally:
+        clients.get_gemini_model, clients.MAX_INSTRUCTED_MODELS = previous_factory, previous_limit
+        clients._instructed_models.clear()
+    
+    print("✅ 客户端按凭据隔离并复用")
+
+def test_disk_cache():
+    """测试磁盘缓存的共享和过期"""
+    print("\n💾 测试磁盘缓存...")
+    
+    import tempfile
+    import time
+    from cache_store import DiskCache, make_key, EXTRACT
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "cache.db")
+        writer = DiskCache(db_path)
+        reader = DiskCache(db_path)
+        
+        key = make_key("https://mp.weixin.qq.com/s/abc123")
+        assert key == make_key("https://mp.weixin.qq.com/s/abc123")
+        writer.set(EXTRACT, key, "# 文章内容")
+        assert reader.get(EXTRACT, key) == "# 文章内容", "不同实例应共享同一个缓存文件"
+        assert reader.get("rewrite", key) is None, "不同命名空间互不影响"
+        
+        writer.set(EXTRACT, "expiring", {"a": 1}, ttl=0.01)
+        time.sleep(0.02)
+        assert reader.get(EXTRACT, "expiring", "expired") == "expired"
+    
+    print("✅ 缓存共享与过期正常")
+
+def test_duplicate_index():
+    """测试近似重复文章检测"""
+    print("\n🔁 测试近似重复检测...")
+    
+    import tempfile
+    from dedup_index import DuplicateIndex, simhash, hamming_distance, normalize
+    
+    article = "# 大模型发展简史\n\n本文回顾了大语言模型从统计方法到深度学习的演进过程。![](https://mmbiz.qpic.cn/a.png)\n" * 10
+    repost = article.replace("https://mmbiz.qpic.cn/a.png", "https://res.cloudinary.com/demo/a.webp") + "\n原文转载自某公众号"
+    other = "# 家常菜做法\n\n红烧肉需要先焯水，再用冰糖炒出糖色。\n" * 10
+    
+    assert hamming_distance(simhash(article), simhash(repost)) <= 3, "转载文章应判定为近似重复"
+    assert hamming_distance(simhash(article), simhash(other)) > 3, "不同文章不应判定为重复"
+    assert normalize("详情请访问https://example.com/a，红烧肉需要先焯水") == "详情请访问，红烧肉需要先焯水", \
+        "URL后面紧跟的中文正文应保留"
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index = DuplicateIndex(os.path.join(tmp_dir, "cache.db"))
+        index.add(simhash(article), "https://mp.weixin.qq.com/s/original", "prompt-a", 1)
+        
+        match = index.find(simhash(repost), "prompt-a")
+        assert match["history_id"] == 1 and match["url"] == "https://mp.weixin.qq.com/s/original"
+        assert index.find(simhash(repost), "prompt-b") is None, "改写指令不同时不应复用"
+        assert index.find(simhash(other), "prompt-a") is None
+    
+    # 只有图片的文章没有可比的正文，不同文章之间不应互相匹配
+    import dedup_index
+    import pipeline
+    from history_store import HistoryStore
+    gallery = "![](https://mmbiz.qpic.cn/a.png)\n\n![图片](https://mmbiz.qpic.cn/b.png)\n"
+    another_gallery = "![](https://mmbiz.qpic.cn/c.png)\n\n![](https://mmbiz.qpic.cn/d.png)\n"
+    assert simhash(gallery) == simhash(another_gallery) == 0
+    
+    previous_index = dedup_index._default_index
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dedup_index._default_index = DuplicateIndex(os.path.join(tmp_dir, "cache.db"))
+        try:
+            store = HistoryStore(os.path.join(tmp_dir, "history.db"))
+            job = pipeline.build_job("https://mp.weixin.qq.com/s/gallery")
+            item = store.add(url=job["url"], title="图集", content="改写结果")
+            pipeline.register_rewrite(job, gallery, item["id"])
+            other_job = pipeline.build_job("https://mp.weixin.qq.com/s/another-gallery")
+            assert pipeline.find_duplicate(other_job, another_gallery, store) is None, "不同的纯图片文章不应判定为重复"
+            assert pipeline.find_duplicate(other_job, gallery, store) is None
+        finally:
+            dedup_index._default_index = previous_index
+    
+    print("✅ 近似重复检测正常")
+
+def test_memory_bounded():
+    """测试超长文章处理的内存峰值"""
+    print("\n📏 测试长文章内存占用...")
+    
+    import sys
+    import hashlib
+    import tracemalloc
+    import prompt_compactor
+    from dedup_index import simhash, normalize
+    from rewrite_validator import segment_spans, validate
+    
+    def peak_ratio(function, text):
+        tracemalloc.start()
+        try:
+            function(text)
+            return tracemalloc.get_traced_memory()[1] / sys.getsizeof(text)
+        finally:
+            tracemalloc.stop()
+    
+    # 分块统计的指纹应与逐个特征统计的结果完全一致
+    sample = "# 大模型发展简史\n\n本文回顾了大语言模型的演进过程。![](https://mmbiz.qpic.cn/a.png)\n" * 200
+    text = normalize(sample)
+    hashes = [
+        int.from_bytes(hashlib.blake2b(text[i:i + 4].encode("utf-8"), digest_size=8).digest(), "big")
+        for i in range(len(text) - 3)
+    ]
+    expected = 0
+    for bit in range(63, -1, -1):
+        ones = sum(value >> bit & 1 for value in hashes)
+        expected = (expected << 1) | (ones > len(hashes) / 2)
+    assert simhash(sample) == expected, "分块统计后指纹不应改变"
+    
+    lines = []
+    for i in range(600):
+        lines.append(f"## 第{i}节\n")
+        lines.append("这是一段用于测试的正文内容，包含[普通链接](https://example.com/page) 和一些文字。" * 3)
+        lines.append(f"![配图{i}](https://mmbiz.qpic.cn/mmbiz_png/{i % 50:04d}/640?wx_fmt=png)\n")
+    article = "\n".join(lines)
+    
+    segments = segment_spans(article, 20000)
+    assert "".join(article[start:end] for start, end in segments) == article, "分段应首尾相接覆盖全文"
+    assert len(segments) > 1 and all(end - start <= 20000 for start, end in segments)
+    
+    # 峰值应为正文大小的固定倍数，而不是随特征数量增长
+    assert peak_ratio(simhash, article) < 5, "指纹计算的内存峰值过高"
+    assert peak_ratio(lambda text: segment_spans(text, 20000), article) < 1, "分段只应记录偏移"
+    
+    try:
+        import app
+    except ImportError:
+        print("⚠️ 未安装应用依赖，跳过低内存模式的整体测试")
+        return
+    
+    def rewrite_segment(segment, *args, **kwargs):
+        # 代替Gemini：压缩、原样还原并校验结构，改写结果与原文相同
+        compacted, placeholders = prompt_compactor.compact(segment)
+        rewritten = prompt_compactor.restore(compacted, placeholders)
+        assert not validate(segment, rewritten)
+        return rewritten
+    
+    def low_memory_flow(text):
+        # 与低内存模式相同：转存替换、指纹，再逐段改写后拼接
+        text = app.process_images_with_cloudinary(text, "demo", "key", "secret")
+        simhash(text)
+        return app.rewrite_segmented(text, "key", repair_structure=False, max_chars=20000)
+    
+    upload, rewrite = app.upload_images_to_cloudinary, app.rewrite_with_gemini
+    app.upload_images_to_cloudinary = lambda urls, *args, **kwargs: {url: url + "?uploaded" for url in urls}
+    app.rewrite_with_gemini = rewrite_segment
+    try:
+        result = low_memory_flow(article)
+        assert result == article.replace("640?wx_fmt=png", "640?wx_fmt=png?uploaded"), "分段改写后应按原顺序拼接"
+        assert peak_ratio(low_memory_flow, article) < 6, "低内存模式的内存峰值过高"
+    finally:
+        app.upload_images_to_cloudinary, app.rewrite_with_gemini = upload, rewrite
+    
+    print("✅ 长文章内存占用正常")
+
+def test_url_canonicalization():
+    """测试公众号URL规范化"""
+    print("\n🔗 测试URL规范化...")
+    
+    from article_url import canonicalize
+    
+    assert canonicalize("http://mp.weixin.qq.com/s/AbC123?chksm=ab&scene=21#wechat_redirect") == \
+        "https://mp.weixin.qq.com/s/AbC123"
+    long_url = "https://mp.weixin.qq.com/s?__biz=MzA3&mid=2650&idx=1&sn=abc&chksm=84&scene=21&sessionid=123#rd"
+    reordered = "https://mp.weixin.qq.com/s?sn=abc&idx=1&mid=2650&__biz=MzA3&scene=126"
+    assert canonicalize(long_url) == canonicalize(reordered) == \
+        "https://mp.weixin.qq.com/s?__biz=MzA3&mid=2650&idx=1&sn=abc"
+    assert canonicalize("https://example.com/post?id=3&utm_source=x#top") == "https://example.com/post?id=3"
+    assert canonicalize("https://example.com/post?flag&from=home&spm=a.b") == "https://example.com/post?flag&from=home&spm=a.b"
+    assert canonicalize("https://example.com/post?utm_medium=x&q=a%20b&flag") == "https://example.com/post?q=a%20b&flag"
+    assert canonicalize("https://example.com/#/article/1?utm_source=x") == "https://example.com/#/article/1?utm_source=x"
+    assert canonicalize("https://example.com/?utm_source=x#!/post/2") == "https://example.com/#!/post/2"
+    
+    print("✅ URL规范化正常")
+
+def test_single_flight():
+    """测试并发请求合并"""
+    print("\n🛫 测试请求合并...")
+    
+    import threading
+    import time
+    from single_flight import SingleFlight
+    
+    flight = SingleFlight()
+    calls = []
+    
+    def slow_extract():
+        calls.append(1)
+        time.sleep(0.05)
+        return "# 文章内容"
+    
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("same-article", slow_extract)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(calls) == 1, "并发的相同请求只应执行一次"
+    assert results == ["# 文章内容"] * 5
+    assert not flight.in_flight("same-article")
+    assert flight.do("same-article", slow_extract) == "# 文章内容" and len(calls) == 2, "完成后的新请求应重新执行"
+    
+    try:
+        import app
+    except ImportError:
+        print("⚠️ 未安装应用依赖，跳过改写合并的时限测试")
+        print("✅ 请求合并正常")
+        return
+    
+    import tempfile
+    import cache_store
+    from deadline import Deadline, DeadlineExceeded
+    
+    # 合并的改写因发起者的时限中止时，时限未到的等待者应重新改写
+    started = threading.Event()
+    
+    def rewrite_uncached(markdown_text, api_key, custom_prompt, compact_prompt, cache_key, deadline, *args):
+        if not started.is_set():
+            started.set()
+            while not deadline.expired():
+                time.sleep(0.01)
+            deadline.check("AI改写")
+        return "# 改写结果"
+    
+    outcomes = {}
+    
+    def rewrite(name, budget):
+        try:
+            outcomes[name] = app.rewrite_with_gemini("# 原文", "key", use_cache=False, deadline=Deadline(budget))
+        except Exception as e:
+            outcomes[name] = e
+    
+    previous = (cache_store._default_cache, app._rewrite_uncached)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_store._default_cache = cache_store.DiskCache(os.path.join(tmp_dir, "cache.db"))
+        app._rewrite_uncached = rewrite_uncached
+        try:
+            leader = threading.Thread(target=rewrite, args=("leader", 0.3))
+            leader.start()
+            started.wait(5)
+            waiter = threading.Thread(target=rewrite, args=("waiter", 0))
+            waiter.start()
+            leader.join(5)
+            waiter.join(5)
+        finally:
+            cache_store._default_cache, app._rewrite_uncached = previous
+    
+    assert isinstance(outcomes["leader"], DeadlineExceeded), "发起者自己的时限到了应报错"
+    assert outcomes["waiter"] == "# 改写结果", "等待者的时限未到时应重新改写"
+    
+    print("✅ 请求合并正常")
+
+def test_deadline():
+    """测试单篇处理时限"""
+    print("\n⏰ 测试处理时限...")
+    
+    from deadline import Deadline, DeadlineExceeded
+    
+    unlimited = Deadline(0)
+    assert unlimited.remaining() is None and not unlimited.expired()
+    assert unlimited.timeout(30) == 30, "不限制时使用原有的固定超时"
+    unlimited.check("AI改写")
+    
+    deadline = Deadline(10)
+    assert 0 < deadline.remaining() <= 10
+    assert deadline.timeout(30) <= 10, "超时不应超过剩余时间"
+    assert deadline.timeout(5) == 5
+    
+    images = deadline.reserve(60)
+    assert images.expired(), "预留时间超过剩余时间时子时限应已到期"
+    assert not deadline.expired(), "子时限不影响总时限"
+    assert images.timeout(30) == 1.0, "剩余时间不足时超时取下限"
+    try:
+        images.check("图片转存")
+        assert False, "时限已到时应抛出DeadlineExceeded"
+    except DeadlineExceeded as e:
+        assert isinstance(e, TimeoutError) and "图片转存" in str(e)
+    
+    print("✅ 处理时限正常")
+
+def test_stage_scheduler():
+    """测试阶段调度的通道优先级和老化"""
+    print("\n🚦 测试阶段调度...")
+    
+    import tempfile
+    import threading
+    import time
+    from deadline import Deadline, DeadlineExceeded
+    from stage_scheduler import StageScheduler, INTERACTIVE, BATCH, capacity_from_env
+    
+    def grant_order(scheduler, lanes):
+        """占满唯一的槽位后依次排队，释放后记录各通道获得槽位的顺序"""
+        order = []
+        
+        def wait(lane):
+            with scheduler.slot("rewrite", lane):
+                order.append(lane)
+        
+        holder = scheduler.acquire("rewrite", BATCH)
+        threads = []
+        for lane in lanes:
+            thread = threading.Thread(target=wait, args=(lane,))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.02)
+        scheduler.release(holder)
+        for thread in threads:
+            thread.join()
+        return order
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        scheduler = StageScheduler(os.path.join(tmp, "scheduler.db"), capacity={"rewrite": 1})
+        order = grant_order(scheduler, [BATCH, BATCH, INTERACTIVE])
+        assert order[0] == INTERACTIVE, "后到的交互式请求应先于积压的批量任务获得槽位"
+        
+        stats = scheduler.stats("rewrite")
+        assert not stats["active"] and not stats["waiting"], "槽位和排队记录应全部释放"
+        assert stats["granted"] == {BATCH: 3, INTERACTIVE: 1}
+        
+        holder = scheduler.acquire("rewrite", BATCH)
+        try:
+            scheduler.acquire("rewrite", INTERACTIVE, Deadline(0.1))
+            assert False, "排队超过时限应抛出DeadlineExceeded"
+        except DeadlineExceeded:
+            pass
+        scheduler.release(holder)
+        assert not scheduler.stats("rewrite")["waiting"], "超时的排队者应被移除"
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        aged = StageScheduler(os.path.join(tmp, "scheduler.db"), capacity={"rewrite": 1}, aging=0)
+        assert grant_order(aged, [BATCH, INTERACTIVE]) == [BATCH, INTERACTIVE], "等待超过老化时间的请求应按先后顺序放行"
+    
+    # 排队记录被当作已退出的排队者清理后，仍在等待的请求应重新登记并最终获得槽位
+    with tempfile.TemporaryDirectory() as tmp:
+        scheduler = StageScheduler(os.path.join(tmp, "scheduler.db"), capacity={"rewrite": 1})
+        holder = scheduler.acquire("rewrite", BATCH)
+        granted = []
+        waiter = threading.Thread(target=lambda: granted.append(scheduler.acquire("rewrite", INTERACTIVE, Deadline(5))))
+        waiter.start()
+        while not scheduler.stats("rewrite")["waiting"]:
+            time.sleep(0.01)
+        scheduler._connect().execute("DELETE FROM waiters")
+        scheduler.release(holder)
+        waiter.join(5)
+        assert granted, "被清理的排队者应重新登记"
+        scheduler.release(granted[0])
+    
+    assert capacity_from_env("") == {}
+    assert capacity_from_env("8") == {"extract": 8, "images": 8, "rewrite": 8}
+    assert capacity_from_env("extract=6, rewrite=2") == {"extract": 6, "rewrite": 2}
+    for invalid in ("0", "upload=3", "extract=many"):
+        try:
+            capacity_from_env(invalid)
+            assert False, f"应拒绝槽位配置: {invalid}"
+        except ValueError:
+            pass
+    
+    print("✅ 阶段调度正常")
+
+def test_pipeline_checkpoints():
+    """测试流水线检查点的续跑和设置变化后的失效"""
+    print("\n💾 测试处理检查点...")
+    
+    try:
+        import pipeline
+    except ImportError:
+        print("⚠️ 未安装应用依赖，跳过检查点测试")
+        return
+    
+    import tempfile
+    import cache_store
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        previous_cache = cache_store._default_cache
+        cache_store._default_cache = cache_store.DiskCache(os.path.join(tmp_dir, "cache.db"))
+        try:
+            job = pipeline.build_job("https://mp.weixin.qq.com/s/checkpoint?chksm=1")
+            assert pipeline.resume_stage(job) is None
+            pipeline.save_checkpoint(job, "extract", "# 原文")
+            assert pipeline.resume_stage(job) == "extract"
+            pipeline.save_checkpoint(job, "images", "# 转存后")
+            assert pipeline.resume_stage(job) == "images"
+            assert pipeline.resume_stage(dict(job, use_cache=False)) is None, "禁用缓存时不从检查点继续"
+            
+            # 只改了改写设置：两个检查点都可以继续使用
+            reprompt = dict(job, custom_prompt="更口语化", compact_prompt=True, deadline_seconds=60)
+            assert pipeline.resume_stage(reprompt) == "images"
+            assert pipeline.load_checkpoint(reprompt, "images") == "# 转存后"
+            
+            # 图片设置变化：只有images检查点失效
+            reimage = dict(job, image_options=dict(job["image_options"], quality=60))
+            assert pipeline.resume_stage(reimage) == "extract"
+            assert pipeline.load_checkpoint(reimage, "extract") == "# 原文"
+            assert pipeline.load_checkpoint(reimage, "images") is None
+            
+            # 提取设置变化：之后的阶段一并失效
+            assert pipeline.resume_stage(dict(job, use_chrome_fallback=False)) is None
+            
+            pipeline.clear_checkpoints(job)
+            assert pipeline.resume_stage(job) is None
+        finally:
+            cache_store._default_cache = previous_cache
+    
+    print("✅ 处理检查点正常")
+
+def test_bulk_rewrite():
+    """测试离线批量改写台账（使用本地模拟服务商）"""
+    print("\n🌙 测试离线批量改写...")
+    
+    import tempfile
+    import cache_store
+    from bulk_rewrite import BulkLedger, BulkRewriter, LocalBatchProvider
+    from history_store import HistoryStore
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        previous_cache = cache_store._default_cache
+        cache_store._default_cache = cache_store.DiskCache(os.path.join(tmp_dir, "cache.db"))
+        try:
+            ledger = BulkLedger(os.path.join(tmp_dir, "bulk.db"))
+            history = HistoryStore(":memory:")
+            rewriter = BulkRewriter(
+                ledger,
+                LocalBatchProvider(rewrite=lambda source: source.replace("原文", "改写")),
+                batch_size=2,
+                prompt_builder=lambda source, custom_prompt: source,
+                history_store=history
+            )
+            for i in range(5):
+                rewriter.enqueue(f"https://mp.weixin.qq.com/s/article{i}", f"# 原文{i}", None)
+            
+            assert len(rewriter.submit_pending()) == 3, "5篇文章按每批2篇应分为3个批次"
+            assert ledger.counts() == {"submitted": 5}
+            assert rewriter.run(poll_interval=0) == {"done": 5, "failed": 0}
+            assert history.count() == 5
+            assert ledger.get_item(1)["result"] == "# 改写0"
+            
+            # 相同原文和指令再次登记时直接复用缓存结果，不再提交
+            rewriter.enqueue("https://mp.weixin.qq.com/s/repost", "# 原文0", None)
+            assert ledger.counts() == {"done": 6} and rewriter.submit_pending() == []
+            # 本地演练的结果不写入交互式改写共用的缓存
+            key = cache_store.make_key("# 原文0", None, False)
+            assert cache_store.get_cache().get(cache_store.REWRITE, key) is None
+        finally:
+            cache_store._default_cache = previous_cache
+    
+    print("✅ 离线批量改写正常")
+
+def test_pipeline_events():
+    """测试流水线事件的顺序（使用模拟的提取、图片和改写函数）"""
+    print("\n📡 测试流水线事件...")
+    
+    try:
+        import app
+        import pipeline
+    except ImportError:
+        print("⚠️ 未安装应用依赖，跳过流水线事件测试")
+        return
+    
+    import tempfile
+    import cache_store
+    import dedup_index
+    import history_store
+    
+    article = "# 测试文章\n\n正文内容。![](https://mmbiz.qpic.cn/a.png)![](https://mmbiz.qpic.cn/b.png)\n" * 20
+    
+    def process_images(markdown_text, *args, on_image=None, **kwargs):
+        for done, url in enumerate(["https://mmbiz.qpic.cn/a.png", "https://mmbiz.qpic.cn/b.png"], 1):
+            on_image(url, url + "?uploaded", done, 2)
+        return markdown_text
+    
+    def rewrite(markdown_text, *args, on_chunk=None, **kwargs):
+        if "失败" in markdown_text:
+            raise Exception("Gemini API调用失败")
+        if on_chunk:
+            on_chunk("改写", "改写")
+            on_chunk("结果", "改写结果")
+        return "改写结果"
+    
+    stubs = {
+        "extract_article": lambda url, *args, **kwargs: article.replace("正文", "失败") if "fail" in url else article,
+        "process_images_with_cloudinary": process_images,
+        "rewrite_with_gemini": rewrite,
+    }
+    previous = {name: getattr(app, name) for name in stubs}
+    previous_store = history_store.HistoryStore
+    previous_cache, previous_index = cache_store._default_cache, dedup_index._default_index
+    
+    def kinds(events):
+        return [type(event).__name__ for event in events]
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, stub in stubs.items():
+            setattr(app, name, stub)
+        history_store.HistoryStore = lambda: previous_store(os.path.join(tmp_dir, "history.db"))
+        cache_store._default_cache = cache_store.DiskCache(os.path.join(tmp_dir, "cache.db"))
+        dedup_index._default_index = dedup_index.DuplicateIndex(os.path.join(tmp_dir, "cache.db"))
+        try:
+            job = pipeline.build_job("https://mp.weixin.qq.com/s/events", repair_structure=False)
+            events = list(pipeline.stream_pipeline(job))
+            assert kinds(events) == ["Extracted", "ImageDone", "ImageDone", "RewriteChunk", "RewriteChunk", "Finished"]
+            assert events[2].done == 2 and events[-2].content == "改写结果"
+            assert events[-1].result["content"] == "改写结果" and events[-1].result["error"] is None
+            
+            # 近似重复的文章直接结束
+            repost = pipeline.build_job("https://mp.weixin.qq.com/s/repost", repair_structure=False)
+            events = list(pipeline.stream_pipeline(repost))
+            assert kinds(events) == ["Extracted", "Finished"]
+            assert events[-1].result["duplicate_of"] == job["url"]
+            
+            # 失败时也以Finished结束
+            failing = pipeline.build_job("https://mp.weixin.qq.com/s/fail", repair_structure=False)
+            events = list(pipeline.stream_pipeline(failing))
+            assert kinds(events) == ["Extracted", "ImageDone", "ImageDone", "Finished"]
+            assert "Gemini API调用失败" in events[-1].result["error"]
+            
+            # 没有事件订阅者时不使用流式接口
+            assert pipeline.run_pipeline(dict(failing, url="https://mp.weixin.qq.com/s/plain"))["content"] == "改写结果"
+        finally:
+            for name, function in previous.items():
+                setattr(app, name, function)
+            history_store.HistoryStore = previous_store
+            cache_store._default_cache, dedup_index._default_index = previous_cache, previous_index
+    
+    print("✅ 流水线事件顺序正常")
+
+def test_firecrawl_batch():
+    """测试Firecrawl批量抓取（使用模拟的HTTP会话）"""
+    print("\n📥 测试Firecrawl批量抓取...")
+    
+    try:
+        import firecrawl_client
+        import pipeline
+    except ImportError:
+        print("⚠️ 未安装应用依赖，跳过Firecrawl批量抓取测试")
+        return
+    
+    import tempfile
+    import cache_store
+    
+    class FakeResponse:
+        def __init__(self, data):
+            self.data = data
+        
+        def raise_for_status(self):
+            pass
+        
+        def json(self):
+            return self.data
+    
+    class FakeSession:
+        def __init__(self, pages):
+            self.pages = list(pages)
+            self.posted = []
+            self.fetched = []
+        
+        def post(self, url, json=None, headers=None, timeout=None):
+            self.posted.append((url, json))
+            return FakeResponse({"success": True, "id": "job-1"})
+        
+        def get(self, url, headers=None, timeout=None):
+            self.fetched.append(url)
+            return FakeResponse(self.pages.pop(0))
+    
+    api = firecrawl_client.API_BASE
+    session = FakeSession([
+        {"status": "scraping"},
+        {"status": "completed", "next": f"{api}/batch/scrape/job-1?skip=1",
+         "data": [{"markdown": "# 甲", "metadata": {"sourceURL": "https://example.com/a"}}]},
+        {"status": "completed",
+         "data": [{"markdown": "# 乙", "metadata": {"url": "https://example.com/b"}},
+                  {"markdown": "", "metadata": {"sourceURL": "https://example.com/c"}},
+                  {"markdown": "# 无关", "metadata": {"sourceURL": "https://example.com/other"}}]},
+    ])
+    previous_session = firecrawl_client._session
+    firecrawl_client._session = session
+    try:
+        urls = ["https://example.com/a", "https://example.com/b", "https://example.com/c", "https://example.com/a"]
+        results = firecrawl_client.batch_scrape(urls, "fc-key", poll_interval=0)
+    finally:
+        firecrawl_client._session = previous_session
+    
+    assert session.posted == [(f"{api}/batch/scrape", {
+        "formats": ["markdown"], "onlyMainContent": True,
+        "urls": ["https://example.com/a", "https://example.com/b", "https://example.com/c"]
+    })], "只请求正文Markdown，重复URL只提交一次"
+    assert session.fetched[-1].endswith("?skip=1"), "应按next继续读取下一页"
+    assert results == {"https://example.com/a": "# 甲", "https://example.com/b": "# 乙", "https://example.com/c": None}
+    
+    # 公众号文章走静态HTML解析，不参与批量抓取
+    submitted = []
+    batch_scrape = firecrawl_client.batch_scrape
+    firecrawl_client.batch_scrape = lambda urls, api_key: submitted.extend(urls) or {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        previous_cache = cache_store._default_cache
+        cache_store._default_cache = cache_store.DiskCache(os.path.join(tmp_dir, "cache.db"))
+        try:
+            jobs = [pipeline.build_job(f"https://example.com/post{i}", firecrawl_key="fc-key") for i in range(3)]
+            jobs += [pipeline.build_job(f"https://mp.weixin.qq.com/s/post{i}", firecrawl_key="fc-key") for i in range(3)]
+            pipeline.prefetch_extractions(jobs, min_urls=1)
+        finally:
+            cache_store._default_cache = previous_cache
+            firecrawl_client.batch_scrape = batch_scrape
+    assert submitted == [f"https://example.com/post{i}" for i in range(3)]
+    
+    print("✅ Firecrawl批量抓取正常")
+
+def test_image_tokens():
+    """测试图片占位链接的替换与还原"""
+    print("\n🔖 测试图片占位链接...")
+    
+    try:
+        import app
+    except ImportError:
+        print("⚠️ 未安装应用依赖，跳过图片占位链接测试")
+        return
+    
+    markdown = (
+        "![a](https://mmbiz.qpic.cn/a.png) 正文 ![b](https://mmbiz.qpic.cn/b.png)\n"
+        "<img src=\"https://mmbiz.qpic.cn/a.png\"> ![c][ref]\n\n"
+        "[ref]: https://mmbiz.qpic.cn/c.png\n"
+        "正文提到 https://mmbiz.qpic.cn/a.png 不是图片"
+    )
+    tokenized, token_map = app.tokenize_image_urls(markdown)
+    assert sorted(token_map.values()) == [
+        "https://mmbiz.qpic.cn/a.png", "https://mmbiz.qpic.cn/b.png", "https://mmbiz.qpic.cn/c.png"
+    ]
+    assert all(token.startswith(app.IMAGE_TOKEN_PREFIX) for token in token_map)
+    assert tokenized.count(app.IMAGE_TOKEN_PREFIX) == 4
+    assert "正文提到 https://mmbiz.qpic.cn/a.png 不是图片" in tokenized
+    
+    # 不传上传结果时原样还原
+    assert app.restore_image_tokens(tokenized, token_map) == markdown
+    
+    # 上传成功的换成新链接，上传失败的回退到原链接
+    uploaded = {"https://mmbiz.qpic.cn/a.png": "https://res.cloudinary.com/x/a.webp"}
+    restored = app.restore_image_tokens(tokenized, token_map, uploaded)
+    assert restored.count("https://res.cloudinary.com/x/a.webp") == 2
+    assert "![b](https://mmbiz.qpic.cn/b.png)" in restored
+    assert "[ref]: https://mmbiz.qpic.cn/c.png" in restored
+    assert app.IMAGE_TOKEN_PREFIX not in restored
+    
+    # 一个占位符是另一个的前缀时，先替换较长的
+    short_token, long_token = app.IMAGE_TOKEN_PREFIX + "img_1000", app.IMAGE_TOKEN_PREFIX + "img_10000"
+    collision_map = {short_token: "https://x/short.png", long_token: "https://x/long.png"}
+    text = f"![]({short_token}) ![]({long_token})"
+    assert app.restore_image_tokens(text, collision_map) == "![](https://x/short.png) ![](https://x/long.png)"
+    
+    print("✅ 图片占位链接正常")
+
+def test_prefetch():
+    """测试预先提取和提交时的复用"""
+    print("\n⚡ 测试预先提取...")
+    
+    try:
+        import app
+    except ImportError:
+        print("⚠️ 未安装应用依赖，跳过预先提取测试")
+        return
+    
+    import tempfile
+    import threading
+    import time
+    import cache_store
+    import stage_scheduler
+    from article_url import canonicalize
+    from deadline import DeadlineExceeded
+    
+    calls = []
+    
+    def static_html(url, deadline=None):
+        calls.append(url)
+        return "# 预取的正文"
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        previous = (cache_store._default_cache, stage_scheduler._default_scheduler, app.get_content_from_static_html)
+        cache_store._default_cache = cache_store.DiskCache(os.path.join(tmp_dir, "cache.db"))
+        stage_scheduler._default_scheduler = stage_scheduler.StageScheduler(os.path.join(tmp_dir, "scheduler.db"))
+        app.get_content_from_static_html = static_html
+        try:
+            cache = cache_store.get_cache()
+            url = "https://mp.weixin.qq.com/s/prefetch?chksm=1"
+            key = cache_store.make_key(canonicalize(url))
+            
+            assert app.extract_article(url, "", False, speculative=True) == "# 预取的正文"
+            assert app.extract_article(url, "", False, speculative=True) == "# 预取的正文"
+            assert len(calls) == 1, "预取结果应被再次预取复用"
+            assert cache.get(cache_store.EXTRACT, key) is None, "预取结果不应直接写入提取缓存"
+            assert stage_scheduler.get_scheduler().stats("extract")["granted"] == {stage_scheduler.BATCH: 1}, \
+                "预取应走批量通道"
+            
+            assert app.extract_article(url, "", False) == "# 预取的正文" and len(calls) == 1
+            assert cache.get(cache_store.EXTRACT, key) == "# 预取的正文", "提交后应转为正式的提取缓存"
+            assert cache.get(cache_store.PREFETCH, key) is None
+            
+            # 提交时正在等待的预取失败（例如预取的时限已到），提交应重新提取一次而不是直接报错
+            started, release = threading.Event(), threading.Event()
+            
+            def failing_once(url, deadline=None):
+                calls.append(url)
+                if len(calls) == 2:
+                    started.set()
+                    release.wait(5)
+                    raise DeadlineExceeded("预取时限已到")
+                return "# 重新提取的正文"
+            
+            app.get_content_from_static_html = failing_once
+            url = "https://mp.weixin.qq.com/s/retry"
+            results = {}
+            
+            def run(name, speculative):
+                try:
+                    results[name] = app.extract_article(url, "", False, speculative=speculative)
+                except Exception as e:
+                    results[name] = e
+            
+            prefetch = threading.Thread(target=run, args=("prefetch", True))
+            prefetch.start()
+            started.wait(5)
+            submit = threading.Thread(target=run, args=("submit", False))
+            submit.start()
+            flight_key = cache_store.make_key(canonicalize(url))
+            while app._extract_flight._calls[flight_key].waiters == 0:
+                time.sleep(0.01)
+            release.set()
+            prefetch.join(5)
+            submit.join(5)
+            
+            assert isinstance(results["prefetch"], DeadlineExceeded), "预取自身应收到原始异常"
+            assert results["submit"] == "# 重新提取的正文"
+            
+            # 提交等待的预取还在批量通道排队时，预取改到交互通道，排在积压的批量任务之前
+            scheduler = stage_scheduler.StageScheduler(os.path.join(tmp_dir, "promote.db"), capacity={"extract": 1})
+            stage_scheduler._default_scheduler = scheduler
+            order = []
+            app.get_content_from_static_html = lambda url, deadline=None: order.append("prefetch") or "# 正文"
+            holder = scheduler.acquire("extract", stage_scheduler.BATCH)
+            
+            def backlog():
+                with scheduler.slot("extract", stage_scheduler.BATCH):
+                    order.append("backlog")
+            
+            backlog_thread = threading.Thread(target=backlog)
+            backlog_thread.start()
+            while scheduler.stats("extract")["waiting"].get(stage_scheduler.BATCH, 0) < 1:
+                time.sleep(0.01)
+            url = "https://mp.weixin.qq.com/s/promote"
+            flight_key = cache_store.make_key(canonicalize(url))
+            prefetch = threading.Thread(target=run, args=("prefetch", True))
+            prefetch.start()
+            while flight_key not in app._prefetch_promotions:
+                time.sleep(0.01)
+            submit = threading.Thread(target=run, args=("submit", False))
+            submit.start()
+            while scheduler.stats("extract")["waiting"].get(stage_scheduler.INTERACTIVE, 0) < 1:
+                time.sleep(0.01)
+            scheduler.release(holder)
+            for thread in (prefetch, submit, backlog_thread):
+                thread.join(5)
+            
+            assert results["submit"] == "# 正文"
+            assert order == ["prefetch", "backlog"], "被提交等待的预取应先于批量任务获得槽位"
+            assert scheduler.stats("extract")["granted"].get(stage_scheduler.INTERACTIVE) == 1
+        finally:
+            cache_store._default_cache, stage_scheduler._default_scheduler, app.get_content_from_static_html = previous
+    
+    print("✅ 预先提取正常")
+
 def check_configuration_template():
     """检查配置模板"""
     print("\n⚙️ 检查配置模板...")
@@ -124,6 +1203,26 @@ def main():
     images = test_image_extraction()
     test_content_processing()
     test_api_structure()
+    test_prompt_compaction()
+    test_markdown_scanner()
+    test_wechat_html()
+    test_image_optimizer()
+    test_rewrite_validation()
+    test_history_store()
+    test_client_cache()
+    test_disk_cache()
+    test_duplicate_index()
+    test_memory_bounded()
+    test_url_canonicalization()
+    test_single_flight()
+    test_deadline()
+    test_stage_scheduler()
+    test_pipeline_checkpoints()
+    test_bulk_rewrite()
+    test_pipeline_events()
+    test_firecrawl_batch()
+    test_image_tokens()
+    test_prefetch()
     check_configuration_template()
     
     print("\n" + "=" * 50)
@@ -0,0 +1,225 @@
+"""
+公众号文章HTML解析模块
+公众号文章的正文直接输出在首屏HTML的 #js_content 中，无需渲染即可提取。
+本模块用标准库html.parser把正文转换为Markdown，并识别验证页、已删除等无法直接提取的页面
+"""
+import html
+import re
+from html.parser import HTMLParser
+from typing import List, Optional, Tuple
+
+
+CONTENT_ID = "js_content"
+
+# 出现这些标记说明拿到的是验证页或提示页，而不是文章
+_BLOCKED_MARKERS = [
+    ("环境异常", "触发了环境异常验证"),
+    ("完成验证后即可继续访问", "需要完成人机验证"),
+    ("wappoc_appmsgcaptcha", "需要完成人机验证"),
+    ("该内容已被发布者删除", "文章已被发布者删除"),
+    ("此内容因违规无法查看", "文章因违规无法查看"),
+    ("此内容被多人投诉", "文章被投诉无法查看"),
+]
+_TITLE_PATTERNS = [
+    re.compile(r'<meta\s+property="og:title"\s+content="([^"]*)"', re.IGNORECASE),
+    re.compile(r"var\s+msg_title\s*=\s*'([^']*)'"),
+]
+
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+_BLOCK_TAGS = {"p", "div", "section", "blockquote", "ul", "ol", "li", "pre", "table", "tr",
+               "h1", "h2", "h3", "h4", "h5", "h6", "figure", "figcaption", "hr"}
+_SKIP_TAGS = {"script", "style", "noscript", "iframe", "svg", "mpvoice", "mpvideo"}
+
+
+class _ContentParser(HTMLParser):
+    """只转换 id="js_content" 元素内部的HTML"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        # 正文内未闭合的元素 [(标签, 是否在跳过的元素内)]，第一个是正文元素本身，为空表示不在正文中。
+        # 公众号HTML常省略</p>、</li>，按元素栈匹配结束标签，正文元素结束时栈内剩余的元素一并关闭
+        self.stack: List[Tuple[str, bool]] = []
+        self.found = False
+        self.blocks: List[str] = []
+        self.line: List[str] = []
+        self.prefix = ""
+        self.list_stack: List[List] = []  # [[类型, 序号]]
+        self.quote_depth = 0
+        self.in_pre = False
+        self.link_href: Optional[str] = None
+
+    def handle_starttag(self, tag, attrs):
+        attributes = dict(attrs)
+        if not self.stack:
+            if attributes.get("id") == CONTENT_ID and not self.found:
+                self.found = True
+                self.stack.append((tag, False))
+            return
+        self._close_implied(tag)
+        skipped = self.stack[-1][1] or tag in _SKIP_TAGS
+        if tag not in _VOID_TAGS:
+            self.stack.append((tag, skipped))
+        if skipped:
+            return
+
+        if tag in _BLOCK_TAGS:
+            self._flush()
+        if tag in ("h1", "h2", "h3", "h4", "h5", "h6"):
+            self.prefix = "#" * int(tag[1]) + " "
+        elif tag in ("ul", "ol"):
+            self.list_stack.append([tag, 0])
+        elif tag == "li" and self.list_stack:
+            self.list_stack[-1][1] += 1
+            kind, number = self.list_stack[-1]
+            indent = "  " * (len(self.list_stack) - 1)
+            self.prefix = f"{indent}{number}. " if kind == "ol" else f"{indent}- "
+        elif tag == "blockquote":
+            self.quote_depth += 1
+        elif tag == "pre":
+            self.in_pre = True
+        elif tag == "br":
+            self._flush()
+        elif tag == "hr":
+            self.blocks.append("---")
+        elif tag in ("strong", "b"):
+            self.line.append("**")
+        elif tag in ("em", "i"):
+            self.line.append("*")
+        elif tag == "code" and not self.in_pre:
+            self.line.append("`")
+        elif tag == "a":
+            self.link_href = attributes.get("href")
+            if self.link_href:
+                self.line.append("[")
+        elif tag == "img":
+            # 懒加载图片的真实地址在data-src中
+            src = attributes.get("data-src") or attributes.get("src")
+            if src and not src.startswith("data:"):
+                alt = (attributes.get("alt") or "").replace("]", "")
+                self.line.append(f"![{alt}]({src})")
+
+    def _close_implied(self, tag):
+        """按HTML规则关闭省略了结束标签的元素：块级元素开始时关闭<p>，新的<li>关闭同一列表中的上一个<li>"""
+        if tag in _BLOCK_TAGS and len(self.stack) > 1 and self.stack[-1][0] == "p":
+            self._pop_until("p")
+        elif tag == "li":
+            for open_tag, _ in reversed(self.stack[1:]):
+                if open_tag in ("ul", "ol"):
+                    break
+                if open_tag == "li":
+                    self._pop_until("li")
+                    break
+
+    def _pop_until(self, tag):
+        """关闭栈顶到最近一个tag元素之间的所有元素"""
+        while self.stack:
+            open_tag, skipped = self.stack.pop()
+            if not self.stack:
+                # 正文元素结束，之后的页面内容（二维码、页脚等）不再转换
+                self._flush()
+                return
+            if not skipped:
+                self._end_element(open_tag)
+            if open_tag == tag:
+                return
+
+    def handle_endtag(self, tag):
+        if not self.stack or tag in _VOID_TAGS:
+            return
+        # 没有对应开始标签的结束标签直接忽略
+        if any(open_tag == tag for open_tag, _ in self.stack):
+            self._pop_until(tag)
+
+    def _end_element(self, tag):
+        if tag in ("strong", "b"):
+            self.line.append("**")
+        elif tag in ("em", "i"):
+            self.line.append("*")
+        elif tag == "code" and not self.in_pre:
+            self.line.append("`")
+        elif tag == "a":
+            if self.link_href:
+                self.line.append(f"]({self.link_href})")
+            self.link_href = None
+        elif tag in ("ul", "ol") and self.list_stack:
+            self.list_stack.pop()
+        if tag in _BLOCK_TAGS:
+            if tag == "pre":
+                code = "".join(self.line).strip("\n")
+                self.line = []
+                if code:
+                    self.blocks.append(f"```\n{code}\n```")
+                self.in_pre = False
+            else:
+                self._flush()
+            if tag == "blockquote":
+                self.quote_depth = max(0, self.quote_depth - 1)
+
+    def handle_data(self, data):
+        if not self.stack or self.stack[-1][1]:
+            return
+        if self.in_pre:
+            self.line.append(data)
+        else:
+            self.line.append(re.sub(r"\s+", " ", data))
+
+    def _flush(self):
+        if self.in_pre:
+            return
+        text = "".join(self.line).strip()
+        self.line = []
+        # 只有格式标记没有文字的片段（例如空的<strong></strong>）直接丢弃
+        if not text.replace("*", "").replace("`", "").strip():
+            self.prefix = ""
+            return
+        text = self.prefix + text
+        if self.quote_depth:
+            text = "> " * self.quote_depth + text
+        self.blocks.append(text)
+        self.prefix = ""
+
+
+def detect_blocked(page_html: str) -> Optional[str]:
+    """
+    判断页面是否为验证页、删除提示页等非文章页面
+
+    Returns:
+        原因描述；是正常文章页面时返回None
+    """
+    for marker, reason in _BLOCKED_MARKERS:
+        if marker in page_html:
+            return reason
+    return None
+
+
+def extract_title(page_html: str) -> str:
+    """从og:title或页面脚本中的msg_title读取标题"""
+    for pattern in _TITLE_PATTERNS:
+        match = pattern.search(page_html)
+        if match and match.group(1).strip():
+            return html.unescape(match.group(1)).strip()
+    return ""
+
+
+def parse_article(page_html: str) -> Tuple[str, str]:
+    """
+    把公众号文章页面的正文转换为Markdown
+
+    Args:
+        page_html: 文章页面的完整HTML
+
+    Returns:
+        (标题, 正文Markdown)；找不到正文元素时正文为空字符串
+    """
+    parser = _ContentParser()
+    parser.feed(page_html)
+    parser.close()
+    return extract_title(page_html), "\n\n".join(parser.blocks)
+
+
+def to_markdown(page_html: str) -> str:
+    """转换为带一级标题的完整Markdown文档；正文为空时返回空字符串"""
+    title, body = parse_article(page_html)
+    if not body:
+        return ""
+    return f"# {title}\n\n{body}" if title else body
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+多进程工作池模块
+启动N个流水线工作进程并行处理文章，绕开单进程的GIL和阻塞调用限制。
+各进程通过磁盘缓存（cache_store）共享提取、图片和改写结果
+
+用法:
+    python worker_pool.py urls.txt --workers 4
+    python worker_pool.py urls.txt --prompt-file prompt.txt --no-chrome
+    python worker_pool.py urls.txt --firecrawl-batch   # 大批量非公众号文章先整批提交给Firecrawl
+    python worker_pool.py urls.txt --deadline 120      # 每篇文章最多处理120秒，0为不限制
+    python worker_pool.py urls.txt --low-memory        # 超长文章按章节分段改写，降低内存峰值
+    python worker_pool.py urls.txt --owner <标识>      # 结果显示在页面上该历史记录标识的处理历史中
+
+API密钥从环境变量读取: FIRECRAWL_API_KEY、GEMINI_API_KEY、
+CLOUDINARY_CLOUD_NAME、CLOUDINARY_API_KEY、CLOUDINARY_API_SECRET
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, Future, as_completed
+from typing import Dict, Any, Iterable, Iterator, Optional
+
+import pipeline
+import stage_scheduler
+from deadline import Deadline
+
+
+def _init_worker():
+    """
+    工作进程初始化：工作进程没有页面上下文，屏蔽Streamlit的相关提示日志；
+    各阶段按批量通道排队，页面上提交的文章优先获得服务商并发
+    """
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    stage_scheduler.set_default_lane(stage_scheduler.BATCH)
+
+
+class PipelineWorkerPool:
+    """流水线工作进程池，任务从本地队列分发给各工作进程"""
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or os.cpu_count() or 1
+        # 使用spawn启动，避免从带有线程的Streamlit进程fork出不一致的子进程
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker
+        )
+
+    def submit(self, job: Dict[str, Any]) -> Future:
+        """提交一个任务，返回结果为pipeline.run_pipeline返回值的Future"""
+        return self._executor.submit(pipeline.run_pipeline, job)
+
+    def run(self, jobs: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """提交一批任务，按完成顺序逐个产出结果"""
+        futures = [self.submit(job) for job in jobs]
+        for future in as_completed(futures):
+            yield future.result()
+
+    def shutdown(self, wait: bool = True):
+        """关闭工作池"""
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(wait=exc_type is None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="使用多进程工作池批量处理公众号文章")
+    parser.add_argument("url_file", help="每行一个文章URL的文本文件")
+    parser.add_argument("--workers", type=int, default=None, help="工作进程数，默认等于CPU核数")
+    parser.add_argument("--prompt-file", default=None, help="自定义改写指令文件")
+    parser.add_argument("--no-chrome", action="store_true", help="禁用Chrome DevTools MCP降级")
+    parser.add_argument("--no-fast-load", action="store_true", help="Chrome降级时加载完整页面（不拦截图片等资源）")
+    parser.add_argument("--no-cache", action="store_true", help="不读取缓存，强制重新处理")
+    parser.add_argument("--firecrawl-batch", action="store_true",
+                        help="先用Firecrawl批量接口一次性抓取未缓存的文章；公众号文章仍直接解析静态HTML，不参与批量抓取")
+    parser.add_argument("--deadline", type=float, default=Deadline.DEFAULT_BUDGET,
+                        help="单篇文章的处理时限（秒），时限将到时跳过剩余图片转存；0为不限制")
+    parser.add_argument("--low-memory", action="store_true",
+                        help="按章节分段改写，处理超长文章时内存峰值与分段大小相关，而不是整篇文章")
+    parser.add_argument("--owner", default=os.environ.get("WRITERE_HISTORY_OWNER", ""),
+                        help="历史记录标识（页面处理历史中显示），结果会出现在该标识的处理历史中")
+    args = parser.parse_args()
+
+    with open(args.url_file, "r", encoding="utf-8") as f:
+        urls = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+    custom_prompt = None
+    if args.prompt_file:
+        with open(args.prompt_file, "r", encoding="utf-8") as f:
+            custom_prompt = f.read().strip() or None
+
+    jobs = [
+        pipeline.build_job_from_env(
+            url,
+            custom_prompt=custom_prompt,
+            use_chrome_fallback=not args.no_chrome,
+            chrome_fast_load=not args.no_fast_load,
+            use_cache=not args.no_cache,
+            deadline_seconds=args.deadline,
+            low_memory=args.low_memory,
+            owner=args.owner
+        )
+        for url in urls
+    ]
+
+    print(f"🚀 使用 {args.workers or os.cpu_count()} 个工作进程处理 {len(jobs)} 篇文章")
+    print("=" * 50)
+
+    started = time.perf_counter()
+    if args.firecrawl_batch:
+        try:
+            prefetched = pipeline.prefetch_extractions(jobs)
+            print(f"📥 Firecrawl批量抓取完成，预取 {prefetched} 篇文章（{time.perf_counter() - started:.1f}s）")
+        except Exception as e:
+            print(f"⚠️ Firecrawl批量抓取失败，改为逐篇提取: {e}")
+
+    succeeded = 0
+    with PipelineWorkerPool(args.workers) as pool:
+        for result in pool.run(jobs):
+            timings = ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in result["timings"].items())
+            if result["error"]:
+                print(f"❌ {result['url']}: {result['error']}")
+            elif result["duplicate_of"]:
+                succeeded += 1
+                print(f"🔁 {result['url']} 与 {result['duplicate_of']} 近似重复，复用改写结果 → 历史记录 #{result['history_id']}")
+            else:
+                succeeded += 1
+                print(f"✅ {result['url']} → 历史记录 #{result['history_id']} ({timings})")
+
+    elapsed = time.perf_counter() - started
+    print("=" * 50)
+    print(f"📊 完成 {succeeded}/{len(jobs)} 篇，总耗时 {elapsed:.1f}s")
+    return 0 if succeeded == len(jobs) else 1
+
+
+if __name__ == "__main__":
+    exit(main())